@@ -0,0 +1,647 @@
+import argparse
+import heapq
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+from contextlib import redirect_stdout
+import random
+import socket
+import time
+import tracemalloc
+
+import dpkt
+
+from bpf_filter import compile_filter
+from buffered_pcap import BufferedPcapWriter
+from ctf_part2 import CaptureIndex
+from fast_decode import decode_frame, decode_payload
+from flow_report import EXTENSIONS, PORT_BITS, REPORT_FORMATS, SORT_FIELDS, ranked
+from mmap_pcap import GLOBAL_HEADER_LEN, MmapPcapReader
+from packet_ring import SO_TIMESTAMPNS, TIMESTAMP_ANCDATA_SIZE, kernel_timestamp
+from payload_search import PayloadPatterns, search_pcap
+from python_sniffer import FlowTable, PackedFlowTable, PacketSniffer, analyze_chunk
+
+
+def synthetic_frames(count, flows=4096, seed=0):
+    """Yields `count` Ethernet frames drawn from a fixed pool of TCP/UDP flows."""
+    rng = random.Random(seed)
+    templates = []
+    for i in range(flows):
+        src = socket.inet_aton(f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}")
+        dst = socket.inet_aton(f"172.16.{rng.randint(0, 255)}.{rng.randint(1, 254)}")
+        payload = b"x" * rng.choice([0, 64, 512, 1400])
+        if i % 4:
+            l4 = dpkt.tcp.TCP(sport=1024 + i % 60000, dport=443, flags=dpkt.tcp.TH_ACK, data=payload)
+            proto = dpkt.ip.IP_PROTO_TCP
+        else:
+            l4 = dpkt.udp.UDP(sport=1024 + i % 60000, dport=53, data=payload)
+            l4.ulen = len(l4)
+            proto = dpkt.ip.IP_PROTO_UDP
+        ip = dpkt.ip.IP(src=src, dst=dst, p=proto, ttl=64, data=l4)
+        ip.len = len(ip)
+        eth = dpkt.ethernet.Ethernet(src=b"\x02" * 6, dst=b"\x04" * 6, type=dpkt.ethernet.ETH_TYPE_IP, data=ip)
+        templates.append(bytes(eth))
+
+    for n in range(count):
+        # Fresh copy per frame, like sock.recv() allocates
+        yield memoryview(templates[n % flows]).tobytes()
+
+
+def current_rss_kb():
+    # Linux only, reads the resident set size of this process
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+class NullWriter:
+    def writepkt(self, packet, ts=None):
+        pass
+
+
+def bench_memory(args):
+    sniffer = PacketSniffer()
+    writer = NullWriter()
+    checkpoints = {args.packets * step // 4 for step in range(1, 5)}
+
+    # The live-stats line is printed once per second, keep it out of the measurement
+    start = time.perf_counter()
+    samples = []
+    with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+        for n, frame in enumerate(synthetic_frames(args.packets, args.flows), 1):
+            sniffer.packet_callback(frame, writer)
+            if n in checkpoints:
+                samples.append((n, current_rss_kb()))
+    elapsed = time.perf_counter() - start
+
+    print(f"packets={args.packets} flows={args.flows} "
+          f"time={elapsed:.2f}s ({args.packets / elapsed:.0f} pkt/s)")
+    for n, rss in samples:
+        print(f"  after {n:>10} packets: RSS {rss / 1024:.1f} MiB")
+
+
+def bench_pcap_readers(args):
+    # Each reader walks every record and touches the frame length, as the sniffer would
+    def read_mmap():
+        with MmapPcapReader(args.file) as reader:
+            return sum(len(packet) for _, packet in reader)
+
+    def read_dpkt():
+        with open(args.file, 'rb') as f:
+            return sum(len(packet) for _, packet in dpkt.pcap.Reader(f))
+
+    def read_scapy():
+        from scapy.all import rdpcap
+        return sum(len(packet.original) for packet in rdpcap(args.file))
+
+    readers = [('mmap', read_mmap), ('dpkt.pcap.Reader', read_dpkt)]
+    try:
+        import scapy  # noqa: F401
+        readers.append(('scapy rdpcap', read_scapy))
+    except ImportError:
+        print("scapy not installed, skipping rdpcap")
+
+    for name, reader in readers:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            total = reader()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:>18}: {best:.3f}s best of {args.repeat} ({total} bytes of frames)")
+
+
+def bench_parallel(args):
+    # Serial aggregation of the whole file is the reference every worker count must match
+    with MmapPcapReader(args.file) as reader:
+        size = len(reader)
+    start = time.perf_counter()
+    reference = analyze_chunk(args.file, GLOBAL_HEADER_LEN, size)
+    serial = time.perf_counter() - start
+    print(f"serial: {serial:.2f}s ({reference.packet_count} packets, {len(reference.flow_table)} flows)")
+
+    for workers in args.workers:
+        sniffer = PacketSniffer()
+        sniffer.loop_analysis_tasks = lambda path: None  # Skip the interactive menu
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+            sniffer.analyze_pcap_parallel(args.file, workers)
+        elapsed = time.perf_counter() - start
+        identical = (sniffer.flow_table.flows == reference.flow_table.flows
+                     and sniffer.size_stats.buckets == reference.size_stats.buckets)
+        print(f"{workers:>2} workers: {elapsed:.2f}s speedup {serial / elapsed:.2f}x identical={identical}")
+
+
+def blast_frames(interface, deadline, rate=None):
+    # Sender process: writes synthetic frames into one end of the veth pair as fast as it can,
+    # or paced to `rate` frames per second
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    sock.bind((interface, 0))
+    frames = list(synthetic_frames(1024, flows=1024))
+    sent = 0
+    start = time.time()
+    while time.time() < deadline:
+        for frame in frames:
+            try:
+                sock.send(frame)
+            except OSError:
+                pass  # Transmit queue full, keep going
+            sent += 1
+            if rate and sent % 64 == 0:
+                ahead = start + sent / rate - time.time()
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+def bench_capture(args):
+    # Needs root: builds a veth pair, floods one end and captures on the other with each backend
+    sender_end, capture_end = 'snifbench0', 'snifbench1'
+    subprocess.run(['ip', 'link', 'add', sender_end, 'type', 'veth', 'peer', 'name', capture_end], check=True)
+    try:
+        for interface in (sender_end, capture_end):
+            subprocess.run(['ip', 'link', 'set', interface, 'up'], check=True)
+
+        for backend in args.backends:
+            sniffer = PacketSniffer()
+            sniffer.loop_analysis_tasks = lambda path: None  # Skip the interactive menu
+            sender = multiprocessing.Process(target=blast_frames,
+                                             args=(sender_end, time.time() + args.duration + 1))
+            sender.start()
+            before = resource.getrusage(resource.RUSAGE_SELF)
+            with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+                sniffer.start_sniffing(capture_end, args.duration, None, backend, args.pipeline)
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            sender.join()
+
+            cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+            print(f"{backend:>5}: captured {sniffer.packet_count} packets "
+                  f"({sniffer.packet_count / args.duration:.0f} pkt/s), kernel saw {sniffer.kernel_packets}, "
+                  f"dropped {sniffer.kernel_drops}, CPU {cpu:.2f}s")
+            if sniffer.pipeline:
+                print(f"       pipeline drops {sniffer.pipeline.drops}")
+    finally:
+        subprocess.run(['ip', 'link', 'del', sender_end])
+
+
+def interface_rx_packets(interface):
+    with open(f"/sys/class/net/{interface}/statistics/rx_packets") as f:
+        return int(f.read())
+
+
+def bench_filter(args):
+    # Needs root: captures the same mixed TCP/UDP flood with and without a kernel BPF filter
+    program, compiler = compile_filter(args.expression, 'lo')
+    print(f"filter {args.expression!r}: {len(program)} instructions ({compiler})")
+    sender_end, capture_end = 'snifbench0', 'snifbench1'
+    subprocess.run(['ip', 'link', 'add', sender_end, 'type', 'veth', 'peer', 'name', capture_end], check=True)
+    try:
+        for interface in (sender_end, capture_end):
+            subprocess.run(['ip', 'link', 'set', interface, 'up'], check=True)
+
+        for label, capture_filter in (('unfiltered', None), ('filtered', program)):
+            sniffer = PacketSniffer()
+            sniffer.loop_analysis_tasks = lambda path: None  # Skip the interactive menu
+            sender = multiprocessing.Process(target=blast_frames,
+                                             args=(sender_end, time.time() + args.duration + 1, args.rate))
+            offered = interface_rx_packets(capture_end)
+            sender.start()
+            before = resource.getrusage(resource.RUSAGE_SELF)
+            with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+                sniffer.start_sniffing(capture_end, args.duration, None, args.backend, capture_filter=capture_filter)
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            sender.join()
+            offered = interface_rx_packets(capture_end) - offered
+
+            user = after.ru_utime - before.ru_utime
+            system = after.ru_stime - before.ru_stime
+            print(f"{label:>10}: link carried {offered} frames, delivered {sniffer.packet_count} "
+                  f"({sniffer.packet_count / max(offered, 1):.0%}), dropped {sniffer.kernel_drops}, "
+                  f"user CPU {user:.2f}s, system CPU {system:.2f}s, "
+                  f"user CPU per link frame {user / max(offered, 1) * 1e6:.2f} us")
+    finally:
+        subprocess.run(['ip', 'link', 'del', sender_end])
+
+
+def dpkt_five_tuple(packet):
+    # The per-packet decode parse_packet used before fast_decode, kept as the reference
+    try:
+        eth = dpkt.ethernet.Ethernet(packet)
+        if isinstance(eth.data, dpkt.ip.IP):
+            ip = eth.data
+            if isinstance(ip.data, (dpkt.tcp.TCP, dpkt.udp.UDP)):
+                return ip.p, ip.src, ip.data.sport, ip.dst, ip.data.dport
+            return ip.p, ip.src, None, ip.dst, None
+    except Exception:
+        pass
+    return None
+
+
+def fast_five_tuple(packet):
+    decoded = decode_frame(packet)
+    if decoded is not None and decoded[0] == 4:
+        return decoded[1], decoded[2], decoded[4], decoded[3], decoded[5]
+    return None
+
+
+def bench_decode(args):
+    with MmapPcapReader(args.file) as reader:
+        frames = [bytes(packet) for _, packet in reader]
+
+    results = {}
+    for name, decode in [('dpkt', dpkt_five_tuple), ('fast_decode', fast_five_tuple)]:
+        start = time.perf_counter()
+        tuples = [decode(frame) for frame in frames]
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed, tuples)
+        print(f"{name:>12}: {elapsed / len(frames) * 1e9:.0f} ns/packet ({len(frames) / elapsed:.0f} pkt/s)")
+
+    (dpkt_time, dpkt_tuples), (fast_time, fast_tuples) = results['dpkt'], results['fast_decode']
+    mismatches = sum(1 for a, b in zip(dpkt_tuples, fast_tuples) if a != b)
+    print(f"speedup {dpkt_time / fast_time:.1f}x, {mismatches} packets decoded differently")
+
+
+def scapy_ctf_answers(path):
+    # ctf_part2.py before the index: rdpcap, then one full scan per question with payloads decoded each time
+    from scapy.all import IP, TCP, Raw, rdpcap
+    packets = rdpcap(path)
+
+    my_ip = None
+    for packet in packets:
+        if packet.haslayer(TCP) and packet.haslayer(Raw):
+            payload = packet[Raw].load.decode(errors='ignore')
+            if "ip address" in payload:
+                start = payload.find("ip address =") + len("ip address =")
+                my_ip = payload[start:payload.find(">", start)].strip()[1:]
+                break
+
+    ip_packets = None
+    if my_ip:
+        ip_packets = sum(1 for packet in packets
+                         if packet.haslayer(IP) and my_ip in (packet[IP].src, packet[IP].dst))
+
+    laptop = checksum = None
+    for packet in packets:
+        if packet.haslayer(TCP) and packet.haslayer(Raw):
+            payload = packet[Raw].load.decode(errors='ignore')
+            index = payload.find("name of laptop")
+            if index != -1:
+                laptop, checksum = payload[index + len("laptop"): index + len("laptop") + 30], packet[TCP].chksum
+                break
+
+    orders = sum(1 for packet in packets
+                 if packet.haslayer(Raw) and "Order Successful" in packet[Raw].load.decode(errors='ignore'))
+    return my_ip, ip_packets, laptop, checksum, orders
+
+
+def bench_ctf(args):
+    # The index runs first: ru_maxrss only grows, so its peak is not hidden under rdpcap's
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    index = CaptureIndex.build(args.file)
+    my_ip = index.my_ip_address()
+    laptop, checksum = index.laptop_name_and_checksum()
+    indexed = (my_ip, index.packets_with_ip(my_ip) if my_ip else None, laptop, checksum,
+               index.order_successful_packets())
+    index_time = time.perf_counter() - start
+    index_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print(f"single-pass index: {index_time:.2f}s for {index.packets} packets, peak RSS +{index_peak / 1024:.1f} MiB")
+    if args.skip_scapy:
+        print(f"answers: {indexed}")
+        return
+
+    start = time.perf_counter()
+    reference = scapy_ctf_answers(args.file)
+    scapy_time = time.perf_counter() - start
+    scapy_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print(f"rdpcap + four scans: {scapy_time:.2f}s, peak RSS +{scapy_peak / 1024:.1f} MiB")
+    print(f"speedup {scapy_time / index_time:.1f}x, identical answers: {indexed == reference}")
+    if indexed != reference:
+        print(f"  index:  {indexed}\n  scapy:  {reference}")
+
+
+def find_per_packet(path, patterns):
+    # The ctf_part2.py way: every payload decoded to str and searched once per pattern, segments on their own
+    texts = [pattern.decode(errors='ignore') for pattern in patterns]
+    hits = 0
+    with MmapPcapReader(path) as reader:
+        for _, frame in reader:
+            decoded = decode_payload(frame)
+            if decoded is None or not decoded[8]:
+                continue
+            payload = bytes(decoded[8]).decode(errors='ignore')
+            hits += sum(payload.count(text) for text in texts)
+    return hits
+
+
+def bench_search(args):
+    rng = random.Random(0)
+    markers = [b"ip address", b"name of laptop", b"Order Successful"]
+    letters = b"abcdefghijklmnopqrstuvwxyz"
+    patterns = markers + [bytes(rng.choice(letters) for _ in range(rng.randint(6, 16)))
+                          for _ in range(args.patterns - len(markers))]
+    size = os.path.getsize(args.file) / (1 << 20)
+    print(f"{len(patterns)} literal patterns over {size:.0f} MB")
+
+    start = time.perf_counter()
+    naive = find_per_packet(args.file, patterns)
+    naive_time = time.perf_counter() - start
+    print(f"per-packet str.find: {naive_time:.2f}s ({size / naive_time:.1f} MB/s), {naive} hits")
+
+    payload_patterns = PayloadPatterns(patterns)
+    reference = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        frames, matches = search_pcap(args.file, payload_patterns, workers)
+        elapsed = time.perf_counter() - start
+        reference = matches if reference is None else reference
+        print(f"payload_search {workers:>2} workers: {elapsed:.2f}s ({size / elapsed:.1f} MB/s), "
+              f"{len(matches)} stream matches, speedup {naive_time / elapsed:.1f}x, "
+              f"identical to first run: {matches == reference}")
+
+
+def string_flows(tuples):
+    # Keys as the sniffer originally built them, one formatted "ip:port" string per endpoint and packet
+    flows = {}
+    for proto, src, sport, dst, dport, length in tuples:
+        src = socket.inet_ntoa(src) if sport is None else f"{socket.inet_ntoa(src)}:{sport}"
+        dst = socket.inet_ntoa(dst) if dport is None else f"{socket.inet_ntoa(dst)}:{dport}"
+        counters = flows.setdefault((src, dst), [0, 0])
+        counters[0] += 1
+        counters[1] += length
+    return flows
+
+
+def table_flows(table):
+    # Keys as the sniffer builds them, tuples by default and packed ints with --packed-flows
+    def aggregate(tuples):
+        flows = table()
+        for proto, src, sport, dst, dport, length in tuples:
+            flows.update(proto, src, sport, dst, dport, length)
+        return flows.flows
+    return aggregate
+
+
+def bench_flow_keys(args):
+    with MmapPcapReader(args.file) as reader:
+        frames = [bytes(packet) for _, packet in reader]
+
+    def decoded():
+        for frame in frames:
+            five_tuple = fast_five_tuple(frame)
+            if five_tuple is not None:
+                yield five_tuple + (len(frame),)
+
+    # Timed on tuples decoded up front, so only key building and dict updates are measured
+    tuples = list(decoded())
+    for name, aggregate in [('strings', string_flows), ('tuples', table_flows(FlowTable)),
+                            ('ints', table_flows(PackedFlowTable))]:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            flows = aggregate(tuples)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            del flows
+
+        # Memory is traced with decoding inside, so addresses kept alive by the keys are counted too
+        tracemalloc.start()
+        flows = aggregate(decoded())
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{name:>8}: {best:.3f}s ({best / len(tuples) * 1e9:.0f} ns/packet), "
+              f"{len(flows)} keys, {size / 1024 / 1024:.1f} MiB ({size / len(flows):.0f} bytes/key)")
+        del flows
+
+
+def bench_report(args):
+    # Random TCP flows straight into the flow table, then every report format from the same table
+    rng = random.Random(0)
+    sniffer = PacketSniffer()
+    for _ in range(args.flows):
+        src, dst = rng.getrandbits(32).to_bytes(4, 'big'), rng.getrandbits(32).to_bytes(4, 'big')
+        sniffer.flow_table.update(6, src, rng.randrange(1024, 65536), dst, rng.choice((80, 443, 22)),
+                                  rng.randrange(60, 1500), rng.randrange(1, 50))
+    sniffer.packet_count = args.flows
+    print(f"{len(sniffer.flow_table)} flows, RSS {current_rss_kb() / 1024:.1f} MiB before reports")
+
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for fmt in args.formats:
+                sniffer.report = {'format': fmt, 'sort': 'bytes', 'top': args.top}
+                start = time.perf_counter()
+                with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+                    sniffer.unique_source_destination_pairs()
+                    sniffer.analyze_flows()
+                elapsed = time.perf_counter() - start
+                size = sum(os.path.getsize(name) for name in os.listdir('.') if name.endswith(EXTENSIONS[fmt]))
+                print(f"{fmt:>7}: {elapsed:.2f}s, {size / 1024 / 1024:.1f} MiB written, "
+                      f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+        finally:
+            os.chdir(cwd)
+
+
+def bench_sketch(args):
+    # Exact flow table against --sketch on the same capture, accuracy plus memory and time of each
+    with MmapPcapReader(args.file) as reader:
+        frames = [bytes(packet) for _, packet in reader]
+
+    sketch = {'cardinality_error': args.cardinality_error, 'heavy_hitter_error': args.heavy_hitter_error}
+    sniffers = {}
+    for name, settings in [('exact', None), ('sketch', sketch)]:
+        # Timed untraced, then rebuilt under tracemalloc for the size of the flow state
+        sniffer = PacketSniffer(sketch=settings)
+        start = time.perf_counter()
+        for frame in frames:
+            sniffer.parse_packet(frame)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        sniffer = PacketSniffer(sketch=settings)
+        for frame in frames:
+            sniffer.parse_packet(frame)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        sniffer.packet_count = len(frames)
+        sniffers[name] = sniffer
+        print(f"{name:>7}: {elapsed / len(frames) * 1e9:.0f} ns/packet, flow state {size / 1024 / 1024:.2f} MiB")
+
+    exact, approximate = sniffers['exact'], sniffers['sketch']
+    exact_pairs = exact.pair_totals()
+    hosts = set()
+    for src, dst, _, _ in exact.flow_table.directions():
+        hosts.add(src >> PORT_BITS)
+        hosts.add(dst >> PORT_BITS)
+    for name, true_count, hll in [('pairs', len(exact_pairs), approximate.flow_table.pairs),
+                                  ('hosts', len(hosts), approximate.flow_table.hosts)]:
+        estimate = hll.estimate()
+        print(f"unique {name}: exact {true_count}, estimate {estimate:.0f} "
+              f"({(estimate - true_count) / true_count:+.2%}, standard error {hll.error:.2%})")
+
+    # Heavy hitters: how many of the exact top-N the sketch finds, and how far its counts are off
+    summary = approximate.flow_table.top_pairs
+    field = SORT_FIELDS['bytes']
+    exact_top = [key for key, _ in ranked(exact_pairs, field, args.top)]
+    sketch_top = [key for key, _ in heapq.nlargest(args.top, summary.counters.items(), key=lambda item: item[1][0])]
+    found = len(set(exact_top) & set(sketch_top))
+    errors = [summary.counters[key][0] - exact_pairs[key][field] for key in sketch_top]
+    print(f"top {args.top} pairs by bytes: {found}/{len(exact_top)} found, "
+          f"overestimate max {max(errors, default=0)} mean {sum(errors) / max(len(errors), 1):.0f} bytes, "
+          f"bound {summary.max_error()} ({summary.max_error() / summary.total:.3%} of {summary.total} bytes)")
+
+
+def bench_writer(args):
+    frames = list(synthetic_frames(args.packets))
+    timestamps = [1_700_000_000 + n * 1e-5 for n in range(args.packets)]
+    writers = [('dpkt.pcap.Writer', dpkt.pcap.Writer), ('BufferedPcapWriter', BufferedPcapWriter)]
+
+    written = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, writer_class in writers:
+            path = os.path.join(directory, f"{writer_class.__name__}.pcap")
+            start = time.perf_counter()
+            writer = writer_class(open(path, 'wb'))
+            for frame, timestamp in zip(frames, timestamps):
+                writer.writepkt(frame, ts=timestamp)
+            writer.close()
+            elapsed = time.perf_counter() - start
+            print(f"{name:>18}: {args.packets / elapsed:.0f} writes/s")
+            with MmapPcapReader(path) as reader:
+                written[name] = [(round(ts, 6), bytes(frame)) for ts, frame in reader]
+
+    print(f"identical records: {written['dpkt.pcap.Writer'] == written['BufferedPcapWriter']}")
+
+
+def send_frames(interface, count):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    sock.bind((interface, 0))
+    for n, frame in enumerate(synthetic_frames(count), 1):
+        sock.send(frame)
+        if n % 64 == 0:
+            time.sleep(0.001)
+
+
+def bench_timestamps(args):
+    # Needs root: sends frames across a veth pair and checks every one carries a kernel timestamp
+    sender_end, capture_end = 'snifbench0', 'snifbench1'
+    subprocess.run(['ip', 'link', 'add', sender_end, 'type', 'veth', 'peer', 'name', capture_end], check=True)
+    try:
+        for interface in (sender_end, capture_end):
+            subprocess.run(['ip', 'link', 'set', interface, 'up'], check=True)
+        receiver = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+        receiver.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        receiver.bind((capture_end, 0))
+        receiver.settimeout(1)
+        # Send from a separate process while receiving so the socket buffer never overflows
+        sender = multiprocessing.Process(target=send_frames, args=(sender_end, args.packets))
+        sender.start()
+
+        stamps, missing, after_userspace = [], 0, 0
+        try:
+            while True:
+                _, ancdata, _, _ = receiver.recvmsg(65535, TIMESTAMP_ANCDATA_SIZE)
+                received_at = time.time()
+                stamp = kernel_timestamp(ancdata)
+                if stamp is None:
+                    missing += 1
+                    continue
+                stamps.append(stamp)
+                if stamp > received_at:
+                    after_userspace += 1
+        except socket.timeout:
+            pass
+        sender.join()
+
+        monotonic = all(a <= b for a, b in zip(stamps, stamps[1:]))
+        print(f"received {len(stamps) + missing} frames, {missing} without a kernel timestamp")
+        print(f"monotonic: {monotonic}, stamped after userspace saw them: {after_userspace}")
+        if len(stamps) > 1:
+            print(f"kernel timestamp span: {(stamps[-1] - stamps[0]) * 1e3:.3f} ms")
+    finally:
+        subprocess.run(['ip', 'link', 'del', sender_end])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Packet sniffer benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    memory = subparsers.add_parser('memory', help='Resident memory while feeding a synthetic packet stream')
+    memory.add_argument('--packets', type=int, default=2_000_000, help='Number of synthetic packets')
+    memory.add_argument('--flows', type=int, default=4096, help='Distinct flows in the stream')
+    memory.set_defaults(func=bench_memory)
+
+    readers = subparsers.add_parser('pcap', help='Compare the mmap reader with dpkt and scapy on a pcap file')
+    readers.add_argument('file', help='Classic pcap file to read')
+    readers.add_argument('--repeat', type=int, default=3, help='Runs per reader, the best is reported')
+    readers.set_defaults(func=bench_pcap_readers)
+
+    parallel = subparsers.add_parser('parallel', help='Sharded --read analysis against the serial aggregation')
+    parallel.add_argument('file', help='Classic pcap file to analyze')
+    parallel.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1],
+                          help='Worker counts to try')
+    parallel.set_defaults(func=bench_parallel)
+
+    capture = subparsers.add_parser('capture', help='Live capture backends on a flooded veth pair (root only)')
+    capture.add_argument('--duration', type=int, default=5, help='Seconds to capture per backend')
+    capture.add_argument('--backends', nargs='+', default=['recv', 'ring'], help='Backends to compare')
+    capture.add_argument('--pipeline', action='store_true', help='Capture with the threaded pipeline')
+    capture.set_defaults(func=bench_capture)
+
+    bpf = subparsers.add_parser('filter', help='Userspace CPU with and without a kernel BPF filter on a veth flood (root only)')
+    bpf.add_argument('--expression', default='udp',
+                     help='Capture filter, the synthetic stream is 3/4 TCP to port 443 and 1/4 UDP to port 53')
+    bpf.add_argument('--duration', type=int, default=5, help='Seconds to capture per run')
+    bpf.add_argument('--backend', choices=['recv', 'ring'], default='recv', help='Live capture backend')
+    bpf.add_argument('--rate', type=int, default=50_000,
+                     help='Frames per second sent, 0 floods (on few cores the sniffer then saturates either way)')
+    bpf.set_defaults(func=bench_filter)
+
+    decode = subparsers.add_parser('decode', help='Per-packet header decode cost, dpkt vs fast_decode')
+    decode.add_argument('file', help='Classic pcap file to decode')
+    decode.set_defaults(func=bench_decode)
+
+    ctf = subparsers.add_parser('ctf', help='ctf_part2.py single-pass index against the scapy full scans')
+    ctf.add_argument('file', help='pcap/pcapng file to search')
+    ctf.add_argument('--skip-scapy', action='store_true', help='Only time the index, rdpcap holds the whole capture')
+    ctf.set_defaults(func=bench_ctf)
+
+    search = subparsers.add_parser('search', help='payload_search.py with many patterns against per-packet str.find')
+    search.add_argument('file', help='Classic pcap file to search')
+    search.add_argument('--patterns', type=int, default=300, help='Number of literal patterns')
+    search.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help='Worker counts to try')
+    search.set_defaults(func=bench_search)
+
+    flow_keys = subparsers.add_parser('flowkeys', help='Flow table time and memory with string, tuple and int keys')
+    flow_keys.add_argument('file', help='Classic pcap file to aggregate')
+    flow_keys.add_argument('--repeat', type=int, default=3, help='Timed runs per key type, the best is reported')
+    flow_keys.set_defaults(func=bench_flow_keys)
+
+    report = subparsers.add_parser('report', help='Pair and flow report time and size for a large synthetic flow table')
+    report.add_argument('--flows', type=int, default=1_000_000, help='Distinct flows in the table')
+    report.add_argument('--formats', nargs='+', choices=REPORT_FORMATS, default=list(REPORT_FORMATS),
+                        help='Report formats to write')
+    report.add_argument('--top', type=int, help='Only write the N largest rows of each section')
+    report.set_defaults(func=bench_report)
+
+    sketch = subparsers.add_parser('sketch', help='Accuracy, memory and time of --sketch against the exact flow table')
+    sketch.add_argument('file', help='Classic pcap file to aggregate')
+    sketch.add_argument('--cardinality-error', type=float, default=0.01, help='HyperLogLog standard error')
+    sketch.add_argument('--heavy-hitter-error', type=float, default=0.001, help='Space-Saving error, 1/capacity')
+    sketch.add_argument('--top', type=int, default=100, help='Heavy hitters compared with the exact ranking')
+    sketch.set_defaults(func=bench_sketch)
+
+    writer = subparsers.add_parser('writer', help='pcap writes/sec of dpkt.pcap.Writer and BufferedPcapWriter')
+    writer.add_argument('--packets', type=int, default=500_000, help='Number of records to write')
+    writer.set_defaults(func=bench_writer)
+
+    timestamps = subparsers.add_parser('timestamps', help='Check SO_TIMESTAMPNS stamps on a veth pair (root only)')
+    timestamps.add_argument('--packets', type=int, default=10_000, help='Frames to send')
+    timestamps.set_defaults(func=bench_timestamps)
+
+    args = parser.parse_args()
+    args.func(args)
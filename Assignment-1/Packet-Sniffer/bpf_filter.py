@@ -0,0 +1,446 @@
+import ctypes
+import ctypes.util
+import re
+import shutil
+import socket
+import struct
+import subprocess
+
+SO_ATTACH_FILTER = 26
+BPF_INSN = struct.Struct('HBBI')
+# struct sock_fprog: unsigned short len, then a pointer aligned to its natural size
+SOCK_FPROG = struct.Struct('HP')
+
+# Classic BPF opcodes used by the built-in compiler
+LD_W_ABS = 0x20
+LD_H_ABS = 0x28
+LD_B_ABS = 0x30
+LD_H_IND = 0x48
+LDX_B_MSH = 0xb1
+JMP_JA = 0x05
+JMP_JEQ_K = 0x15
+JMP_JSET_K = 0x45
+RET_K = 0x06
+
+# Instruction fields: class in the low 3 bits, then size/source, then mode/operation
+BPF_LD, BPF_LDX, BPF_ST, BPF_STX, BPF_ALU, BPF_JMP, BPF_RET, BPF_MISC = range(8)
+BPF_W, BPF_H, BPF_B = 0x00, 0x08, 0x10
+BPF_IMM, BPF_ABS, BPF_IND, BPF_MEM, BPF_LEN, BPF_MSH = 0x00, 0x20, 0x40, 0x60, 0x80, 0xa0
+BPF_X = 0x08
+BPF_DIV, BPF_NEG, BPF_MOD = 0x30, 0x80, 0x90
+BPF_RVAL_A = 0x10
+BPF_TXA = 0x80
+BPF_MEMWORDS = 16
+MASK32 = 0xFFFFFFFF
+# Loads from these offsets fetch Linux socket metadata (SKF_AD_OFF), not frame bytes
+SKF_AD_OFF = 0xFFFFF000
+
+# Every opcode the kernel accepts in a classic program
+VALID_OPCODES = frozenset(
+    [BPF_LD | size | mode for size in (BPF_W, BPF_H, BPF_B) for mode in (BPF_ABS, BPF_IND)]
+    + [BPF_LD | BPF_W | mode for mode in (BPF_IMM, BPF_MEM, BPF_LEN)]
+    + [BPF_LDX | BPF_W | mode for mode in (BPF_IMM, BPF_MEM, BPF_LEN)] + [BPF_LDX | BPF_B | BPF_MSH]
+    + [BPF_ST, BPF_STX]
+    + [BPF_ALU | op | src for op in range(0x00, 0xb0, 0x10) if op != BPF_NEG for src in (0, BPF_X)]
+    + [BPF_ALU | BPF_NEG]
+    + [BPF_JMP] + [BPF_JMP | op | src for op in (0x10, 0x20, 0x30, 0x40) for src in (0, BPF_X)]
+    + [BPF_RET, BPF_RET | BPF_RVAL_A]
+    + [BPF_MISC, BPF_MISC | BPF_TXA])
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_IP6 = 0x86dd
+ETH_TYPE_ARP = 0x0806
+PROTOCOLS = {'tcp': 6, 'udp': 17, 'icmp': 1}
+
+
+def parse_bytecode(text):
+    """Parses `tcpdump -ddd` output: an instruction count, then one "code jt jf k" per line or comma."""
+    fields = [field.strip() for field in re.split(r'[,\n]', text.strip()) if field.strip()]
+    count = int(fields[0])
+    program = [tuple(int(value) for value in field.split()) for field in fields[1:]]
+    if len(program) != count or any(len(insn) != 4 for insn in program):
+        raise ValueError(f"Expected {count} instructions of 'code jt jf k'")
+    check_program(program)
+    return program
+
+
+def check_program(program, offline=False):
+    """Raises ValueError unless the program is one the kernel would accept.
+
+    With `offline`, also rejects loads of Linux socket metadata, which only
+    exist for live captures and cannot be evaluated on frames from a file.
+    """
+    if not program:
+        raise ValueError("Empty BPF program")
+    for pc, (code, jt, jf, k) in enumerate(program):
+        where = f"BPF instruction {pc} ({code:#x} {jt} {jf} {k})"
+        if code not in VALID_OPCODES:
+            raise ValueError(f"{where}: unknown opcode")
+        cls = code & 0x07
+        if cls == BPF_JMP:
+            targets = [k] if code == BPF_JMP else [jt, jf]
+            if any(pc + 1 + target >= len(program) for target in targets):
+                raise ValueError(f"{where}: jumps past the end of the program")
+        elif (cls in (BPF_ST, BPF_STX) or code & 0xe0 == BPF_MEM and cls in (BPF_LD, BPF_LDX)) and k >= BPF_MEMWORDS:
+            raise ValueError(f"{where}: scratch memory has only {BPF_MEMWORDS} words")
+        elif cls == BPF_ALU and code & 0xf0 in (BPF_DIV, BPF_MOD) and not code & BPF_X and k == 0:
+            raise ValueError(f"{where}: division by zero")
+        elif offline and cls == BPF_LD and code & 0xe0 in (BPF_ABS, BPF_IND) and k >= SKF_AD_OFF:
+            raise ValueError(f"{where}: Linux socket metadata loads only work on live captures")
+    if program[-1][0] & 0x07 != BPF_RET:
+        raise ValueError("BPF program does not end with a return")
+
+
+def compile_filter(expression, interface=None, snaplen=262144):
+    """Compiles a tcpdump-style expression to [(code, jt, jf, k)] for Ethernet frames.
+
+    libpcap is used through ctypes when installed, then `tcpdump -ddd` on
+    the capture interface. Without either, a built-in compiler covers the
+    common primitives: ip, ip6, arp, tcp, udp, icmp, [ip|ip6] [src|dst] host
+    ADDR (numeric IPv4 or IPv6) and [tcp|udp] [src|dst] port N, joined with
+    and/or/not and parentheses.
+    Returns (program, compiler name).
+    """
+    library = ctypes.util.find_library('pcap')
+    if library:
+        program, compiler = compile_with_libpcap(library, expression, snaplen), 'libpcap'
+    elif shutil.which('tcpdump') and interface:
+        output = subprocess.run(['tcpdump', '-i', interface, '-s', str(snaplen), '-ddd', expression],
+                                capture_output=True, text=True)
+        if output.returncode != 0:
+            raise ValueError(output.stderr.strip())
+        return parse_bytecode(output.stdout), 'tcpdump'
+    else:
+        program, compiler = FilterCompiler(expression, snaplen).compile(), 'built-in'
+    check_program(program)
+    return program, compiler
+
+
+def compile_with_libpcap(library, expression, snaplen):
+    class BpfInsn(ctypes.Structure):
+        _fields_ = [('code', ctypes.c_ushort), ('jt', ctypes.c_ubyte), ('jf', ctypes.c_ubyte), ('k', ctypes.c_uint32)]
+
+    class BpfProgram(ctypes.Structure):
+        _fields_ = [('bf_len', ctypes.c_uint), ('bf_insns', ctypes.POINTER(BpfInsn))]
+
+    pcap = ctypes.CDLL(library)
+    pcap.pcap_open_dead.restype = ctypes.c_void_p
+    pcap.pcap_geterr.restype = ctypes.c_char_p
+    handle = ctypes.c_void_p(pcap.pcap_open_dead(1, snaplen))  # DLT_EN10MB
+    program = BpfProgram()
+    try:
+        if pcap.pcap_compile(handle, ctypes.byref(program), expression.encode(), 1, 0xffffffff) != 0:
+            raise ValueError(pcap.pcap_geterr(handle).decode())
+        compiled = [(insn.code, insn.jt, insn.jf, insn.k) for insn in program.bf_insns[:program.bf_len]]
+        pcap.pcap_freecode(ctypes.byref(program))
+        return compiled
+    finally:
+        pcap.pcap_close(handle)
+
+
+def attach_filter(sock, program):
+    """Attaches a classic BPF program with SO_ATTACH_FILTER and drops frames queued before it."""
+    instructions = ctypes.create_string_buffer(b''.join(BPF_INSN.pack(*insn) for insn in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                    SOCK_FPROG.pack(len(program), ctypes.addressof(instructions)))
+    # Frames that arrived between socket() and the filter were not filtered
+    blocking = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(65535)
+    except (BlockingIOError, InterruptedError):
+        pass
+    finally:
+        sock.settimeout(blocking)
+
+
+def run_filter(program, frame):
+    """Runs a program on one frame like the kernel would, returning the number of bytes to keep.
+
+    Covers the whole classic instruction set except Linux socket metadata
+    loads, which check_program(offline=True) rejects beforehand.
+    """
+    a = x = 0
+    memory = [0] * BPF_MEMWORDS
+    pc = 0
+    length = len(frame)
+    unpack_from = struct.unpack_from
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        cls = code & 0x07
+        if cls == BPF_JMP:
+            op = code & 0xf0
+            if op == 0x00:
+                pc += k
+                continue
+            operand = x if code & BPF_X else k
+            if op == 0x10:
+                taken = a == operand
+            elif op == 0x20:
+                taken = a > operand
+            elif op == 0x30:
+                taken = a >= operand
+            else:
+                taken = a & operand
+            pc += jt if taken else jf
+        elif cls == BPF_LD or cls == BPF_LDX:
+            mode = code & 0xe0
+            if mode == BPF_ABS or mode == BPF_IND:
+                offset = k if mode == BPF_ABS else (x + k) & MASK32
+                size = code & 0x18
+                try:
+                    if size == BPF_H:
+                        value = unpack_from('!H', frame, offset)[0]
+                    elif size == BPF_B:
+                        value = frame[offset]
+                    else:
+                        value = unpack_from('!I', frame, offset)[0]
+                except (IndexError, struct.error):
+                    # Loads past the end of the frame reject it, as in the kernel
+                    return 0
+            elif mode == BPF_IMM:
+                value = k
+            elif mode == BPF_MEM:
+                value = memory[k]
+            elif mode == BPF_LEN:
+                value = length
+            else:
+                if k >= length:
+                    return 0
+                value = (frame[k] & 0x0F) << 2
+            if cls == BPF_LD:
+                a = value
+            else:
+                x = value
+        elif cls == BPF_ALU:
+            op = code & 0xf0
+            operand = x if code & BPF_X else k
+            if op == 0x00:
+                a += operand
+            elif op == 0x10:
+                a -= operand
+            elif op == 0x20:
+                a *= operand
+            elif op == BPF_DIV or op == BPF_MOD:
+                if operand == 0:
+                    return 0
+                a = a // operand if op == BPF_DIV else a % operand
+            elif op == 0x40:
+                a |= operand
+            elif op == 0x50:
+                a &= operand
+            elif op == 0x60:
+                a = a << operand if operand < 32 else 0
+            elif op == 0x70:
+                a = a >> operand if operand < 32 else 0
+            elif op == BPF_NEG:
+                a = -a
+            else:
+                a ^= operand
+            a &= MASK32
+        elif cls == BPF_RET:
+            return min(a if code & BPF_RVAL_A else k, length)
+        elif cls == BPF_ST:
+            memory[k] = a
+        elif cls == BPF_STX:
+            memory[k] = x
+        elif code & BPF_TXA:
+            a = x
+        else:
+            x = a
+
+
+class Label:
+    __slots__ = ('position',)
+
+    def __init__(self):
+        self.position = None
+
+
+class FilterCompiler:
+    """Recursive-descent compiler for a subset of tcpdump filter expressions.
+
+    Every primitive becomes a test that jumps to a true or a false label,
+    `and`/`or`/`not` only rewire those labels, and the labels are resolved to
+    forward jump offsets once the program is laid out.
+    """
+
+    def __init__(self, expression, snaplen=262144):
+        self.tokens = re.findall(r'\(|\)|&&|\|\||!|[^\s()!]+', expression)
+        self.position = 0
+        self.snaplen = snaplen
+        self.code = []
+
+    def compile(self):
+        if not self.tokens:
+            return [(RET_K, 0, 0, self.snaplen)]
+        tree = self._expression()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.position]}' in filter")
+        accept, reject = Label(), Label()
+        self._emit(tree, accept, reject)
+        self._place(accept)
+        self.code.append((RET_K, 0, 0, self.snaplen))
+        self._place(reject)
+        self.code.append((RET_K, 0, 0, 0))
+        return self._resolve()
+
+    # Parsing into ('and'|'or', left, right), ('not', node) and ('test', loads, jump, k) nodes
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _take(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("Filter expression ends too early")
+        self.position += 1
+        return token
+
+    def _expression(self):
+        node = self._term()
+        while self._peek() in ('or', '||'):
+            self._take()
+            node = ('or', node, self._term())
+        return node
+
+    def _term(self):
+        node = self._factor()
+        while self._peek() in ('and', '&&'):
+            self._take()
+            node = ('and', node, self._factor())
+        return node
+
+    def _factor(self):
+        token = self._take()
+        if token in ('not', '!'):
+            return ('not', self._factor())
+        if token == '(':
+            node = self._expression()
+            if self._take() != ')':
+                raise ValueError("Missing ')' in filter")
+            return node
+        self.position -= 1
+        return self._primitive()
+
+    def _primitive(self):
+        proto = direction = None
+        if self._peek() in ('ip', 'ip6', 'arp', 'tcp', 'udp', 'icmp'):
+            proto = self._take()
+        if self._peek() in ('src', 'dst'):
+            direction = self._take()
+        keyword = self._peek()
+        if keyword == 'host' and proto in (None, 'ip', 'ip6'):
+            self._take()
+            return self._host(self._take(), proto, direction)
+        if keyword == 'port' and proto in (None, 'tcp', 'udp'):
+            self._take()
+            return self._port(proto, int(self._take()), direction)
+        if proto is None or direction is not None or keyword not in (None, 'and', '&&', 'or', '||', ')'):
+            raise ValueError(f"Unsupported filter primitive near '{keyword}', install libpcap or tcpdump for full syntax")
+        return self._protocol(proto)
+
+    @staticmethod
+    def _ether_type(value):
+        return ('test', [(LD_H_ABS, 12)], JMP_JEQ_K, value)
+
+    @staticmethod
+    def _any(nodes):
+        node = nodes[0]
+        for other in nodes[1:]:
+            node = ('or', node, other)
+        return node
+
+    @staticmethod
+    def _all(nodes):
+        node = nodes[0]
+        for other in nodes[1:]:
+            node = ('and', node, other)
+        return node
+
+    def _protocol(self, proto):
+        if proto == 'ip':
+            return self._ether_type(ETH_TYPE_IP)
+        if proto == 'ip6':
+            return self._ether_type(ETH_TYPE_IP6)
+        if proto == 'arp':
+            return self._ether_type(ETH_TYPE_ARP)
+        number = PROTOCOLS[proto]
+        ip4 = self._all([self._ether_type(ETH_TYPE_IP), ('test', [(LD_B_ABS, 23)], JMP_JEQ_K, number)])
+        if proto == 'icmp':
+            return ip4
+        ip6 = self._all([self._ether_type(ETH_TYPE_IP6), ('test', [(LD_B_ABS, 20)], JMP_JEQ_K, number)])
+        return self._any([ip4, ip6])
+
+    def _host(self, text, proto, direction):
+        ip6 = ':' in text
+        if proto is not None and (proto == 'ip6') != ip6:
+            raise ValueError(f"'{proto} host' needs an {'IPv6' if proto == 'ip6' else 'IPv4'} address, not '{text}'")
+        try:
+            address = socket.inet_pton(socket.AF_INET6, text) if ip6 else socket.inet_aton(text)
+        except OSError:
+            raise ValueError(f"Invalid host address '{text}', the built-in compiler takes numeric addresses only") from None
+        if not ip6:
+            offsets = {'src': [26], 'dst': [30], None: [26, 30]}[direction]
+            tests = [('test', [(LD_W_ABS, offset)], JMP_JEQ_K, int.from_bytes(address, 'big')) for offset in offsets]
+            return self._all([self._ether_type(ETH_TYPE_IP), self._any(tests)])
+        # IPv6 addresses are compared a 32-bit word at a time
+        offsets = {'src': [22], 'dst': [38], None: [22, 38]}[direction]
+        words = [int.from_bytes(address[i:i + 4], 'big') for i in range(0, 16, 4)]
+        tests = [self._all([('test', [(LD_W_ABS, offset + 4 * i)], JMP_JEQ_K, word) for i, word in enumerate(words)])
+                 for offset in offsets]
+        return self._all([self._ether_type(ETH_TYPE_IP6), self._any(tests)])
+
+    def _port(self, proto, port, direction):
+        numbers = [PROTOCOLS[proto]] if proto else [PROTOCOLS['tcp'], PROTOCOLS['udp']]
+        offsets = {'src': [0], 'dst': [2], None: [0, 2]}[direction]
+        # IPv4: skip fragments, then index past the variable-length header
+        ip4 = self._all([
+            self._ether_type(ETH_TYPE_IP),
+            self._any([('test', [(LD_B_ABS, 23)], JMP_JEQ_K, number) for number in numbers]),
+            ('not', ('test', [(LD_H_ABS, 20)], JMP_JSET_K, 0x1FFF)),
+            self._any([('test', [(LDX_B_MSH, 14), (LD_H_IND, 14 + offset)], JMP_JEQ_K, port) for offset in offsets]),
+        ])
+        # IPv6 without extension headers, as tcpdump matches it
+        ip6 = self._all([
+            self._ether_type(ETH_TYPE_IP6),
+            self._any([('test', [(LD_B_ABS, 20)], JMP_JEQ_K, number) for number in numbers]),
+            self._any([('test', [(LD_H_ABS, 54 + offset)], JMP_JEQ_K, port) for offset in offsets]),
+        ])
+        return self._any([ip4, ip6])
+
+    # Code generation
+
+    def _emit(self, node, on_true, on_false):
+        kind = node[0]
+        if kind == 'test':
+            _, loads, jump, k = node
+            for code, offset in loads:
+                self.code.append((code, 0, 0, offset))
+            self.code.append((jump, on_true, on_false, k))
+        elif kind == 'not':
+            self._emit(node[1], on_false, on_true)
+        else:
+            middle = Label()
+            if kind == 'and':
+                self._emit(node[1], middle, on_false)
+            else:
+                self._emit(node[1], on_true, middle)
+            self._place(middle)
+            self._emit(node[2], on_true, on_false)
+
+    def _place(self, label):
+        label.position = len(self.code)
+
+    def _resolve(self):
+        program = []
+        for index, (code, jt, jf, k) in enumerate(self.code):
+            if isinstance(jt, Label):
+                jt = jt.position - index - 1
+                jf = jf.position - index - 1
+                if not (0 <= jt <= 255 and 0 <= jf <= 255):
+                    raise ValueError("Filter expression too long for 8-bit BPF jumps")
+            program.append((code, jt, jf, k))
+        return program
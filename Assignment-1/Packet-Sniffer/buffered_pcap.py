@@ -0,0 +1,69 @@
+import struct
+import time
+
+PCAP_MAGIC_MICRO = 0xa1b2c3d4
+PCAP_MAGIC_NANO = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+
+FILE_HEADER = struct.Struct('<IHHiIII')
+RECORD_HEADER = struct.Struct('<IIII')
+
+
+class BufferedPcapWriter:
+    """pcap writer that packs records into a preallocated buffer and writes it out in bulk.
+
+    Drop-in for dpkt.pcap.Writer's writepkt()/close(). Headers are packed
+    straight into the buffer with struct.pack_into and frames are copied in
+    behind them, so the file sees one write() per buffer_size bytes instead
+    of one per packet.
+    """
+
+    def __init__(self, fileobj, snaplen=65535, linktype=LINKTYPE_ETHERNET, nano=False, buffer_size=1 << 22):
+        self._file = fileobj
+        self._buffer = bytearray(buffer_size)
+        self._size = buffer_size
+        self._view = memoryview(self._buffer)
+        self._used = 0
+        self._multiplier = 10 ** 9 if nano else 10 ** 6
+        self.records = 0
+
+        magic = PCAP_MAGIC_NANO if nano else PCAP_MAGIC_MICRO
+        fileobj.write(FILE_HEADER.pack(magic, 2, 4, 0, 0, snaplen, linktype))
+
+    def writepkt(self, pkt, ts=None):
+        if ts is None:
+            ts = time.time()
+        length = len(pkt)
+        sec = int(ts)
+        frac = int((ts - sec) * self._multiplier + 0.5)
+        if frac >= self._multiplier:
+            sec += 1
+            frac -= self._multiplier
+
+        used = self._used
+        if used + RECORD_HEADER.size + length > self._size:
+            self.flush()
+            used = 0
+            if RECORD_HEADER.size + length > self._size:
+                # Larger than the whole buffer, write it through
+                self._file.write(RECORD_HEADER.pack(sec, frac, length, length))
+                self._file.write(pkt)
+                self.records += 1
+                return
+
+        RECORD_HEADER.pack_into(self._buffer, used, sec, frac, length, length)
+        start = used + RECORD_HEADER.size
+        self._view[start:start + length] = pkt
+        self._used = start + length
+        self.records += 1
+
+    def flush(self):
+        if self._used:
+            self._file.write(self._view[:self._used])
+            self._used = 0
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._view.release()
+        self._file.close()
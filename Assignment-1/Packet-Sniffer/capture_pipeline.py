@@ -0,0 +1,66 @@
+import queue
+import threading
+
+
+class CapturePipeline:
+    """Decouples the receive loop from pcap writing and statistics.
+
+    The receive stage only collects (timestamp, frame) pairs into batches and
+    hands each batch to one bounded queue per stage. A stage whose queue is
+    full loses that batch, which is counted rather than stalling the socket.
+    Batching keeps queue locking down to one put/get per batch_size frames.
+    """
+
+    def __init__(self, stages, queue_size=256, batch_size=256):
+        # stages maps a stage name to a callable taking (timestamp, frame)
+        self.batch_size = batch_size
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in stages}
+        self.drops = {name: 0 for name in stages}
+        self.processed = {name: 0 for name in stages}
+        self._threads = [
+            threading.Thread(target=self._run_stage, args=(name, handler), name=f"{name}-stage", daemon=True)
+            for name, handler in stages.items()
+        ]
+        self._batch = []
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, timestamp, frame):
+        # Frames from an mmap ring are only valid until the next block, so keep a copy
+        self._batch.append((timestamp, bytes(frame)))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        for name, stage_queue in self.queues.items():
+            try:
+                stage_queue.put_nowait(batch)
+            except queue.Full:
+                self.drops[name] += len(batch)
+
+    def queue_depths(self):
+        # Batches waiting per stage, approximate while the stages are running
+        return {name: stage_queue.qsize() for name, stage_queue in self.queues.items()}
+
+    def stop(self):
+        # Drains everything already queued, then waits for every stage to finish
+        self.flush()
+        for stage_queue in self.queues.values():
+            stage_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run_stage(self, name, handler):
+        stage_queue = self.queues[name]
+        while True:
+            batch = stage_queue.get()
+            if batch is None:
+                return
+            for timestamp, frame in batch:
+                handler(timestamp, frame)
+            self.processed[name] += len(batch)
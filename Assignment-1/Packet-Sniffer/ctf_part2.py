@@ -1,66 +1,135 @@
-from scapy.all import *
-
-packets = rdpcap('capture.pcap')
-
-# Q1. Find the IP address in a TCP packet containing the message "<my ip address = >"
-def find_my_ip_address(packets):
-    for packet in packets:
-        if packet.haslayer(TCP) and packet.haslayer(Raw):
-            payload = packet[Raw].load.decode(errors='ignore')
-            if "ip address" in payload:
-                # Extract the IP address from the payload
-                start_index = payload.find("ip address =") + len("ip address =")
-                end_index = payload.find(">", start_index)  # Find the closing '>'
-                ip_address = payload[start_index:end_index].strip()
-                return ip_address[1:]
+import argparse
+import socket
+import time
+
+import dpkt
+
+from fast_decode import decode_frame
+from mmap_pcap import read_pcap
+from pattern_match import PatternMatcher
+
+MY_IP_MARKER = b"ip address"
+LAPTOP_MARKER = b"name of laptop"
+ORDER_MARKER = b"Order Successful"
+
+
+def transport_payload(frame):
+    # (payload, TCP checksum or None) of a TCP/UDP frame, None for anything else
+    try:
+        ip = dpkt.ethernet.Ethernet(bytes(frame)).data
+    except Exception:
+        return None
+    if not isinstance(ip, (dpkt.ip.IP, dpkt.ip6.IP6)):
+        return None
+    if isinstance(ip.data, dpkt.tcp.TCP):
+        return ip.data.data, ip.data.sum
+    if isinstance(ip.data, dpkt.udp.UDP):
+        return ip.data.data, None
     return None
 
-# Q2. Find the number of packets with that IP address
-def count_packets_with_ip(packets, ip_address):
-    count = 0
-    for packet in packets:
-        if packet.haslayer(IP):
-            if packet[IP].src == ip_address or packet[IP].dst == ip_address:
-                count += 1
-    return count
-
-def find_laptop_name_and_checksum(packets):
-    for packet in packets:
-        if packet.haslayer(TCP) and packet.haslayer(Raw):
-            payload = packet[Raw].load.decode(errors='ignore')
-
-            index = payload.find("name of laptop")
-            if index != -1: 
-                next_chars = payload[index + len("laptop"): index + len("laptop") + 30]
-
-                tcp_checksum = packet[TCP].chksum
-                return next_chars, tcp_checksum
-
-    return None, None
-
-
-# Q4. Find the number of packets containing the message "Order successful"
-def count_order_successful_packets(packets):
-    count = 0
-    for packet in packets:
-        if packet.haslayer(Raw):
-            payload = packet[Raw].load.decode(errors='ignore')
-            if "Order Successful" in payload:
-                count += 1
-    return count
-
-# Results
-my_ip_address = find_my_ip_address(packets)
-print(f"Q1. My IP address: {my_ip_address}")
-
-if my_ip_address:
-    packet_count = count_packets_with_ip(packets, my_ip_address)
-    print(f"Q2. Number of packets with IP {my_ip_address}: {packet_count}")
-
-laptop_name, tcp_checksum = find_laptop_name_and_checksum(packets)
-if laptop_name:
-    print(f"Q3a. {laptop_name[2:]}")
-    print(f"Q3b. TCP checksum of that packet: {tcp_checksum}")
-
-order_successful_count = count_order_successful_packets(packets)
-print(f"Q4. Number of packets with 'Order successful': {order_successful_count}")
\ No newline at end of file
+
+class CaptureIndex:
+    """Everything the CTF questions ask about, collected in one streaming pass.
+
+    Each frame is decoded once for its IPv4 addresses and scanned once for
+    all payload markers together. Only the rare frames with a hit are parsed
+    further, to check the marker lies in the TCP/UDP payload. The index keeps
+    packet counts per address, packet counts per marker and the first TCP
+    payload carrying each marker with its checksum, so memory does not grow
+    with the capture.
+    """
+
+    def __init__(self, markers=(MY_IP_MARKER, LAPTOP_MARKER, ORDER_MARKER)):
+        self.matcher = PatternMatcher(markers)
+        self.packets = 0
+        # Packed IPv4 address -> packets with it as source or destination
+        self.packets_per_ip = {}
+        # Marker -> packets whose payload contains it
+        self.marker_packets = dict.fromkeys(self.matcher.patterns, 0)
+        # Marker -> (payload, checksum) of the first TCP packet containing it
+        self.first_tcp_match = {}
+
+    def add(self, frame):
+        self.packets += 1
+        decoded = decode_frame(frame)
+        if decoded is not None and decoded[0] == 4:
+            src, dst = decoded[2], decoded[3]
+            self.packets_per_ip[src] = self.packets_per_ip.get(src, 0) + 1
+            if dst != src:
+                self.packets_per_ip[dst] = self.packets_per_ip.get(dst, 0) + 1
+
+        if not self.matcher.contains_any(frame):
+            return
+        transport = transport_payload(frame)
+        if transport is None:
+            return
+        payload, checksum = transport
+        for marker in self.matcher.found(payload):
+            self.marker_packets[marker] += 1
+            if checksum is not None and marker not in self.first_tcp_match:
+                self.first_tcp_match[marker] = (payload, checksum)
+
+    @classmethod
+    def build(cls, path):
+        index = cls()
+        for _, frame in read_pcap(path):
+            index.add(frame)
+        return index
+
+    # Q1. Find the IP address in a TCP packet containing the message "<my ip address = >"
+    def my_ip_address(self):
+        match = self.first_tcp_match.get(MY_IP_MARKER)
+        if match is None:
+            return None
+        payload = match[0].decode(errors='ignore')
+        # Extract the IP address from the payload
+        start_index = payload.find("ip address =") + len("ip address =")
+        end_index = payload.find(">", start_index)  # Find the closing '>'
+        ip_address = payload[start_index:end_index].strip()
+        return ip_address[1:]
+
+    # Q2. Find the number of packets with that IP address
+    def packets_with_ip(self, ip_address):
+        try:
+            return self.packets_per_ip.get(socket.inet_aton(ip_address), 0)
+        except OSError:
+            return 0
+
+    # Q3. Find the laptop name and the TCP checksum of the packet that names it
+    def laptop_name_and_checksum(self):
+        match = self.first_tcp_match.get(LAPTOP_MARKER)
+        if match is None:
+            return None, None
+        payload = match[0].decode(errors='ignore')
+        index = payload.find("name of laptop")
+        return payload[index + len("laptop"): index + len("laptop") + 30], match[1]
+
+    # Q4. Find the number of packets containing the message "Order successful"
+    def order_successful_packets(self):
+        return self.marker_packets[ORDER_MARKER]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Answer the CTF questions in a single pass over a capture')
+    parser.add_argument('pcap', nargs='?', default='capture.pcap', help='pcap/pcapng file to search')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = CaptureIndex.build(args.pcap)
+    print(f"Indexed {index.packets} packets in {time.perf_counter() - start:.2f} seconds")
+
+    # Results
+    my_ip_address = index.my_ip_address()
+    print(f"Q1. My IP address: {my_ip_address}")
+
+    if my_ip_address:
+        packet_count = index.packets_with_ip(my_ip_address)
+        print(f"Q2. Number of packets with IP {my_ip_address}: {packet_count}")
+
+    laptop_name, tcp_checksum = index.laptop_name_and_checksum()
+    if laptop_name:
+        print(f"Q3a. {laptop_name[2:]}")
+        print(f"Q3b. TCP checksum of that packet: {tcp_checksum}")
+
+    order_successful_count = index.order_successful_packets()
+    print(f"Q4. Number of packets with 'Order successful': {order_successful_count}")
@@ -0,0 +1,193 @@
+import struct
+
+import dpkt
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_IP6 = 0x86dd
+# 802.1Q and QinQ tag types, up to two tags are skipped like dpkt does
+ETH_TYPES_VLAN = (0x8100, 0x88a8, 0x9100, 0x9200)
+ETH_TYPES_MPLS = (0x8847, 0x8848)
+
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+# IPv6 extension headers that are walked to find the transport header
+IP6_EXTENSION_HEADERS = (0, 43, 60)
+IP6_FRAGMENT_HEADER = 44
+
+ETH_TYPE = struct.Struct('!H')
+IP4_HEADER = struct.Struct('!BxHxxHxB2x4s4s')
+IP6_HEADER = struct.Struct('!4xHBx16s16s')
+PORTS = struct.Struct('!HH')
+TCP_OFFSET_FLAGS = struct.Struct('!BB')
+TCP_SEQ = struct.Struct('!I')
+
+
+def decode_frame(frame):
+    """Decodes the headers of an Ethernet frame without building dpkt objects.
+
+    Returns (ip_version, proto, src, dst, sport, dport, tcp_flags, payload_len)
+    with addresses as packed bytes, or None when the frame carries no IP
+    packet. Ports are None for anything but TCP/UDP (and for non-first
+    fragments), tcp_flags is None outside TCP and payload_len is the
+    transport payload size. 802.3/LLC and MPLS frames are handed to dpkt.
+    """
+    if len(frame) < 14:
+        return None
+    offset = 12
+    (eth_type,) = ETH_TYPE.unpack_from(frame, offset)
+    for _ in range(2):
+        if eth_type not in ETH_TYPES_VLAN or len(frame) < offset + 6:
+            break
+        offset += 4
+        (eth_type,) = ETH_TYPE.unpack_from(frame, offset)
+    offset += 2
+
+    if eth_type == ETH_TYPE_IP:
+        return decode_ip4(frame, offset)
+    if eth_type == ETH_TYPE_IP6:
+        return decode_ip6(frame, offset)
+    if eth_type <= 1500 or eth_type in ETH_TYPES_MPLS:
+        return decode_with_dpkt(frame)
+    return None
+
+
+def decode_ip4(frame, offset):
+    if len(frame) < offset + 20:
+        return None
+    version_ihl, total_length, fragment, proto, src, dst = IP4_HEADER.unpack_from(frame, offset)
+    header_length = (version_ihl & 0x0F) << 2
+    if header_length < 20:
+        return None
+    # A zero total length comes from segmentation offload, the IP packet then runs to the end of the frame
+    end = min(offset + total_length, len(frame)) if total_length else len(frame)
+    start = offset + header_length
+    if fragment & 0x1FFF:
+        return 4, proto, src, dst, None, None, None, max(end - start, 0)
+    return (4, proto, src, dst) + decode_transport(frame, proto, start, end)
+
+
+def decode_ip6(frame, offset):
+    if len(frame) < offset + 40:
+        return None
+    payload_length, next_header, src, dst = IP6_HEADER.unpack_from(frame, offset)
+    end = min(offset + 40 + payload_length, len(frame)) if payload_length else len(frame)
+    start = offset + 40
+    while next_header in IP6_EXTENSION_HEADERS and start + 8 <= end:
+        next_header, length = frame[start], frame[start + 1]
+        start += (length + 1) * 8
+    if next_header == IP6_FRAGMENT_HEADER:
+        return 6, next_header, src, dst, None, None, None, max(end - start, 0)
+    return (6, next_header, src, dst) + decode_transport(frame, next_header, start, end)
+
+
+def decode_transport(frame, proto, start, end):
+    # Returns (sport, dport, tcp_flags, payload_len), ports are None when the header is cut short
+    if proto == IP_PROTO_TCP and end - start >= 20:
+        sport, dport = PORTS.unpack_from(frame, start)
+        data_offset, flags = TCP_OFFSET_FLAGS.unpack_from(frame, start + 12)
+        header_length = (data_offset >> 4) << 2
+        if header_length >= 20:
+            return sport, dport, flags, max(end - start - header_length, 0)
+    elif proto == IP_PROTO_UDP and end - start >= 8:
+        sport, dport = PORTS.unpack_from(frame, start)
+        return sport, dport, None, end - start - 8
+    return None, None, None, max(end - start, 0)
+
+
+def decode_with_dpkt(frame):
+    # Slow path for link layers the offsets above do not cover
+    try:
+        eth = dpkt.ethernet.Ethernet(bytes(frame))
+    except Exception:
+        # Malformed frames can fail anywhere inside dpkt, they carry nothing to report
+        return None
+    ip = eth.data
+    if isinstance(ip, dpkt.ip.IP):
+        version, proto = 4, ip.p
+    elif isinstance(ip, dpkt.ip6.IP6):
+        version, proto = 6, ip.nxt
+    else:
+        return None
+    l4 = ip.data
+    if isinstance(l4, dpkt.tcp.TCP):
+        return version, proto, ip.src, ip.dst, l4.sport, l4.dport, l4.flags, len(l4.data)
+    if isinstance(l4, dpkt.udp.UDP):
+        return version, proto, ip.src, ip.dst, l4.sport, l4.dport, None, len(l4.data)
+    return version, proto, ip.src, ip.dst, None, None, None, len(l4)
+
+
+def decode_payload(frame):
+    """Decodes a TCP or UDP frame down to its payload, for content inspection.
+
+    Returns (ip_version, proto, src, dst, sport, dport, tcp_flags, seq,
+    payload) with payload a slice of `frame` (a view into the pcap mapping
+    for memoryview frames), seq None for UDP, or None for anything that is
+    not a first-fragment TCP/UDP packet. Follows the same headers as
+    decode_frame.
+    """
+    if len(frame) < 14:
+        return None
+    offset = 12
+    (eth_type,) = ETH_TYPE.unpack_from(frame, offset)
+    for _ in range(2):
+        if eth_type not in ETH_TYPES_VLAN or len(frame) < offset + 6:
+            break
+        offset += 4
+        (eth_type,) = ETH_TYPE.unpack_from(frame, offset)
+    offset += 2
+
+    if eth_type == ETH_TYPE_IP:
+        if len(frame) < offset + 20:
+            return None
+        version_ihl, total_length, fragment, proto, src, dst = IP4_HEADER.unpack_from(frame, offset)
+        header_length = (version_ihl & 0x0F) << 2
+        if header_length < 20 or fragment & 0x1FFF:
+            return None
+        version = 4
+        end = min(offset + total_length, len(frame)) if total_length else len(frame)
+        start = offset + header_length
+    elif eth_type == ETH_TYPE_IP6:
+        if len(frame) < offset + 40:
+            return None
+        payload_length, proto, src, dst = IP6_HEADER.unpack_from(frame, offset)
+        version = 6
+        end = min(offset + 40 + payload_length, len(frame)) if payload_length else len(frame)
+        start = offset + 40
+        while proto in IP6_EXTENSION_HEADERS and start + 8 <= end:
+            proto, length = frame[start], frame[start + 1]
+            start += (length + 1) * 8
+    elif eth_type <= 1500 or eth_type in ETH_TYPES_MPLS:
+        return decode_payload_with_dpkt(frame)
+    else:
+        return None
+
+    if proto == IP_PROTO_TCP and end - start >= 20:
+        sport, dport = PORTS.unpack_from(frame, start)
+        (seq,) = TCP_SEQ.unpack_from(frame, start + 4)
+        data_offset, flags = TCP_OFFSET_FLAGS.unpack_from(frame, start + 12)
+        header_length = (data_offset >> 4) << 2
+        if header_length >= 20:
+            return version, proto, src, dst, sport, dport, flags, seq, frame[start + header_length:end]
+    elif proto == IP_PROTO_UDP and end - start >= 8:
+        sport, dport = PORTS.unpack_from(frame, start)
+        return version, proto, src, dst, sport, dport, None, None, frame[start + 8:end]
+    return None
+
+
+def decode_payload_with_dpkt(frame):
+    try:
+        ip = dpkt.ethernet.Ethernet(bytes(frame)).data
+    except Exception:
+        return None
+    if isinstance(ip, dpkt.ip.IP):
+        version, proto = 4, ip.p
+    elif isinstance(ip, dpkt.ip6.IP6):
+        version, proto = 6, ip.nxt
+    else:
+        return None
+    l4 = ip.data
+    if isinstance(l4, dpkt.tcp.TCP):
+        return version, proto, ip.src, ip.dst, l4.sport, l4.dport, l4.flags, l4.seq, l4.data
+    if isinstance(l4, dpkt.udp.UDP):
+        return version, proto, ip.src, ip.dst, l4.sport, l4.dport, None, None, l4.data
+    return None
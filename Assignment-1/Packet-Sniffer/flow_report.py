@@ -0,0 +1,150 @@
+import csv
+import heapq
+import io
+import json
+import socket
+import struct
+
+# Endpoints are packed as address << 17 | port, with NO_PORT standing in for traffic without ports
+PORT_BITS = 17
+PORT_MASK = (1 << PORT_BITS) - 1
+NO_PORT = 1 << 16
+ENDPOINT_BITS = 32 + PORT_BITS
+ENDPOINT_MASK = (1 << ENDPOINT_BITS) - 1
+
+REPORT_FORMATS = ('text', 'csv', 'jsonl', 'binary')
+EXTENSIONS = {'text': '.txt', 'csv': '.csv', 'jsonl': '.jsonl', 'binary': '.bin'}
+# Index into the [packets, bytes] counters that reports are ordered by
+SORT_FIELDS = {'packets': 0, 'bytes': 1}
+
+# Binary reports: magic, then fixed-size (section, src, dst, packets, bytes) records
+BINARY_MAGIC = b'FLOWRPT1'
+BINARY_RECORD = struct.Struct('<BQQQQ')
+NO_ENDPOINT = (1 << 64) - 1
+SECTIONS = ('pairs', 'sources', 'destinations', 'top_pair')
+CSV_COLUMNS = ('section', 'src', 'sport', 'dst', 'dport', 'packets', 'bytes')
+
+
+def endpoint_parts(endpoint):
+    # (dotted address, port or None)
+    port = endpoint & PORT_MASK
+    return socket.inet_ntoa((endpoint >> PORT_BITS).to_bytes(4, 'big')), None if port == NO_PORT else port
+
+
+def format_endpoint(endpoint):
+    # Ports are only shown for TCP/UDP, other IP traffic is keyed by address alone
+    addr = socket.inet_ntoa((endpoint >> PORT_BITS).to_bytes(4, 'big'))
+    port = endpoint & PORT_MASK
+    return addr if port == NO_PORT else f"{addr}:{port}"
+
+
+def ranked(totals, field, top=None):
+    """Returns (key, [packets, bytes]) items of `totals` by descending counters[field].
+
+    With `top`, heapq.nlargest keeps only that many items instead of sorting
+    the whole table.
+    """
+    key = lambda item: item[1][field]
+    if top is not None:
+        return heapq.nlargest(top, totals.items(), key=key)
+    return sorted(totals.items(), key=key, reverse=True)
+
+
+class ReportWriter:
+    """Writes report rows to a text, CSV, JSON lines or binary file in chunks.
+
+    Rows are (src, dst, packets, bytes) with packed endpoints, dst is None
+    for per-endpoint sections. They are consumed lazily and encoded
+    `chunk_rows` at a time into a single write(), so the report never exists
+    as one list of strings however many flows it covers.
+    """
+
+    def __init__(self, path, fmt='text', chunk_rows=8192):
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format {fmt!r}")
+        self.path = path
+        self.fmt = fmt
+        self.chunk_rows = chunk_rows
+        if fmt == 'binary':
+            self._file = open(path, 'wb')
+            self._file.write(BINARY_MAGIC)
+        else:
+            self._file = open(path, 'w', newline='' if fmt == 'csv' else None, buffering=1 << 20)
+            if fmt == 'csv':
+                self._file.write(','.join(CSV_COLUMNS) + '\r\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def title(self, line):
+        # Section headings only exist in the text format, the others carry a section column
+        if self.fmt == 'text':
+            self._file.write(line + '\n')
+
+    def write_section(self, section, rows):
+        encode = getattr(self, f"_encode_{self.fmt}")
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_rows:
+                self._file.write(encode(section, chunk))
+                chunk = []
+        if chunk:
+            self._file.write(encode(section, chunk))
+
+    def close(self):
+        self._file.close()
+
+    def _encode_text(self, section, rows):
+        if section == 'pairs':
+            lines = [f"{(format_endpoint(src), format_endpoint(dst))}\n" for src, dst, _, _ in rows]
+        elif section == 'top_pair':
+            lines = [f"{(format_endpoint(src), format_endpoint(dst))}: {nbytes} bytes\n"
+                     for src, dst, _, nbytes in rows]
+        else:
+            lines = [f"{format_endpoint(src)}: {packets}\n" for src, _, packets, _ in rows]
+        return ''.join(lines)
+
+    def _encode_csv(self, section, rows):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for src, dst, packets, nbytes in rows:
+            dst_addr, dst_port = endpoint_parts(dst) if dst is not None else ('', '')
+            writer.writerow((section, *endpoint_parts(src), dst_addr, dst_port, packets, nbytes))
+        return out.getvalue()
+
+    def _encode_jsonl(self, section, rows):
+        lines = []
+        for src, dst, packets, nbytes in rows:
+            record = {'section': section}
+            record['src'], record['sport'] = endpoint_parts(src)
+            if dst is not None:
+                record['dst'], record['dport'] = endpoint_parts(dst)
+            record['packets'] = packets
+            record['bytes'] = nbytes
+            lines.append(json.dumps(record) + '\n')
+        return ''.join(lines)
+
+    def _encode_binary(self, section, rows):
+        buffer = bytearray(BINARY_RECORD.size * len(rows))
+        section = SECTIONS.index(section)
+        for i, (src, dst, packets, nbytes) in enumerate(rows):
+            BINARY_RECORD.pack_into(buffer, i * BINARY_RECORD.size, section, src,
+                                    NO_ENDPOINT if dst is None else dst, packets, nbytes)
+        return buffer
+
+
+def read_binary_report(path):
+    """Yields (section, src, dst, packets, bytes) rows of a binary report, endpoints still packed."""
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary flow report")
+        while True:
+            records = f.read(BINARY_RECORD.size * 8192)
+            if not records:
+                return
+            for section, src, dst, packets, nbytes in BINARY_RECORD.iter_unpack(records):
+                yield SECTIONS[section], src, None if dst == NO_ENDPOINT else dst, packets, nbytes
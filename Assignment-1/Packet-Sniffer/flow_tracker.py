@@ -0,0 +1,169 @@
+import csv
+from collections import OrderedDict
+
+from flow_report import ENDPOINT_BITS, ENDPOINT_MASK, NO_PORT, PORT_BITS, endpoint_parts
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+RECORD_FIELDS = ('start', 'end', 'duration', 'proto', 'src', 'sport', 'dst', 'dport', 'packets', 'bytes',
+                 'rev_packets', 'rev_bytes', 'tcp_flags', 'end_reason')
+
+
+class Flow:
+    """Counters of one bidirectional flow, oriented by the packet that opened it."""
+
+    __slots__ = ('key', 'start', 'end', 'forward', 'packets', 'bytes', 'rev_packets', 'rev_bytes', 'flags', 'fins')
+
+    def __init__(self, key, timestamp, forward):
+        self.key = key
+        self.start = timestamp
+        self.end = timestamp
+        # True when the opening packet went from the lower endpoint of the key to the higher one
+        self.forward = forward
+        self.packets = 0
+        self.bytes = 0
+        self.rev_packets = 0
+        self.rev_bytes = 0
+        self.flags = 0
+        # Bit 1 once the initiator sent FIN, bit 2 once the responder did
+        self.fins = 0
+
+
+def close_reason(flow):
+    return 'fin' if flow.fins == 3 else 'rst'
+
+
+class FlowTracker:
+    """Active flow table with TCP state and idle/active timeouts, exporting each finished flow.
+
+    Flows live in two LRU-ordered dicts: open flows expire after
+    `idle_timeout` without traffic, TCP flows closed by RST or a FIN from
+    both ends linger `close_timeout` for trailing ACKs. Each dict has a
+    single timeout, so expiry only ever pops from the front. Flows running
+    longer than `active_timeout` are exported and restarted, and
+    `max_flows` evicts the least recently used flow. Memory is bounded by
+    the flows active within the timeouts, not by every flow ever seen.
+    """
+
+    def __init__(self, export, idle_timeout=15.0, active_timeout=1800.0, close_timeout=2.0, max_flows=None):
+        # export(flow, reason) receives every flow leaving the table
+        self.export = export
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.close_timeout = close_timeout
+        self.max_flows = max_flows
+        self.open = OrderedDict()
+        self.closing = OrderedDict()
+        self.exported = 0
+        self.peak_flows = 0
+        self._next_expiry = None
+
+    def __len__(self):
+        return len(self.open) + len(self.closing)
+
+    def update(self, timestamp, proto, src, sport, dst, dport, length, tcp_flags=0):
+        # Expiry runs at most once a second of capture time, between packets it costs one comparison
+        if self._next_expiry is None or timestamp >= self._next_expiry:
+            self.expire(timestamp)
+            self._next_expiry = timestamp + 1
+
+        a = int.from_bytes(src, 'big') << PORT_BITS | (NO_PORT if sport is None else sport)
+        b = int.from_bytes(dst, 'big') << PORT_BITS | (NO_PORT if dport is None else dport)
+        lower = a <= b
+        key = (proto << ENDPOINT_BITS | (a if lower else b)) << ENDPOINT_BITS | (b if lower else a)
+
+        flow = self.open.get(key)
+        if flow is not None:
+            self.open.move_to_end(key)
+        else:
+            flow = self.closing.get(key)
+            if flow is not None:
+                if tcp_flags & TCP_SYN and not tcp_flags & TCP_ACK:
+                    # A new connection reusing the ports of one that just closed
+                    self._remove(self.closing, key, close_reason(flow))
+                    flow = None
+                else:
+                    self.closing.move_to_end(key)
+            if flow is None:
+                if self.max_flows and len(self) >= self.max_flows:
+                    # Closed flows are the cheapest to lose, then the least recently active open one
+                    flows = self.closing or self.open
+                    self._remove(flows, next(iter(flows)), 'evicted')
+                flow = self.open[key] = Flow(key, timestamp, lower)
+                if len(self) > self.peak_flows:
+                    self.peak_flows = len(self)
+
+        if timestamp - flow.start >= self.active_timeout:
+            # Long-lived flows are reported in slices so their traffic does not wait for the end
+            self.export(flow, 'active')
+            self.exported += 1
+            flow.start = timestamp
+            flow.packets = flow.bytes = flow.rev_packets = flow.rev_bytes = flow.flags = 0
+
+        initiator = lower == flow.forward
+        if initiator:
+            flow.packets += 1
+            flow.bytes += length
+        else:
+            flow.rev_packets += 1
+            flow.rev_bytes += length
+        flow.end = timestamp
+
+        if tcp_flags:
+            flow.flags |= tcp_flags
+            if tcp_flags & TCP_FIN:
+                flow.fins |= 1 if initiator else 2
+            if (tcp_flags & TCP_RST or flow.fins == 3) and key in self.open:
+                del self.open[key]
+                self.closing[key] = flow
+
+    def expire(self, now):
+        for flows, timeout in ((self.open, self.idle_timeout), (self.closing, self.close_timeout)):
+            while flows:
+                key, flow = next(iter(flows.items()))
+                if now - flow.end < timeout:
+                    break
+                self._remove(flows, key, 'idle' if flows is self.open else close_reason(flow))
+
+    def flush(self, reason='end'):
+        # Exports every flow still in the table, e.g. when the capture stops
+        for key in list(self.closing):
+            self._remove(self.closing, key, close_reason(self.closing[key]))
+        for key in list(self.open):
+            self._remove(self.open, key, reason)
+
+    def _remove(self, flows, key, reason):
+        self.export(flows.pop(key), reason)
+        self.exported += 1
+
+
+class FlowRecordWriter:
+    """CSV export of finished flows with NetFlow/IPFIX-like fields.
+
+    Records are oriented from the flow's initiator: `packets`/`bytes` are
+    what it sent and `rev_packets`/`rev_bytes` the replies. `tcp_flags` is
+    the OR of every TCP flag seen and `end_reason` one of idle, active,
+    fin, rst, evicted or end.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', newline='', buffering=1 << 20)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(RECORD_FIELDS)
+        self.records = 0
+
+    def __call__(self, flow, reason):
+        a = (flow.key >> ENDPOINT_BITS) & ENDPOINT_MASK
+        b = flow.key & ENDPOINT_MASK
+        src, dst = (a, b) if flow.forward else (b, a)
+        self._writer.writerow((f"{flow.start:.6f}", f"{flow.end:.6f}", f"{flow.end - flow.start:.6f}",
+                               flow.key >> (2 * ENDPOINT_BITS), *endpoint_parts(src), *endpoint_parts(dst),
+                               flow.packets, flow.bytes, flow.rev_packets, flow.rev_bytes, flow.flags, reason))
+        self.records += 1
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,68 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(snapshot):
+    """Renders [(name, type, help, [(labels, value)])] in the Prometheus text exposition format."""
+    lines = []
+    for name, kind, description, samples in snapshot:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if labels:
+                label_text = ','.join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves the most recently published metrics snapshot over HTTP from a daemon thread.
+
+    The capture loop hands over a finished snapshot with publish(), which is
+    a single attribute assignment, and the server thread only ever reads
+    that snapshot. Neither side takes a lock or touches the other's tables.
+    Binds to localhost unless told otherwise.
+    """
+
+    def __init__(self, host='127.0.0.1', port=9100):
+        self.snapshot = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render_metrics(server.snapshot).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes would otherwise interleave with the capture output
+                pass
+
+        self._httpd = HTTPServer((host, port), Handler)
+        self.address = self._httpd.server_address
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        print(f"Serving metrics at http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def publish(self, snapshot):
+        self.snapshot = snapshot
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
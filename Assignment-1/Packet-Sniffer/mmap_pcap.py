@@ -0,0 +1,134 @@
+import mmap
+import os
+import struct
+
+import dpkt
+
+from rotating_pcap import OPENERS, read_segments, segment_paths
+
+# Classic pcap magic numbers as they appear on disk -> (byte order, timestamp resolution)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+
+class MmapPcapReader:
+    """Memory-mapped reader for classic pcap files.
+
+    Records are yielded as (timestamp, memoryview) where the view is a slice of
+    the mapping, so no bytes object is allocated per frame. Views are only
+    valid while the reader is open; copy them with bytes() to keep a frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty, not a pcap file")
+
+        magic = self._map[:4]
+        if magic not in PCAP_MAGIC or len(self._map) < GLOBAL_HEADER_LEN:
+            self.close()
+            raise ValueError(f"{path} is not a classic pcap file")
+
+        endian, self.resolution = PCAP_MAGIC[magic]
+        self.snaplen, self.linktype = struct.unpack_from(endian + 'II', self._map, 16)
+        self._record = struct.Struct(endian + 'IIII')
+        self._view = memoryview(self._map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self.records()
+
+    def __len__(self):
+        # Size of the mapped file in bytes
+        return len(self._map)
+
+    def records(self, start=GLOBAL_HEADER_LEN, end=None):
+        """Yields records whose header begins in the byte range [start, end)."""
+        view = self._view
+        unpack_from = self._record.unpack_from
+        resolution = self.resolution
+        size = len(self._map)
+        if end is None or end > size:
+            end = size
+
+        offset = start
+        while offset < end and offset + RECORD_HEADER_LEN <= size:
+            sec, frac, caplen, _ = unpack_from(self._map, offset)
+            offset += RECORD_HEADER_LEN
+            if offset + caplen > size:
+                break  # Truncated final record, as left by an interrupted capture
+            yield sec + frac * resolution, view[offset:offset + caplen]
+            offset += caplen
+
+    def split(self, chunks):
+        """Splits the file into at most `chunks` byte ranges of similar size on record boundaries.
+
+        Only record headers are read, each range can then be passed to records().
+        """
+        size = len(self._map)
+        target = max((size - GLOBAL_HEADER_LEN) // max(chunks, 1), 1)
+        unpack_from = self._record.unpack_from
+
+        ranges = []
+        start = offset = GLOBAL_HEADER_LEN
+        while offset + RECORD_HEADER_LEN <= size:
+            if offset - start >= target and len(ranges) < chunks - 1:
+                ranges.append((start, offset))
+                start = offset
+            offset += RECORD_HEADER_LEN + unpack_from(self._map, offset)[2]
+        ranges.append((start, size))
+        return ranges
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if hasattr(self, '_view'):
+                self._view.release()
+            self._map.close()
+        except BufferError:
+            # A caller still holds a frame view, the mapping is freed once it is dropped
+            pass
+        self._file.close()
+
+
+def read_pcap(path):
+    """Streams (timestamp, frame) records from a pcap or pcapng file.
+
+    Classic pcap files are memory-mapped and frames are memoryview slices of
+    the mapping, pcapng goes through dpkt and yields bytes. A path written
+    with --rotate-* that no longer exists itself is read as the sequence of
+    its (possibly compressed) segments.
+    """
+    if not os.path.exists(path) and segment_paths(path):
+        yield from read_segments(segment_paths(path))
+        return
+    if os.path.splitext(path)[1] in OPENERS:
+        yield from read_segments([path])
+        return
+
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+
+    if magic == b'\x0a\x0d\x0d\x0a':
+        with open(path, 'rb') as f:
+            for timestamp, packet in dpkt.pcapng.Reader(f):
+                yield timestamp, packet
+    else:
+        with MmapPcapReader(path) as reader:
+            yield from reader
@@ -0,0 +1,113 @@
+import mmap
+import select
+import socket
+import struct
+
+# Constants from <linux/if_packet.h>, the socket module does not export them
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# SO_TIMESTAMPNS delivers a struct timespec as SCM_TIMESTAMPNS ancillary data
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+TIMESPEC = struct.Struct('qq')
+TIMESTAMP_ANCDATA_SIZE = socket.CMSG_SPACE(TIMESPEC.size)
+
+# struct tpacket_req3
+TPACKET_REQ3 = struct.Struct('IIIIIII')
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+# block_status, num_pkts, offset_to_first_pkt
+BLOCK_HEADER = struct.Struct('IIIII')
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac
+PACKET_HEADER = struct.Struct('IIIIIIH')
+
+
+def kernel_timestamp(ancdata):
+    """Returns the SCM_TIMESTAMPNS receive time from recvmsg() ancillary data, or None."""
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            sec, nsec = TIMESPEC.unpack_from(data)
+            return sec + nsec * 1e-9
+    return None
+
+
+def socket_statistics(sock, ring=False):
+    """Reads and resets the kernel's (packets, drops) counters for a packet socket.
+
+    TPACKET_V3 sockets report a third freeze counter, hence the larger struct.
+    """
+    if ring:
+        packets, drops, _ = struct.unpack('III', sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+    else:
+        packets, drops = struct.unpack('II', sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+    return packets, drops
+
+
+class PacketRing:
+    """TPACKET_V3 receive ring shared with the kernel through mmap.
+
+    The kernel fills whole blocks of frames and hands them over at once, so
+    a single poll() wakeup yields many packets without any recv() copies.
+    Frames are memoryview slices of the ring and are only valid until the
+    generator moves past their block.
+    """
+
+    def __init__(self, sock, block_size=1 << 22, block_count=64, frame_size=1 << 11, retire_ms=60):
+        self.sock = sock
+        self.block_size = block_size
+        self.block_count = block_count
+
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        request = TPACKET_REQ3.pack(block_size, block_count, frame_size,
+                                    block_size // frame_size * block_count, retire_ms, 0, 0)
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+        self._map = mmap.mmap(sock.fileno(), block_size * block_count,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._view = memoryview(self._map)
+        self._poll = select.poll()
+        self._poll.register(sock.fileno(), select.POLLIN | select.POLLERR)
+        self._block = 0
+
+    def frames(self, timeout=1.0):
+        """Yields (kernel timestamp, frame) for every packet in the next ready block.
+
+        Waits up to `timeout` seconds for the kernel to retire a block and
+        yields nothing if none became ready.
+        """
+        offset = self._block * self.block_size
+        _, _, status, num_packets, first = BLOCK_HEADER.unpack_from(self._map, offset)
+        if not status & TP_STATUS_USER:
+            self._poll.poll(int(timeout * 1000))
+            _, _, status, num_packets, first = BLOCK_HEADER.unpack_from(self._map, offset)
+            if not status & TP_STATUS_USER:
+                return
+
+        try:
+            packet = offset + first
+            for _ in range(num_packets):
+                next_offset, sec, nsec, snaplen, _, _, mac = PACKET_HEADER.unpack_from(self._map, packet)
+                start = packet + mac
+                yield sec + nsec * 1e-9, self._view[start:start + snaplen]
+                packet += next_offset
+        finally:
+            # Hand the block back to the kernel and move on to the next one
+            struct.pack_into('I', self._map, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            self._block = (self._block + 1) % self.block_count
+
+    def statistics(self):
+        return socket_statistics(self.sock, ring=True)
+
+    def close(self):
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # A caller still holds a frame view, the mapping is freed once it is dropped
+            pass
@@ -0,0 +1,152 @@
+import socket
+
+import numpy as np
+
+# One row per captured packet. Addresses are IPv4 only (0 otherwise), ports are -1 when absent
+PACKET_DTYPE = np.dtype([
+    ('ts', 'f8'),
+    ('length', 'u4'),
+    ('version', 'u1'),
+    ('proto', 'u1'),
+    ('flags', 'u1'),
+    ('src', 'u4'),
+    ('dst', 'u4'),
+    ('sport', 'i4'),
+    ('dport', 'i4'),
+])
+
+
+class PacketStore:
+    """Growable columnar store of per-packet metadata backed by a NumPy structured array.
+
+    Rows are collected as tuples and copied into the array in chunks, since
+    assigning one NumPy row per packet costs more than the decode itself.
+    The array doubles in size when full.
+    """
+
+    def __init__(self, capacity=1 << 16, chunk_size=1 << 14):
+        self._array = np.empty(capacity, dtype=PACKET_DTYPE)
+        self._size = 0
+        self._pending = []
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self._size + len(self._pending)
+
+    def append(self, timestamp, length, decoded):
+        # decoded is a fast_decode.decode_frame() result or None
+        if decoded is None:
+            row = (timestamp, length, 0, 0, 0, 0, 0, -1, -1)
+        else:
+            version, proto, src, dst, sport, dport, flags, _ = decoded
+            if version == 4:
+                src = int.from_bytes(src, 'big')
+                dst = int.from_bytes(dst, 'big')
+            else:
+                src = dst = 0
+            row = (timestamp, length, version, proto, flags or 0, src, dst,
+                   -1 if sport is None else sport, -1 if dport is None else dport)
+        self._pending.append(row)
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed > len(self._array):
+            grown = np.empty(max(needed, 2 * len(self._array)), dtype=PACKET_DTYPE)
+            grown[:self._size] = self._array[:self._size]
+            self._array = grown
+
+    def _flush(self):
+        if not self._pending:
+            return
+        rows = np.array(self._pending, dtype=PACKET_DTYPE)
+        self._pending = []
+        self.extend(rows)
+
+    def extend(self, rows):
+        # Appends a structured array (or another store's packets) in order
+        self._flush()
+        self._reserve(len(rows))
+        self._array[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    @property
+    def packets(self):
+        self._flush()
+        return self._array[:self._size]
+
+    def save(self, path):
+        np.save(path, self.packets)
+
+    @classmethod
+    def load(cls, path):
+        rows = np.load(path)
+        store = cls(capacity=max(len(rows), 1))
+        store.extend(rows)
+        return store
+
+    def size_summary(self):
+        # (count, total, min, max, mean) of frame lengths
+        lengths = self.packets['length']
+        if not len(lengths):
+            return 0, 0, None, None, 0
+        total = int(lengths.sum(dtype=np.uint64))
+        return len(lengths), total, int(lengths.min()), int(lengths.max()), total / len(lengths)
+
+    def size_counts(self):
+        # Distinct frame lengths and how often each occurred
+        sizes, counts = np.unique(self.packets['length'], return_counts=True)
+        return sizes, counts
+
+    def per_second(self):
+        """Returns (second offset, packets, bytes) arrays for every second of the capture."""
+        packets = self.packets
+        if not len(packets):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        seconds = (packets['ts'] - packets['ts'].min()).astype(np.int64)
+        counts = np.bincount(seconds)
+        volume = np.bincount(seconds, weights=packets['length'])
+        return np.arange(len(counts)), counts, volume
+
+    def top_talkers(self, n=10, field='src'):
+        """Returns [(address, packets, bytes)] for the n IPv4 addresses moving the most bytes."""
+        packets = self.packets
+        packets = packets[packets['version'] == 4]
+        if not len(packets):
+            return []
+        addresses, inverse = np.unique(packets[field], return_inverse=True)
+        volume = np.bincount(inverse, weights=packets['length'])
+        counts = np.bincount(inverse)
+        top = np.argsort(volume)[::-1][:n]
+        return [(socket.inet_ntoa(int(addresses[i]).to_bytes(4, 'big')), int(counts[i]), int(volume[i]))
+                for i in top]
+
+    def flows(self):
+        """Yields (proto, src, sport, dst, dport, packets, bytes) per directional IPv4 flow.
+
+        Addresses come back as packed bytes and absent ports as None, as the
+        flow table expects them.
+        """
+        packets = self.packets
+        packets = packets[packets['version'] == 4]
+        if not len(packets):
+            return
+        # Pack the 5-tuple into two uint64 keys, sorting those is far cheaper than np.unique on records
+        addresses = (packets['src'].astype(np.uint64) << np.uint64(32)) | packets['dst']
+        rest = ((packets['proto'].astype(np.uint64) << np.uint64(34))
+                | ((packets['sport'] + 1).astype(np.uint64) << np.uint64(17))
+                | (packets['dport'] + 1).astype(np.uint64))
+        order = np.lexsort((rest, addresses))
+        addresses, rest = addresses[order], rest[order]
+        changed = (addresses[1:] != addresses[:-1]) | (rest[1:] != rest[:-1])
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        counts = np.diff(np.append(starts, len(order)))
+        volume = np.add.reduceat(packets['length'][order].astype(np.int64), starts)
+
+        first = packets[order[starts]]
+        for proto, src, sport, dst, dport, flow_packets, flow_bytes in zip(
+                first['proto'].tolist(), first['src'].tolist(), first['sport'].tolist(), first['dst'].tolist(),
+                first['dport'].tolist(), counts.tolist(), volume.tolist()):
+            yield (proto, src.to_bytes(4, 'big'), None if sport < 0 else sport,
+                   dst.to_bytes(4, 'big'), None if dport < 0 else dport, flow_packets, flow_bytes)
@@ -0,0 +1,83 @@
+import re
+
+
+def trie_regex(patterns):
+    """Regex source matching any of `patterns`, longest first, with shared prefixes factored out.
+
+    A flat alternation makes re try every pattern at every position, the
+    trie shape costs about one character test per position however many
+    patterns there are.
+    """
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for byte in pattern:
+            node = node.setdefault(byte, {})
+        node[None] = True
+    return _trie_source(trie)
+
+
+def _trie_source(node):
+    # None marks the end of a pattern, the continuation is then optional and tried first (greedy)
+    terminal = None in node
+    branches = []
+    single = []
+    for byte, child in sorted((byte, child) for byte, child in node.items() if byte is not None):
+        if list(child) == [None]:
+            single.append(re.escape(bytes([byte])))
+        else:
+            branches.append(re.escape(bytes([byte])) + _trie_source(child))
+    if single:
+        branches.append(single[0] if len(single) == 1 else b'[' + b''.join(single) + b']')
+    if not branches:
+        return b''
+    body = branches[0] if len(branches) == 1 and not terminal else b'(?:' + b'|'.join(branches) + b')'
+    return body + b'?' if terminal else body
+
+
+class PatternMatcher:
+    """Finds every occurrence of a set of byte patterns in one scan of the data.
+
+    The patterns are compiled into a single trie-shaped regular expression,
+    so the scan runs in the re engine's C loop instead of a Python
+    automaton. At each position the longest pattern wins, and every shorter
+    pattern that is a prefix of it matches there too and is reported with
+    it. The search resumes one byte after each match start, so overlapping
+    occurrences are all found, as with Aho-Corasick.
+    """
+
+    def __init__(self, patterns, ignore_case=False):
+        patterns = [p.encode() if isinstance(p, str) else bytes(p) for p in patterns]
+        if not patterns or not all(patterns):
+            raise ValueError("Patterns must be non-empty")
+        self.ignore_case = ignore_case
+        # Matched text folds back to the pattern as given, whatever case it was found in
+        self._canonical = {self._fold(p): p for p in patterns}
+        ordered = sorted(self._canonical, key=len, reverse=True)
+        self._regex = re.compile(trie_regex(ordered), re.IGNORECASE if ignore_case else 0)
+        self._prefixes = {p: [self._canonical[q] for q in ordered if p.startswith(q)] for p in ordered}
+        self.patterns = list(self._canonical.values())
+
+    def _fold(self, data):
+        return bytes(data).lower() if self.ignore_case else bytes(data)
+
+    def contains_any(self, data):
+        # Cheapest check, a single search that stops at the first hit
+        return self._regex.search(data) is not None
+
+    def finditer(self, data, start=0, end=None):
+        """Yields (offset, pattern) for every occurrence in data[start:end], by offset."""
+        search = self._regex.search
+        end = len(data) if end is None else end
+        while True:
+            match = search(data, start, end)
+            if match is None:
+                return
+            offset = match.start()
+            for pattern in self._prefixes[self._fold(match.group())]:
+                yield offset, pattern
+            start = offset + 1
+
+    def found(self, data):
+        # Set of the patterns occurring anywhere in data
+        return {pattern for _, pattern in self.finditer(data)}
@@ -0,0 +1,330 @@
+import argparse
+import bisect
+import codecs
+import re
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from fast_decode import IP_PROTO_TCP, decode_payload
+from mmap_pcap import MmapPcapReader, read_pcap
+from pattern_match import PatternMatcher
+
+SEQ_MASK = (1 << 32) - 1
+TCP_SYN = 0x02
+# Out-of-order segments buffered per stream direction before the gap is given up as lost
+MAX_PENDING = 64
+
+
+class PayloadPatterns:
+    """Byte literals and regular expressions searched together.
+
+    Literals go through one PatternMatcher scan, so hundreds of them cost
+    about as much as one. Each regex is a separate re scan with standard
+    non-overlapping semantics. `window` is the longest match that is still
+    found when it straddles TCP segments or pcap chunks: the longest
+    literal, or `max_match` once there are regexes.
+    """
+
+    def __init__(self, literals=(), regexes=(), ignore_case=False, max_match=1024):
+        flags = re.IGNORECASE if ignore_case else 0
+        self.matcher = PatternMatcher(literals, ignore_case) if literals else None
+        self.regexes = [re.compile(regex, flags) for regex in regexes]
+        self.longest = max(map(len, self.matcher.patterns)) if self.matcher else 0
+        self.window = max_match if self.regexes else self.longest
+
+    def search(self, data, new_from=0):
+        """Yields (start, end, pattern) of matches in data that end after data[new_from:] begins."""
+        if self.matcher:
+            for start, literal in self.matcher.finditer(data, max(0, new_from - self.longest + 1)):
+                if start + len(literal) > new_from:
+                    yield start, start + len(literal), literal
+        for regex in self.regexes:
+            for match in regex.finditer(data):
+                if match.end() > new_from and match.end() > match.start():
+                    yield match.start(), match.end(), regex.pattern
+
+
+class StreamScanner:
+    """Reassembles one direction of a TCP stream and scans it as it grows.
+
+    Segments are placed by sequence number: retransmitted bytes are trimmed,
+    early segments wait in `pending` until the gap before them fills. Each
+    in-order run is scanned together with the last `window - 1` bytes
+    already delivered (the carry), so matches split across segments are
+    found once. Matches are reported by absolute sequence number and the
+    frame number of the segment they start in.
+    """
+
+    def __init__(self, seq, syn):
+        # A SYN takes one sequence number, the data starts after it
+        self.first_seq = (seq + 1) & SEQ_MASK if syn else seq
+        # Offsets count from the SYN when it was seen, else from wherever the stream starts in the capture
+        self.base = self.first_seq if syn else None
+        self.next_seq = self.first_seq
+        self.carry = b''
+        # (offset in carry, frame number) of the segments the carry came from
+        self.carry_frames = []
+        self.pending = {}
+
+    def add(self, seq, payload, frame_number, patterns, matches, flow):
+        distance = (seq - self.next_seq) & SEQ_MASK
+        if distance and distance < 1 << 31:
+            # Ahead of the stream, keep it until the gap is filled
+            if len(self.pending) >= MAX_PENDING:
+                self.skip_gap(patterns, matches, flow)
+                return self.add(seq, payload, frame_number, patterns, matches, flow)
+            if seq not in self.pending or len(self.pending[seq][0]) < len(payload):
+                self.pending[seq] = (bytes(payload), frame_number)
+            return
+        if distance:
+            # Behind: a retransmission, only bytes past next_seq are new
+            payload = payload[(1 << 32) - distance:]
+            if not payload:
+                return
+        self.deliver(payload, frame_number, patterns, matches, flow)
+        self.drain(patterns, matches, flow)
+
+    def drain(self, patterns, matches, flow):
+        while self.pending:
+            ready = [seq for seq in self.pending if not (0 < (seq - self.next_seq) & SEQ_MASK < 1 << 31)]
+            if not ready:
+                return
+            for seq in ready:
+                payload, frame_number = self.pending.pop(seq)
+                skip = (self.next_seq - seq) & SEQ_MASK
+                if skip < len(payload):
+                    self.deliver(payload[skip:], frame_number, patterns, matches, flow)
+
+    def skip_gap(self, patterns, matches, flow):
+        # The missing bytes never came, continue from the earliest buffered segment without a carry
+        self.next_seq = min(self.pending, key=lambda seq: (seq - self.next_seq) & SEQ_MASK)
+        self.carry = b''
+        self.carry_frames = []
+        self.drain(patterns, matches, flow)
+
+    def flush(self, patterns, matches, flow):
+        while self.pending:
+            self.skip_gap(patterns, matches, flow)
+
+    def deliver(self, payload, frame_number, patterns, matches, flow):
+        keep = patterns.window - 1
+        buffer = self.carry + bytes(payload)
+        frames = self.carry_frames + [(len(self.carry), frame_number)]
+        buffer_seq = (self.next_seq - len(self.carry)) & SEQ_MASK
+        scan_window(buffer, len(self.carry), frames, buffer_seq, patterns, matches, flow, self.base)
+        self.next_seq = (self.next_seq + len(payload)) & SEQ_MASK
+
+        self.carry, self.carry_frames = trim_window(buffer, frames, keep)
+
+
+def trim_window(buffer, frames, keep):
+    # Last `keep` bytes of buffer with the frame offsets rebased onto them
+    cut = max(len(buffer) - keep, 0)
+    index = max(bisect.bisect_right(frames, (cut, float('inf'))) - 1, 0)
+    return buffer[cut:], [(max(offset - cut, 0), frame) for offset, frame in frames[index:]]
+
+
+def scan_window(buffer, new_from, frames, buffer_seq, patterns, matches, flow, base=0):
+    if matches is None:
+        return
+    for start, end, pattern in patterns.search(buffer, new_from):
+        frame = frames[bisect.bisect_right(frames, (start, float('inf'))) - 1][1]
+        matches.append((frame, flow, (buffer_seq + start) & SEQ_MASK, pattern, base))
+
+
+class PayloadSearch:
+    """Search state over a run of frames: TCP streams being reassembled and the matches found.
+
+    Matches are (frame number, flow, position, pattern, base): TCP positions
+    are absolute sequence numbers and base the stream's first one when its
+    SYN was seen (None otherwise), UDP positions are offsets into the
+    datagram with base 0. Flows are (proto, src, sport, dst, dport) in the
+    packet's direction. `first_seq` remembers where each TCP flow started,
+    for offsets of streams whose SYN was not captured.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.streams = {}
+        self.first_seq = {}
+        self.matches = []
+        self.frames = 0
+
+    def feed(self, frames, warm_up=False, known_flows_only=False):
+        """Searches (timestamp, frame) records, numbering them on from the frames fed before.
+
+        Warm-up frames are numbered 0 and only build stream state, their
+        bytes are not scanned. With `known_flows_only`, frames of flows not
+        already tracked are skipped.
+        """
+        patterns = self.patterns
+        streams = self.streams
+        matches = None if warm_up else self.matches
+        for _, frame in frames:
+            if not warm_up:
+                self.frames += 1
+            decoded = decode_payload(frame)
+            if decoded is None:
+                continue
+            _, proto, src, dst, sport, dport, flags, seq, payload = decoded
+            flow = (proto, src, sport, dst, dport)
+            frame_number = 0 if warm_up else self.frames
+            if proto != IP_PROTO_TCP:
+                if payload and not warm_up and not known_flows_only:
+                    scan_window(bytes(payload), 0, [(0, frame_number)], 0, patterns, matches, flow)
+                continue
+            stream = streams.get(flow)
+            if stream is None and known_flows_only:
+                continue
+            if flags & TCP_SYN:
+                # A new SYN restarts the stream, e.g. a reused port pair
+                if stream is not None:
+                    stream.flush(patterns, matches, flow)
+                stream = streams[flow] = StreamScanner(seq, True)
+                seq = (seq + 1) & SEQ_MASK
+            elif stream is None:
+                stream = streams[flow] = StreamScanner(seq, False)
+            self.first_seq.setdefault(flow, stream.first_seq)
+            if payload:
+                stream.add(seq, payload, frame_number, patterns, matches, flow)
+
+    def finish(self):
+        # Gaps that never filled are skipped, so buffered segments are still searched
+        for flow, stream in self.streams.items():
+            stream.flush(self.patterns, self.matches, flow)
+
+
+def search_chunk(path, warm_up, own, look_ahead, patterns):
+    """Worker entry point: searches the records of the byte range `own`.
+
+    The range before it is replayed first without scanning, so streams
+    already running have their sequence numbers, carry and pending
+    segments, and the range after it completes matches that start inside
+    `own`. Only matches starting in an own frame are returned, numbered
+    from 1 within the chunk.
+    """
+    search = PayloadSearch(patterns)
+    with MmapPcapReader(path) as reader:
+        if warm_up:
+            search.feed(reader.records(*warm_up), warm_up=True)
+        search.feed(reader.records(*own))
+        count = search.frames
+        if look_ahead:
+            search.feed(reader.records(*look_ahead), known_flows_only=True)
+        search.finish()
+    matches = [match for match in search.matches if 1 <= match[0] <= count]
+    return count, matches, search.first_seq
+
+
+def merge_chunks(results):
+    """Joins chunk results in file order into global frame numbers and stream offsets."""
+    matches = []
+    first_seq = {}
+    # A stream idle for longer than the overlap looks new to the next chunk, which then reports its
+    # retransmitted bytes again. Reassembly never reports one stream position twice, so repeats are dropped
+    seen = set()
+    offset = 0
+    for count, chunk_matches, chunk_first_seq in results:
+        for frame, flow, position, pattern, base in chunk_matches:
+            if flow[0] == IP_PROTO_TCP:
+                key = (flow, position, pattern, base)
+                if key in seen:
+                    continue
+                seen.add(key)
+            matches.append((frame + offset, flow, position, pattern, base))
+        # The earliest chunk that saw a flow saw where it started
+        for flow, seq in chunk_first_seq.items():
+            first_seq.setdefault(flow, seq)
+        offset += count
+    # Sequence numbers become offsets from the first byte of each stream
+    matches = [(frame, flow, (position - (first_seq[flow] if base is None else base)) & SEQ_MASK, pattern)
+               for frame, flow, position, pattern, base in matches]
+    matches.sort(key=lambda match: (match[0], match[2]))
+    return matches
+
+
+def search_pcap(path, patterns, workers=1, overlap=4 << 20):
+    """Returns (frame count, matches) for a capture, sorted by frame number.
+
+    With several workers, each searches a run of pieces of about `overlap`
+    bytes, replaying the piece before and after its run. Results equal a
+    serial search as long as reordering, retransmissions and matches span
+    less than that.
+    """
+    if workers > 1:
+        try:
+            with MmapPcapReader(path) as reader:
+                pieces = reader.split(max(len(reader) // overlap, 1))
+        except (ValueError, OSError) as e:
+            # pcapng, compressed or rotated captures cannot be memory-mapped and split
+            print(f"{e}, falling back to a single process")
+        else:
+            chunks = min(workers * 4, len(pieces))
+            bounds = [len(pieces) * i // chunks for i in range(chunks + 1)]
+            jobs = []
+            for first, last in zip(bounds, bounds[1:]):
+                jobs.append((pieces[first - 1] if first else None,
+                             (pieces[first][0], pieces[last - 1][1]),
+                             pieces[last] if last < len(pieces) else None))
+            with ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(search_chunk, repeat(path), *zip(*jobs), repeat(patterns)))
+            return sum(result[0] for result in results), merge_chunks(results)
+
+    search = PayloadSearch(patterns)
+    search.feed(read_pcap(path))
+    search.finish()
+    return search.frames, merge_chunks([(search.frames, search.matches, search.first_seq)])
+
+
+def format_flow(flow):
+    proto, src, sport, dst, dport = flow
+    family = socket.AF_INET if len(src) == 4 else socket.AF_INET6
+    name = 'tcp' if proto == IP_PROTO_TCP else 'udp'
+    return f"{name} {socket.inet_ntop(family, src)}:{sport} > {socket.inet_ntop(family, dst)}:{dport}"
+
+
+def read_patterns(path):
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\r\n') for line in f if line.rstrip(b'\r\n')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Search TCP streams and UDP payloads of a capture for many patterns at once')
+    parser.add_argument('pcap', help='pcap/pcapng file to search')
+    parser.add_argument('--pattern', '-e', action='append', default=[],
+                        help=r'Byte string to find, Python escapes such as \x00 allowed (repeatable)')
+    parser.add_argument('--patterns-file', '-F', help='File with one literal pattern per line')
+    parser.add_argument('--regex', action='append', default=[], help='Regular expression over the bytes (repeatable)')
+    parser.add_argument('--ignore-case', '-i', action='store_true', help='Match ASCII letters case-insensitively')
+    parser.add_argument('--max-match', type=int, default=1024,
+                        help='Longest regex match found across segment and chunk boundaries')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Worker processes, each searches pcap chunks')
+    parser.add_argument('--overlap', type=float, default=4,
+                        help='MB replayed before and after each chunk to carry TCP streams across chunk edges')
+    parser.add_argument('--count', '-c', action='store_true', help='Only print the number of matches per pattern')
+    args = parser.parse_args()
+
+    literals = [codecs.escape_decode(pattern.encode())[0] for pattern in args.pattern]
+    if args.patterns_file:
+        literals += read_patterns(args.patterns_file)
+    regexes = [regex.encode() for regex in args.regex]
+    if not literals and not regexes:
+        parser.error('give at least one --pattern, --patterns-file or --regex')
+    patterns = PayloadPatterns(literals, regexes, args.ignore_case, args.max_match)
+
+    start = time.perf_counter()
+    count, matches = search_pcap(args.pcap, patterns, args.workers, int(args.overlap * 1024 * 1024))
+    elapsed = time.perf_counter() - start
+
+    if args.count:
+        totals = {}
+        for _, _, _, pattern in matches:
+            totals[pattern] = totals.get(pattern, 0) + 1
+        for pattern, total in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+            print(f"{total}\t{pattern!r}")
+    else:
+        for frame, flow, position, pattern in matches:
+            print(f"frame {frame}\t{format_flow(flow)}\toffset {position}\t{pattern!r}")
+    print(f"{len(matches)} matches in {count} packets, searched in {elapsed:.2f} seconds")
@@ -1,135 +1,594 @@
+import os
 import socket
 import time
 from collections import defaultdict
 import argparse
-import dpkt 
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import matplotlib.pyplot as plt
+import numpy as np
+from mmap_pcap import MmapPcapReader, read_pcap
+from packet_ring import PacketRing, SO_TIMESTAMPNS, TIMESTAMP_ANCDATA_SIZE, kernel_timestamp, socket_statistics
+from buffered_pcap import BufferedPcapWriter
+from capture_pipeline import CapturePipeline
+from rate_meter import RateMeter
+from fast_decode import decode_frame
+from flow_report import (ENDPOINT_BITS, ENDPOINT_MASK, EXTENSIONS, NO_PORT, PORT_BITS, REPORT_FORMATS,
+                         SORT_FIELDS, ReportWriter, ranked)
+from packet_store import PacketStore
+from sketches import FlowSketch
+from flow_tracker import FlowRecordWriter, FlowTracker
+from metrics_server import MetricsServer
+from bpf_filter import attach_filter, check_program, compile_filter, parse_bytecode, run_filter
+from rotating_pcap import COMPRESSORS, RotatingPcapWriter, segment_paths
+
+
+class FlowTable:
+    """Bidirectional 5-tuple flow index updated once per captured packet.
+
+    Both directions of a conversation share one entry, keyed with the lower
+    endpoint first, and hold [fwd_packets, fwd_bytes, rev_packets, rev_bytes].
+    Keys are (proto, src, sport, dst, dport) tuples, the cheapest to build per
+    packet; endpoints are only packed into ints when directions() is read.
+    """
 
-class PacketSniffer:
     def __init__(self):
+        self.flows = {}
+
+    def __len__(self):
+        return len(self.flows)
+
+    def update(self, proto, src, sport, dst, dport, length, packets=1):
+        if src < dst or (src == dst and (sport or 0) <= (dport or 0)):
+            key, offset = (proto, src, sport, dst, dport), 0
+        else:
+            key, offset = (proto, dst, dport, src, sport), 2
+
+        counters = self.flows.get(key)
+        if counters is None:
+            counters = self.flows[key] = [0, 0, 0, 0]
+        counters[offset] += packets
+        counters[offset + 1] += length
+
+    def merge(self, other):
+        # Adds the counters of another table, e.g. one built by a worker process
+        for key, counters in other.flows.items():
+            existing = self.flows.get(key)
+            if existing is None:
+                self.flows[key] = counters
+            else:
+                for i, value in enumerate(counters):
+                    existing[i] += value
+
+    def directions(self):
+        # Yields (src, dst, packets, bytes) with packed endpoints for every direction that carried traffic
+        for (proto, a, aport, b, bport), counters in self.flows.items():
+            a = int.from_bytes(a, 'big') << PORT_BITS | (NO_PORT if aport is None else aport)
+            b = int.from_bytes(b, 'big') << PORT_BITS | (NO_PORT if bport is None else bport)
+            if counters[0]:
+                yield a, b, counters[0], counters[1]
+            if counters[2]:
+                yield b, a, counters[2], counters[3]
+
+
+class PackedFlowTable(FlowTable):
+    """FlowTable keyed by a single int, proto << 98 | endpoint << 49 | endpoint (--packed-flows).
+
+    An int key takes about half the memory of a tuple of bytes and ports,
+    but costs more to build: about as fast when nearly every packet opens a
+    new flow, two to three times slower once flows repeat. It pays off when
+    the number of flows, not the packet rate, is the limit.
+    """
+
+    def update(self, proto, src, sport, dst, dport, length, packets=1):
+        a = int.from_bytes(src, 'big') << PORT_BITS | (NO_PORT if sport is None else sport)
+        b = int.from_bytes(dst, 'big') << PORT_BITS | (NO_PORT if dport is None else dport)
+        if a <= b:
+            key, offset = (proto << ENDPOINT_BITS | a) << ENDPOINT_BITS | b, 0
+        else:
+            key, offset = (proto << ENDPOINT_BITS | b) << ENDPOINT_BITS | a, 2
+
+        counters = self.flows.get(key)
+        if counters is None:
+            counters = self.flows[key] = [0, 0, 0, 0]
+        counters[offset] += packets
+        counters[offset + 1] += length
+
+    def directions(self):
+        for key, counters in self.flows.items():
+            a = (key >> ENDPOINT_BITS) & ENDPOINT_MASK
+            b = key & ENDPOINT_MASK
+            if counters[0]:
+                yield a, b, counters[0], counters[1]
+            if counters[2]:
+                yield b, a, counters[2], counters[3]
+
+
+class SizeStats:
+    """Running packet size statistics that do not grow with capture length.
+
+    Frame lengths are bounded by the 64 KiB socket read, so counting each
+    distinct size keeps the histogram exact with at most 65536 buckets.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = defaultdict(int)
+
+    def add(self, size):
+        self.count += 1
+        self.total += size
+        if self.min is None or size < self.min:
+            self.min = size
+        if self.max is None or size > self.max:
+            self.max = size
+        self.buckets[size] += 1
+
+    def merge_bucket(self, size, count):
+        # Adds `count` packets of the same size at once
+        self.count += count
+        self.total += size * count
+        if self.min is None or size < self.min:
+            self.min = size
+        if self.max is None or size > self.max:
+            self.max = size
+        self.buckets[size] += count
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        for size, count in other.buckets.items():
+            self.buckets[size] += count
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+def analyze_chunk(path, start, end, columnar=False, sketch=None, report=None, packed_flows=False):
+    # Worker process entry point, aggregates one byte range of a pcap into a fresh sniffer
+    sniffer = PacketSniffer(columnar=columnar, sketch=sketch, report=report, packed_flows=packed_flows)
+    with MmapPcapReader(path) as reader:
+        for timestamp, packet in reader.records(start, end):
+            if sniffer.start_time is None:
+                sniffer.start_time = timestamp
+            sniffer.last_time = timestamp
+            sniffer.packet_count += 1
+            sniffer.total_bytes += sniffer.parse_packet(packet, timestamp)
+    return sniffer
+
+
+class PacketSniffer:
+    def __init__(self, rotation=None, columnar=False, report=None, sketch=None, flow_export=None,
+                 metrics=None, packed_flows=False):
         self.packet_count = 0
         self.start_time = None
+        self.last_time = None
         self.total_bytes = 0
-        self.stats = defaultdict(int)
-        self.packet_sizes = []
-        self.src_dst_pairs = defaultdict(int)
-        self.peak_pps = 0  
-        self.peak_mbps = 0
-        self.packets = []  # Store raw packet data for analysis
-
-    def parse_packet(self, packet):
-        # This function calculates the packet length
+        self.size_stats = SizeStats()
+        # Format, sort order and top-N cut of the pair and flow reports
+        self.report = report or {'format': 'text', 'sort': 'bytes', 'top': None}
+        # FlowSketch error bounds for --sketch, None keeps every flow exactly
+        self.sketch = sketch
+        # Int flow keys for --packed-flows, half the memory per flow at a higher cost per packet
+        self.packed_flows = packed_flows
+        if sketch:
+            self.flow_table = FlowSketch(sort=self.report['sort'], **sketch)
+        elif packed_flows:
+            self.flow_table = PackedFlowTable()
+        else:
+            self.flow_table = FlowTable()
+        self.rate_meter = RateMeter()
+        # Counters reported by the kernel for live captures, None when reading a file
+        self.kernel_packets = None
+        self.kernel_drops = None
+        # Threaded receive/writer/analysis stages, only set for --pipeline captures
+        self.pipeline = None
+        # RotatingPcapWriter settings for --pcap output, None writes a single file
+        self.rotation = rotation
+        # Per-packet metadata columns for vectorized queries, grows with the capture so it is opt-in
+        self.store = PacketStore() if columnar else None
+        # Active flows with timeouts, exported to a CSV file as they finish (--flow-export)
+        self.tracker = None
+        if flow_export:
+            settings = dict(flow_export)
+            self.flow_records = FlowRecordWriter(settings.pop('path'))
+            self.tracker = FlowTracker(self.flow_records, **settings)
+        # Prometheus-style endpoint fed one snapshot per second (--metrics-port), a bound MetricsServer
+        self.metrics = metrics
+        if metrics is not None:
+            self.metrics.start()
+        # Bytes per IPv4 source in the current second, and the heaviest of the last completed one
+        self.window_talkers = {}
+        self.window_top = []
+
+    def parse_packet(self, packet, timestamp=None):
+        # This function calculates the packet length and records the packet in the flow table
         packet_length = len(packet)
-        self.packet_sizes.append(packet_length)
-        
-        try:
-            eth = dpkt.ethernet.Ethernet(packet)
-            if isinstance(eth.payload, dpkt.ip.IP):
-                ip = eth.payload
-                if isinstance(ip.payload, dpkt.tcp.TCP):
-                    src_ip = ip.src
-                    dst_ip = ip.dst
-                    src_port = ip.payload.sport
-                    dst_port = ip.payload.dport
-                    self.src_dst_pairs[(src_ip, src_port, dst_ip, dst_port)] += packet_length
-        except Exception as e:
-            pass 
+        self.size_stats.add(packet_length)
+
+        # The flow report has always covered IPv4 only, IPv6 frames are decoded but not recorded
+        decoded = decode_frame(packet)
+        if decoded is not None and decoded[0] == 4:
+            _, proto, src, dst, src_port, dst_port, _, _ = decoded
+            self.flow_table.update(proto, src, src_port, dst, dst_port, packet_length)
+            if self.tracker is not None:
+                self.tracker.update(time.time() if timestamp is None else timestamp,
+                                    proto, src, src_port, dst, dst_port, packet_length, decoded[6] or 0)
+            if self.metrics is not None:
+                self.window_talkers[src] = self.window_talkers.get(src, 0) + packet_length
+        if self.store is not None:
+            self.store.append(timestamp, packet_length, decoded)
 
         return packet_length
 
-    def packet_callback(self, packet, pcap_writer):
+    def packet_callback(self, packet, pcap_writer, timestamp=None):
+        # Live capture stamps packets on arrival, offline analysis passes the pcap record time
+        if timestamp is None:
+            timestamp = time.time()
         if self.start_time is None:
-            self.start_time = time.time()
+            self.start_time = timestamp
+        self.last_time = timestamp
         
-        packet_length = self.parse_packet(packet)
+        # Offline frames are memoryviews into the mapped pcap: they are only read here, never kept,
+        # so --read copies nothing and memory does not grow with the capture
+        packet_length = self.parse_packet(packet, timestamp)
         self.packet_count += 1
         self.total_bytes += packet_length
         
-        # Store the raw packet for later analysis
-        self.packets.append(packet)
-        
         # Write the packet to pcap file
-        timestamp = time.time()
-        pcap_writer.writepkt(packet, ts=timestamp)
-
-        # Calculate current metrics
-        duration = time.time() - self.start_time
-        pps = self.packet_count / duration
-        mbps = (self.total_bytes * 8 / (1024 * 1024)) / duration
-        
-        # Update peak PPS and peak Mbps
-        if pps > self.peak_pps:
-            self.peak_pps = pps
-        if mbps > self.peak_mbps:
-            self.peak_mbps = mbps
-        
-        if int(duration) > len(self.stats):
-            self.stats[int(duration)] = (pps, mbps)
-            print(f"Current PPS: {pps:.2f}, Mbps: {mbps:.2f}")
-
-    def start_sniffing(self, interface="eth0", duration=60, pcap_path=None):
+        if pcap_writer:
+            pcap_writer.writepkt(packet, ts=timestamp)
+
+        # Update the sliding-window rates, which report once per completed second
+        if self.rate_meter.add(timestamp, packet_length):
+            print(f"Current PPS: {self.rate_meter.window_pps:.2f}, Mbps: {self.rate_meter.window_mbps:.2f}")
+            if self.metrics is not None:
+                # The finished window is swapped out here, so the server never sees a dict being filled
+                talkers, self.window_talkers = self.window_talkers, {}
+                self.window_top = heapq.nlargest(10, talkers.items(), key=lambda item: item[1])
+                self.publish_metrics()
+
+    def open_pcap_writer(self, pcap_path):
+        if not pcap_path:
+            return None
+        if self.rotation:
+            return RotatingPcapWriter(pcap_path, **self.rotation)
+        return BufferedPcapWriter(open(pcap_path, 'wb'))
+
+    def receive_frames(self, sock, ring, duration):
+        # Yields (timestamp, frame) until the duration elapses, or None after a second without traffic
+        start_time = time.time()
+        while True:
+            if ring:
+                # One wakeup hands over a whole block of frames stamped by the kernel
+                received = False
+                for frame in ring.frames(timeout=1):
+                    received = True
+                    yield frame
+                if not received:
+                    print("No packets received in the last second, continuing...")
+                    yield None
+            else:
+                try:
+                    # SO_TIMESTAMPNS attaches the kernel receive time, fall back to arrival time without it
+                    packet, ancdata, _, _ = sock.recvmsg(65535, TIMESTAMP_ANCDATA_SIZE)
+                    timestamp = kernel_timestamp(ancdata)
+                    yield timestamp if timestamp is not None else time.time(), packet
+                except socket.timeout:
+                    print("No packets received in the last second, continuing...")
+                    yield None
+
+            if time.time() - start_time >= duration:
+                break
+
+    def poll_kernel_statistics(self, sock, ring):
+        # PACKET_STATISTICS resets on every read, so the counters are accumulated
+        packets, drops = socket_statistics(sock, ring=ring is not None)
+        self.kernel_packets = (self.kernel_packets or 0) + packets
+        self.kernel_drops = (self.kernel_drops or 0) + drops
+
+    def publish_metrics(self, rates=True):
+        meter = self.rate_meter
+        snapshot = [
+            ('sniffer_packets_total', 'counter', 'Packets processed.', [({}, self.packet_count)]),
+            ('sniffer_bytes_total', 'counter', 'Bytes processed.', [({}, self.total_bytes)]),
+        ]
+        # The parallel path never feeds the rate meter, its gauges would read 0 rather than unknown
+        if rates:
+            snapshot += [
+                ('sniffer_rate_pps', 'gauge', 'Packet rate over the sliding window and its EWMA.',
+                 [({'window': '1s'}, f"{meter.window_pps:.2f}"), ({'window': 'ewma'}, f"{meter.ewma_pps:.2f}")]),
+                ('sniffer_rate_mbps', 'gauge', 'Bit rate in Mbps over the sliding window and its EWMA.',
+                 [({'window': '1s'}, f"{meter.window_mbps:.4f}"), ({'window': 'ewma'}, f"{meter.ewma_mbps:.4f}")]),
+                ('sniffer_peak_pps', 'gauge', 'Highest sliding-window packet rate so far.',
+                 [({}, f"{meter.peak_pps:.2f}")]),
+            ]
+        snapshot.append(('sniffer_flow_table_size', 'gauge', 'Flows in the flow table (estimated with --sketch).',
+                         [({}, len(self.flow_table))]))
+        if self.tracker is not None:
+            snapshot.append(('sniffer_active_flows', 'gauge', 'Flows tracked for --flow-export.',
+                             [({}, len(self.tracker))]))
+        if self.kernel_packets is not None:
+            snapshot.append(('sniffer_kernel_packets_total', 'counter', 'Packets seen by the kernel socket.',
+                             [({}, self.kernel_packets)]))
+            snapshot.append(('sniffer_kernel_drops_total', 'counter', 'Packets the kernel dropped for this socket.',
+                             [({}, self.kernel_drops)]))
+        if self.pipeline:
+            snapshot.append(('sniffer_pipeline_drops_total', 'counter', 'Packets dropped before a pipeline stage.',
+                             [({'stage': stage}, dropped) for stage, dropped in self.pipeline.drops.items()]))
+            snapshot.append(('sniffer_pipeline_queue_depth', 'gauge', 'Batches waiting per pipeline stage.',
+                             [({'stage': stage}, depth) for stage, depth in self.pipeline.queue_depths().items()]))
+        snapshot.append(('sniffer_top_talker_bytes', 'gauge', 'Bytes sent by the busiest IPv4 sources last second.',
+                         [({'address': socket.inet_ntoa(src)}, nbytes) for src, nbytes in self.window_top]))
+        snapshot.append(('sniffer_last_update_timestamp_seconds', 'gauge', 'Wall-clock time of this snapshot.',
+                         [({}, f"{time.time():.3f}")]))
+        self.metrics.publish(snapshot)
+
+    def start_sniffing(self, interface="eth0", duration=60, pcap_path=None, backend="recv", pipelined=False,
+                       capture_filter=None):
         print(f"Starting packet capture on {interface} for {duration} seconds...")
 
         # Create a raw socket and bind it to the interface
         sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+        if capture_filter:
+            # Attached before the ring and bind(), so frames the filter rejects are never copied to userspace
+            try:
+                attach_filter(sock, capture_filter)
+            except OSError as e:
+                print(f"Failed to attach the capture filter: {e}")
+                sock.close()
+                return
+        ring = None
+        if backend == "ring":
+            # The ring has to exist before bind() so no frame is queued outside it
+            try:
+                ring = PacketRing(sock)
+            except OSError as e:
+                print(f"Failed to set up TPACKET_V3 ring: {e}")
+                sock.close()
+                return
         try:
             sock.bind((interface, 0))
             print(f"Successfully bound to {interface}")
         except Exception as e:
             print(f"Failed to bind to {interface}: {e}")
+            if ring:
+                ring.close()
+            sock.close()
             return
         
         sock.settimeout(1)  # Timeout after 1 second if no packet is received
+        if not ring:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
 
         # Open pcap file for writing
-        if pcap_path:
-            pcap_file = open(pcap_path, 'wb')
-            pcap_writer = dpkt.pcap.Writer(pcap_file)
-        else:
-            pcap_writer = None
-
-        start_time = time.time()
+        pcap_writer = self.open_pcap_writer(pcap_path)
+
+        pipeline = None
+        if pipelined:
+            stages = {'analysis': lambda timestamp, packet: self.packet_callback(packet, None, timestamp)}
+            if pcap_writer:
+                stages['writer'] = lambda timestamp, packet: pcap_writer.writepkt(packet, ts=timestamp)
+            pipeline = self.pipeline = CapturePipeline(stages)
+            pipeline.start()
+
+        interrupted = False
+        next_poll = time.time() + 1
         try:
-            while True:
-                try:
-                    packet = sock.recv(65535)
-                    self.packet_callback(packet, pcap_writer)
-                except socket.timeout:
-                    print("No packets received in the last second, continuing...")
-
-                if time.time() - start_time >= duration:
-                    break
+            for frame in self.receive_frames(sock, ring, duration):
+                if self.metrics is not None and time.time() >= next_poll:
+                    # Published from the receive loop as well, so kernel counters, idle seconds and a
+                    # lagging analysis stage still show up once a second
+                    next_poll = time.time() + 1
+                    self.poll_kernel_statistics(sock, ring)
+                    self.publish_metrics()
+                if pipeline:
+                    # Idle seconds show up as None, pass on whatever was batched so far
+                    if frame is None:
+                        pipeline.flush()
+                    else:
+                        pipeline.put(*frame)
+                elif frame is not None:
+                    timestamp, packet = frame
+                    self.packet_callback(packet, pcap_writer, timestamp)
+                elif self.tracker is not None:
+                    # Flows still time out while the link is quiet
+                    self.tracker.expire(time.time())
 
         except KeyboardInterrupt:
             print("\nCapture interrupted by user. Printing final statistics...")
-            if self.packet_count == 0:
-                print("No packet data found.")
-                return
+            interrupted = True
+        finally:
+            self.poll_kernel_statistics(sock, ring)
+            if pipeline:
+                print("Waiting for queued packets to be processed...")
+                pipeline.stop()
+            if ring:
+                ring.close()
+            sock.close()
+
+        self.finish_flows()
+
+        # Checked once the pipeline has drained, queued packets are not counted before that
+        if interrupted and self.packet_count == 0:
+            print("No packet data found.")
+            return
 
         # Print final statistics
-        if self.start_time:
-            total_duration = time.time() - self.start_time
-            avg_pps = self.packet_count / total_duration
-            avg_mbps = (self.total_bytes * 8 / (1024 * 1024)) / total_duration
-            print(f"\nFinal Statistics:")
-            print(f"Total Packets: {self.packet_count}")
-            print(f"Total Bytes Transferred: {self.total_bytes} bytes")
-            print(f"Average PPS: {avg_pps:.2f}")
-            print(f"Average Mbps: {avg_mbps:.2f}")
-            print(f"Total Duration: {total_duration:.2f} seconds")
-            print(f"Peak PPS: {self.peak_pps:.2f}")
-            print(f"Peak Mbps: {self.peak_mbps:.2f}")
-
-        # Close pcap file
+        if self.start_time is not None:
+            self.print_final_statistics(time.time() - self.start_time)
+        if self.metrics is not None:
+            self.publish_metrics()
+
+        # Flush buffered records and close pcap file
         if pcap_writer:
-            pcap_file.close()
+            pcap_writer.close()
 
         # Further analysis options after capture
+        self.save_store(pcap_path)
         self.loop_analysis_tasks(pcap_path)
 
+    def analyze_pcap(self, read_path, pcap_path=None, capture_filter=None):
+        # Replays a saved capture through the same callback as live sniffing, no root needed
+        print(f"Reading packets from {read_path}...")
+
+        pcap_writer = self.open_pcap_writer(pcap_path)
+
+        start_time = time.perf_counter()
+        try:
+            for timestamp, packet in read_pcap(read_path):
+                # Offline reads run the same BPF program in Python, so --filter means the same thing on both paths
+                if capture_filter and not run_filter(capture_filter, packet):
+                    continue
+                self.packet_callback(packet, pcap_writer, timestamp)
+        except KeyboardInterrupt:
+            print("\nReading interrupted by user. Printing final statistics...")
+        elapsed = time.perf_counter() - start_time
+
+        if pcap_writer:
+            pcap_writer.close()
+        self.finish_flows()
+
+        if self.packet_count == 0:
+            print("No packet data found.")
+            return
+
+        print(f"\nProcessed {self.packet_count} packets in {elapsed:.2f} seconds "
+              f"({self.packet_count / elapsed:.2f} packets/sec)")
+        self.print_final_statistics(self.last_time - self.start_time)
+        if self.metrics is not None:
+            self.publish_metrics()
+        self.save_store(read_path)
+        self.loop_analysis_tasks(pcap_path)
+
+    def analyze_pcap_parallel(self, read_path, workers):
+        # Splits a classic pcap on record boundaries and aggregates the chunks in worker processes
+        try:
+            with MmapPcapReader(read_path) as reader:
+                ranges = reader.split(workers * 4)
+        except (ValueError, OSError) as e:
+            # pcapng, compressed or rotated captures cannot be memory-mapped and split
+            print(f"{e}, falling back to a single process")
+            return self.analyze_pcap(read_path)
+
+        print(f"Reading packets from {read_path} with {workers} worker processes...")
+        start_time = time.perf_counter()
+        starts, ends = zip(*ranges)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map() returns chunks in file order, so first/last timestamps merge like the serial path
+            for part in executor.map(analyze_chunk, repeat(read_path), starts, ends, repeat(self.store is not None),
+                                     repeat(self.sketch), repeat(self.report), repeat(self.packed_flows)):
+                self.merge(part)
+                if self.metrics is not None:
+                    # Totals so far after every merged chunk, so a long read shows its progress
+                    self.publish_metrics(rates=False)
+        elapsed = time.perf_counter() - start_time
+
+        if self.packet_count == 0:
+            print("No packet data found.")
+            return
+
+        print(f"\nProcessed {self.packet_count} packets in {elapsed:.2f} seconds "
+              f"({self.packet_count / elapsed:.2f} packets/sec)")
+        self.print_final_statistics(self.last_time - self.start_time, peaks=False)
+        if self.metrics is not None:
+            self.publish_metrics(rates=False)
+        self.save_store(read_path)
+        self.loop_analysis_tasks(None)
+
+    def merge(self, other):
+        # Combines the aggregate state of a sniffer that processed a later part of the capture
+        if self.start_time is None:
+            self.start_time = other.start_time
+        if other.last_time is not None:
+            self.last_time = other.last_time
+        self.packet_count += other.packet_count
+        self.total_bytes += other.total_bytes
+        self.size_stats.merge(other.size_stats)
+        self.flow_table.merge(other.flow_table)
+        if self.store is not None and other.store is not None:
+            self.store.extend(other.store.packets)
+
+    def finish_flows(self):
+        # Exports the flows still active when the capture ends
+        if self.tracker is None:
+            return
+        self.tracker.flush()
+        self.flow_records.close()
+        print(f"Exported {self.flow_records.records} flow records to {self.flow_records.path} "
+              f"(peak {self.tracker.peak_flows} active flows)")
+
+    def save_store(self, pcap_path):
+        # Columns go next to the pcap as <name>.npy so the analysis can be reloaded without parsing
+        if self.store is None or not pcap_path:
+            return
+        npy_path = os.path.splitext(pcap_path)[0] + '.npy'
+        self.store.save(npy_path)
+        print(f"Packet columns saved at {npy_path}")
+
+    def load_store(self, npy_path):
+        # Rebuilds counters, size statistics and the flow table from a saved column store
+        print(f"Loading packet columns from {npy_path}...")
+        start_time = time.perf_counter()
+        self.store = PacketStore.load(npy_path)
+        packets = self.store.packets
+        if not len(packets):
+            print("No packet data found.")
+            return
+
+        self.packet_count, self.total_bytes, *_ = self.store.size_summary()
+        self.start_time = float(packets['ts'][0])
+        self.last_time = float(packets['ts'][-1])
+        for size, count in zip(*self.store.size_counts()):
+            self.size_stats.merge_bucket(int(size), int(count))
+        for proto, src, sport, dst, dport, packets, nbytes in self.store.flows():
+            self.flow_table.update(proto, src, sport, dst, dport, nbytes, packets)
+        print(f"Loaded {self.packet_count} packets in {time.perf_counter() - start_time:.2f} seconds")
+
+        self.print_final_statistics(self.last_time - self.start_time, peaks=False)
+        self.loop_analysis_tasks(None)
+
+    def print_final_statistics(self, total_duration, peaks=True):
+        # Durations come from the capture timestamps, guard against single-instant captures
+        avg_pps = self.packet_count / total_duration if total_duration > 0 else 0
+        avg_mbps = (self.total_bytes * 8 / (1024 * 1024)) / total_duration if total_duration > 0 else 0
+        print(f"\nFinal Statistics:")
+        print(f"Total Packets: {self.packet_count}")
+        print(f"Total Bytes Transferred: {self.total_bytes} bytes")
+        print(f"Average PPS: {avg_pps:.2f}")
+        print(f"Average Mbps: {avg_mbps:.2f}")
+        print(f"Total Duration: {total_duration:.2f} seconds")
+        if self.kernel_drops is not None:
+            print(f"Kernel Packets Seen: {self.kernel_packets}")
+            print(f"Kernel Drops: {self.kernel_drops}")
+        if self.pipeline:
+            for stage, dropped in self.pipeline.drops.items():
+                print(f"Packets Dropped Before {stage.capitalize()} Stage: {dropped}")
+        # Peak rates need packets in arrival order and are not tracked by the parallel path
+        if peaks:
+            meter = self.rate_meter
+            meter.finish()
+            print(f"Peak PPS: {meter.peak_pps:.2f}")
+            print(f"Peak Mbps: {meter.peak_mbps:.2f}")
+            print(f"Peak 100 ms Burst: {meter.peak_bucket_pps:.2f} PPS, {meter.peak_bucket_mbps:.2f} Mbps")
+            print(f"EWMA Rate: {meter.ewma_pps:.2f} PPS, {meter.ewma_mbps:.2f} Mbps")
+            print(f"100 ms Burst Percentiles (PPS): p50 {meter.percentile_pps(50):.2f}, "
+                  f"p95 {meter.percentile_pps(95):.2f}, p99 {meter.percentile_pps(99):.2f}")
+
     def loop_analysis_tasks(self, pcap_file_path):
         while True:
             print("\nPress 'a' to analyze packets, 'h' to make a histogram, 'u' for unique source-destination pairs, 'm' to analyze flows, or 'q' to quit.")
+            if self.store is not None:
+                print("With --columnar, 't' lists top talkers and 'r' shows per-second rates.")
             choice = input("Enter your choice: ").strip()
 
             if choice == 'a':
@@ -140,8 +599,18 @@ class PacketSniffer:
                 self.unique_source_destination_pairs()
             elif choice == 'm':
                 self.analyze_flows()
+            elif choice == 't' and self.store is not None:
+                self.top_talkers()
+            elif choice == 'r' and self.store is not None:
+                self.per_second_rates()
             elif choice == 'q':
-                if pcap_file_path:
+                if pcap_file_path and self.rotation:
+                    # --keep has deleted the oldest segments by now, name only the ones left on disk
+                    segments = segment_paths(pcap_file_path)
+                    if segments:
+                        print(f"\nPCAP segments saved as {segments[0]} to {segments[-1]} ({len(segments)} files), "
+                              f"read them back with --read {pcap_file_path}.")
+                elif pcap_file_path:
                     print(f"\nPCAP file saved at {pcap_file_path} for further analysis.")
                 print("Exiting the program...")
                 break  # Exit the loop if 'q' is pressed
@@ -149,13 +618,14 @@ class PacketSniffer:
                 print("Invalid choice, please try again.")
 
     def analyze_packets(self):
-        if not self.packet_sizes:
+        if not self.size_stats.count:
             print("No packet data to analyze.")
             return
 
-        min_size = min(self.packet_sizes)
-        max_size = max(self.packet_sizes)
-        avg_size = sum(self.packet_sizes) / len(self.packet_sizes) if self.packet_sizes else 0
+        if self.store is not None:
+            _, _, min_size, max_size, avg_size = self.store.size_summary()
+        else:
+            min_size, max_size, avg_size = self.size_stats.min, self.size_stats.max, self.size_stats.mean
         print(f"\nTotal Packets: {self.packet_count}")
         print(f"Total Bytes Transferred: {self.total_bytes} bytes")
         print(f"Minimum Packet Size: {min_size} bytes")
@@ -163,107 +633,251 @@ class PacketSniffer:
         print(f"Average Packet Size: {avg_size:.2f} bytes")
 
     def make_histogram(self):
-        if not self.packet_sizes:
+        if not self.size_stats.count:
             print("No packet data to create histogram.")
             return
 
+        # Bin with NumPy, from the length column or by weighting each distinct size by its count
+        if self.store is not None:
+            counts, edges = np.histogram(self.store.packets['length'], bins=50)
+        else:
+            sizes = np.fromiter(self.size_stats.buckets.keys(), dtype=np.int64)
+            weights = np.fromiter(self.size_stats.buckets.values(), dtype=np.int64)
+            counts, edges = np.histogram(sizes, bins=50, weights=weights)
+
         # Plot and show histogram of packet sizes in a window
-        plt.hist(self.packet_sizes, bins=50, color='blue', alpha=0.7)
+        plt.stairs(counts, edges, fill=True, color='blue', alpha=0.7)
         plt.title('Distribution of Packet Sizes')
         plt.xlabel('Packet Size (bytes)')
         plt.ylabel('Frequency')
         plt.show()
 
+    def top_talkers(self, n=10):
+        print(f"\nTop {n} Sources by Bytes:")
+        for address, packets, nbytes in self.store.top_talkers(n, 'src'):
+            print(f"{address}: {nbytes} bytes in {packets} packets")
+        print(f"\nTop {n} Destinations by Bytes:")
+        for address, packets, nbytes in self.store.top_talkers(n, 'dst'):
+            print(f"{address}: {nbytes} bytes in {packets} packets")
+
+    def per_second_rates(self):
+        seconds, packets, volume = self.store.per_second()
+        print("\nSecond -> PPS, Mbps:")
+        for second, pps, nbytes in zip(seconds.tolist(), packets.tolist(), volume.tolist()):
+            print(f"{second}: {pps}, {nbytes * 8 / (1024 * 1024):.2f}")
+
+    def pair_totals(self):
+        # (src << 49 | dst) -> [packets, bytes] per direction, protocols carrying the same endpoints are summed
+        if self.sketch:
+            return self.flow_table.totals(self.flow_table.top_pairs)
+        totals = {}
+        for src, dst, packets, nbytes in self.flow_table.directions():
+            key = src << ENDPOINT_BITS | dst
+            counters = totals.get(key)
+            if counters is None:
+                totals[key] = [packets, nbytes]
+            else:
+                counters[0] += packets
+                counters[1] += nbytes
+        return totals
+
+    def endpoint_totals(self):
+        # Per-source and per-destination [packets, bytes] and the pair totals, in one pass over the flow table
+        if self.sketch:
+            sketch = self.flow_table
+            return sketch.totals(sketch.top_sources), sketch.totals(sketch.top_destinations), self.pair_totals()
+        src_flows = {}
+        dst_flows = {}
+        pairs = {}
+        for src, dst, packets, nbytes in self.flow_table.directions():
+            for totals, key in ((src_flows, src), (dst_flows, dst), (pairs, src << ENDPOINT_BITS | dst)):
+                counters = totals.get(key)
+                if counters is None:
+                    totals[key] = [packets, nbytes]
+                else:
+                    counters[0] += packets
+                    counters[1] += nbytes
+        return src_flows, dst_flows, pairs
+
+    def sketch_error_note(self, summary):
+        # Space-Saving counts of the sorted field overestimate by at most their recorded error
+        return (f"(approximate: {self.report['sort']} at most {summary.max_error()} over the true value, "
+                f"the other column is a lower bound)")
+
+    def report_path(self, name):
+        return name + EXTENSIONS[self.report['format']]
+
     def unique_source_destination_pairs(self):
-        if not self.packet_sizes:
+        if not self.packet_count:
             print("No packet data to find pairs.")
             return
-        
-        unique_pairs = set()
 
-        for packet in self.packets:
-            try:
-                # Parse the raw packet into an Ethernet frame
-                eth = dpkt.ethernet.Ethernet(packet)
-                if isinstance(eth.data, dpkt.ip.IP): 
-                    ip = eth.data
-                    src = socket.inet_ntoa(ip.src)
-                    dst = socket.inet_ntoa(ip.dst)
-
-                    if isinstance(ip.data, dpkt.tcp.TCP):
-                        src += f":{ip.data.sport}"
-                        dst += f":{ip.data.dport}"
-                    elif isinstance(ip.data, dpkt.udp.UDP):
-                        src += f":{ip.data.sport}"
-                        dst += f":{ip.data.dport}"
-
-                    unique_pairs.add((src, dst))
-            except Exception as e:
-                print(f"Error parsing packet: {e}")
-                continue
-
-        with open("unique_pairs.txt", "w") as file:
-            file.write(f"Unique Source-Destination Pairs: {len(unique_pairs)}\n")
-            for pair in unique_pairs:
-                file.write(f"{pair}\n")
-        print(f"Unique source-destination pairs written to part1_step2.txt")
+        # Answered from the flow table built during capture, endpoints are only formatted as rows are written
+        totals = self.pair_totals()
+        top = ranked(totals, SORT_FIELDS[self.report['sort']], self.report['top'])
+        path = self.report_path("unique_pairs")
+        with ReportWriter(path, self.report['format']) as report:
+            if self.sketch:
+                pairs, hosts = self.flow_table.pairs, self.flow_table.hosts
+                summary = (f"~{pairs.estimate():.0f} (HyperLogLog, ±{pairs.error:.1%} standard error), "
+                           f"Unique Hosts: ~{hosts.estimate():.0f} (±{hosts.error:.1%})")
+                print(f"Unique Source-Destination Pairs: {summary}")
+                report.title(f"Unique Source-Destination Pairs: {summary}")
+                report.title(f"Heaviest {len(top)} pairs {self.sketch_error_note(self.flow_table.top_pairs)}")
+            else:
+                report.title(f"Unique Source-Destination Pairs: {len(totals)}")
+            report.write_section('pairs', ((key >> ENDPOINT_BITS, key & ENDPOINT_MASK, packets, nbytes)
+                                           for key, (packets, nbytes) in top))
+        print(f"Unique source-destination pairs written to {path}")
 
     def analyze_flows(self):
-        if not self.packet_sizes:
+        if not self.packet_count:
             print("No packet data to analyze flows.")
             return
-        
-        src_flows = defaultdict(int)
-        dst_flows = defaultdict(int)
-        flow_data = defaultdict(int)
 
-        for packet in self.packets:
-            try:
-                eth = dpkt.ethernet.Ethernet(packet)
-                if isinstance(eth.data, dpkt.ip.IP): 
-                    ip = eth.data
-                    src = socket.inet_ntoa(ip.src)
-                    dst = socket.inet_ntoa(ip.dst)
-
-                    if isinstance(ip.data, dpkt.tcp.TCP):
-                        src += f":{ip.data.sport}"
-                        dst += f":{ip.data.dport}"
-                    elif isinstance(ip.data, dpkt.udp.UDP):
-                        src += f":{ip.data.sport}"
-                        dst += f":{ip.data.dport}"
-
-                    src_flows[src] += 1
-                    dst_flows[dst] += 1
-                    flow_data[(src, dst)] += len(packet)
-            except Exception as e:
-                print(f"Error parsing packet: {e}")
-                continue
-
-        # Find the source-destination pair transferring the most data
-        max_data_pair = max(flow_data, key=flow_data.get, default=None)
-        max_data_transferred = flow_data[max_data_pair] if max_data_pair else 0
-
-        with open("total_flows.txt", "w") as file:
-            file.write("\nSource IP -> Total Flows:\n")
-            for ip, flows in src_flows.items():
-                file.write(f"{ip}: {flows}\n")
-
-            file.write("\nDestination IP -> Total Flows:\n")
-            for ip, flows in dst_flows.items():
-                file.write(f"{ip}: {flows}\n")
-
-            file.write("\nSource-Destination Pair Transferring the Most Data:\n")
-            if max_data_pair:
-                file.write(f"{max_data_pair}: {max_data_transferred} bytes\n")
-        print(f"Flow analysis written to part1_step3.txt")
+        src_flows, dst_flows, pairs = self.endpoint_totals()
+
+        # The source-destination pair transferring the most data
+        max_pair = ranked(pairs, SORT_FIELDS['bytes'], 1)
+        del pairs
+
+        field = SORT_FIELDS[self.report['sort']]
+        sources = ranked(src_flows, field, self.report['top'])
+        destinations = ranked(dst_flows, field, self.report['top'])
+        path = self.report_path("total_flows")
+        with ReportWriter(path, self.report['format']) as report:
+            report.title("\nSource IP -> Total Flows:")
+            report.write_section('sources', ((endpoint, None, packets, nbytes)
+                                             for endpoint, (packets, nbytes) in sources))
+            report.title("\nDestination IP -> Total Flows:")
+            report.write_section('destinations', ((endpoint, None, packets, nbytes)
+                                                  for endpoint, (packets, nbytes) in destinations))
+            report.title("\nSource-Destination Pair Transferring the Most Data:")
+            report.write_section('top_pair', ((key >> ENDPOINT_BITS, key & ENDPOINT_MASK, packets, nbytes)
+                                              for key, (packets, nbytes) in max_pair))
+            if self.sketch:
+                sketch = self.flow_table
+                notes = [f"Sources {self.sketch_error_note(sketch.top_sources)}",
+                         f"Destinations {self.sketch_error_note(sketch.top_destinations)}",
+                         f"Top pair {self.sketch_error_note(sketch.top_pairs)}"]
+                report.title("")
+                for note in notes:
+                    print(note)
+                    report.title(note)
+        print(f"Flow analysis written to {path}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Network Packet Sniffer')
     parser.add_argument('--interface', '-i', default='eth0', help='Interface to sniff on')
     parser.add_argument('--duration', '-d', type=int, default=60, help='Duration to sniff (seconds)')
-    parser.add_argument('--pcap', '-p', required=True, help='Path to save the pcap file')
+    parser.add_argument('--pcap', '-p', help='Path to save the pcap file')
+    parser.add_argument('--read', '-r', help='Analyze an existing pcap/pcapng file (or saved .npy columns) instead of sniffing')
+    parser.add_argument('--rotate-size', type=float, help='Start a new pcap segment after this many MB')
+    parser.add_argument('--rotate-seconds', type=float, help='Start a new pcap segment after this many seconds')
+    parser.add_argument('--keep', type=int, help='Number of most recent pcap segments to keep')
+    parser.add_argument('--compress', choices=sorted(COMPRESSORS), help='Compress closed pcap segments')
+    parser.add_argument('--backend', choices=['recv', 'ring'], default='recv',
+                        help='Live capture backend: one recv() per frame, or a batched TPACKET_V3 mmap ring')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Receive in the main thread and write/analyze in separate threads joined by bounded queues')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Worker processes for --read analysis of classic pcap files')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Keep per-packet metadata in NumPy columns and save them as <pcap>.npy')
+    parser.add_argument('--report-format', choices=REPORT_FORMATS, default='text',
+                        help='Format of the unique pairs and flow reports')
+    parser.add_argument('--sort', choices=sorted(SORT_FIELDS), default='bytes',
+                        help='Order report rows by bytes or packets, largest first')
+    parser.add_argument('--top', type=int, help='Only report the N largest rows of each section')
+    parser.add_argument('--packed-flows', action='store_true',
+                        help='Key the flow table by packed ints, about half the memory per flow but slower per packet')
+    parser.add_argument('--sketch', action='store_true',
+                        help='Estimate unique pairs and heavy hitters in fixed memory instead of keeping every flow '
+                             '(implied by --flow-export)')
+    parser.add_argument('--cardinality-error', type=float, default=0.01,
+                        help='HyperLogLog standard error for unique pair and host counts with --sketch')
+    parser.add_argument('--heavy-hitter-error', type=float, default=0.001,
+                        help='Space-Saving tracks 1/error heaviest pairs and endpoints with --sketch')
+    parser.add_argument('--flow-export', help='Track flow lifecycles and write finished flow records to this CSV file')
+    parser.add_argument('--idle-timeout', type=float, default=15.0,
+                        help='Seconds without traffic before a tracked flow is exported')
+    parser.add_argument('--active-timeout', type=float, default=1800.0,
+                        help='Seconds after which a long-running flow is exported and restarted')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve live Prometheus-style metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-host', default='127.0.0.1', help='Address the metrics endpoint binds to')
+    parser.add_argument('--max-flows', type=int, help='Most flows tracked at once, the least recently active is evicted')
+    parser.add_argument('--filter', '-f', help='tcpdump-style capture filter, e.g. "tcp port 443 and not host 10.0.0.1"')
+    parser.add_argument('--filter-bytecode',
+                        help='Precompiled BPF program in tcpdump -ddd format, inline or as a file path')
     args = parser.parse_args()
 
-    sniffer = PacketSniffer()
-    sniffer.start_sniffing(args.interface, args.duration, args.pcap)
\ No newline at end of file
+    if not args.read and not args.pcap:
+        parser.error('--pcap is required when sniffing a live interface')
+
+    rotation = None
+    if args.rotate_size or args.rotate_seconds:
+        rotation = {
+            'max_bytes': int(args.rotate_size * 1024 * 1024) if args.rotate_size else None,
+            'max_seconds': args.rotate_seconds,
+            'keep': args.keep,
+            'compress': args.compress,
+        }
+    elif args.keep or args.compress:
+        parser.error('--keep and --compress need --rotate-size or --rotate-seconds')
+
+    capture_filter = None
+    if args.filter and args.filter_bytecode:
+        parser.error('--filter and --filter-bytecode are mutually exclusive')
+    if args.filter or args.filter_bytecode:
+        if args.read and args.read.endswith('.npy'):
+            parser.error('--filter needs packets, not saved .npy columns')
+        try:
+            if args.filter_bytecode:
+                bytecode = args.filter_bytecode
+                if os.path.isfile(bytecode):
+                    with open(bytecode) as f:
+                        bytecode = f.read()
+                capture_filter, compiler = parse_bytecode(bytecode), 'precompiled'
+            else:
+                capture_filter, compiler = compile_filter(args.filter, None if args.read else args.interface)
+            if args.read:
+                # Checked once here rather than failing on the first frame the interpreter cannot run
+                check_program(capture_filter, offline=True)
+        except ValueError as e:
+            parser.error(f'invalid capture filter: {e}')
+        print(f"Capture filter: {len(capture_filter)} BPF instructions ({compiler})")
+
+    report = {'format': args.report_format, 'sort': args.sort, 'top': args.top}
+    sketch = None
+    # The flow tracker is bounded by the flows active at once, an exact flow table next to it would
+    # still keep every flow ever seen, so --flow-export keeps its reports in the sketches too
+    if args.sketch or args.flow_export:
+        sketch = {'cardinality_error': args.cardinality_error, 'heavy_hitter_error': args.heavy_hitter_error}
+    flow_export = None
+    if args.flow_export:
+        if args.read and args.read.endswith('.npy'):
+            parser.error('--flow-export needs packets, not saved .npy columns')
+        flow_export = {'path': args.flow_export, 'idle_timeout': args.idle_timeout,
+                       'active_timeout': args.active_timeout, 'max_flows': args.max_flows}
+    metrics = None
+    if args.metrics_port:
+        # Bound here, so a port in use is reported like any other bad option instead of a traceback
+        try:
+            metrics = MetricsServer(args.metrics_host, args.metrics_port)
+        except OSError as e:
+            parser.error(f"cannot bind metrics port {args.metrics_host}:{args.metrics_port}: {e.strerror or e}")
+    sniffer = PacketSniffer(rotation=rotation, columnar=args.columnar, report=report,
+                            sketch=sketch, flow_export=flow_export, packed_flows=args.packed_flows,
+                            metrics=metrics)
+    if args.read and args.read.endswith('.npy'):
+        sniffer.load_store(args.read)
+    elif args.read and args.workers > 1 and not args.pcap and not args.flow_export and not capture_filter:
+        # Flow lifecycles need packets in capture order, so --flow-export reads in a single process
+        sniffer.analyze_pcap_parallel(args.read, args.workers)
+    elif args.read:
+        sniffer.analyze_pcap(args.read, args.pcap, capture_filter)
+    else:
+        sniffer.start_sniffing(args.interface, args.duration, args.pcap, args.backend, args.pipeline,
+                               capture_filter)
\ No newline at end of file
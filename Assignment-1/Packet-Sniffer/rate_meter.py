@@ -0,0 +1,111 @@
+import math
+from collections import defaultdict
+
+MEGABIT = 1024 * 1024
+
+
+class RateMeter:
+    """Packet and bit rates over fixed-size time buckets.
+
+    Packets are counted into the current bucket (100 ms by default) and each
+    closed bucket goes into a ring covering one window (1 s by default), so
+    add() is O(1) and the sliding-window rate is a running sum. Peaks are
+    tracked both per bucket and per window, EWMA rates smooth over
+    `ewma_seconds`, and the distribution of per-bucket packet counts is kept
+    for burst percentiles.
+    """
+
+    def __init__(self, bucket_seconds=0.1, window_seconds=1.0, ewma_seconds=1.0):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = max(int(round(window_seconds / bucket_seconds)), 1)
+        self.window_seconds = self.window_buckets * bucket_seconds
+        self.alpha = 1 - math.exp(-bucket_seconds / ewma_seconds)
+
+        self._ring_packets = [0] * self.window_buckets
+        self._ring_bytes = [0] * self.window_buckets
+        self._window_packets = 0
+        self._window_bytes = 0
+        self._bucket = None
+        self._bucket_packets = 0
+        self._bucket_bytes = 0
+
+        self.window_pps = 0.0
+        self.window_mbps = 0.0
+        self.peak_pps = 0.0
+        self.peak_mbps = 0.0
+        self.peak_bucket_pps = 0.0
+        self.peak_bucket_mbps = 0.0
+        self.ewma_pps = 0.0
+        self.ewma_mbps = 0.0
+        # Packets per bucket -> number of buckets, bounded by the distinct counts seen
+        self.bucket_counts = defaultdict(int)
+
+    def add(self, timestamp, length):
+        """Counts one packet. Returns True when a window boundary was crossed."""
+        bucket = int(timestamp / self.bucket_seconds)
+        crossed = False
+        if self._bucket is None:
+            self._bucket = bucket
+        elif bucket > self._bucket:
+            crossed = self._advance(bucket)
+        # Late timestamps (bucket < current) are counted in the current bucket
+        self._bucket_packets += 1
+        self._bucket_bytes += length
+        return crossed
+
+    def finish(self):
+        # Closes the bucket in progress so it is included in peaks and percentiles
+        if self._bucket is not None and self._bucket_packets:
+            self._advance(self._bucket + 1)
+
+    def _close_bucket(self, packets, nbytes):
+        slot = self._bucket % self.window_buckets
+        self._window_packets += packets - self._ring_packets[slot]
+        self._window_bytes += nbytes - self._ring_bytes[slot]
+        self._ring_packets[slot] = packets
+        self._ring_bytes[slot] = nbytes
+
+        bucket_pps = packets / self.bucket_seconds
+        bucket_mbps = nbytes * 8 / MEGABIT / self.bucket_seconds
+        self.window_pps = self._window_packets / self.window_seconds
+        self.window_mbps = self._window_bytes * 8 / MEGABIT / self.window_seconds
+        self.peak_bucket_pps = max(self.peak_bucket_pps, bucket_pps)
+        self.peak_bucket_mbps = max(self.peak_bucket_mbps, bucket_mbps)
+        self.peak_pps = max(self.peak_pps, self.window_pps)
+        self.peak_mbps = max(self.peak_mbps, self.window_mbps)
+        self.ewma_pps += self.alpha * (bucket_pps - self.ewma_pps)
+        self.ewma_mbps += self.alpha * (bucket_mbps - self.ewma_mbps)
+        self.bucket_counts[packets] += 1
+        self._bucket += 1
+
+    def _advance(self, bucket):
+        first = self._bucket
+        self._close_bucket(self._bucket_packets, self._bucket_bytes)
+        self._bucket_packets = 0
+        self._bucket_bytes = 0
+
+        # Idle buckets: one full window of zeros empties the ring, the rest only decays the EWMA
+        gap = bucket - self._bucket
+        for _ in range(min(gap, self.window_buckets)):
+            self._close_bucket(0, 0)
+        skipped = bucket - self._bucket
+        if skipped > 0:
+            decay = (1 - self.alpha) ** skipped
+            self.ewma_pps *= decay
+            self.ewma_mbps *= decay
+            self.bucket_counts[0] += skipped
+            self._bucket = bucket
+        return first // self.window_buckets != bucket // self.window_buckets
+
+    def percentile_pps(self, percentile):
+        # Per-bucket packet rate at the given percentile of all closed buckets
+        total = sum(self.bucket_counts.values())
+        if not total:
+            return 0.0
+        rank = math.ceil(percentile / 100 * total)
+        seen = 0
+        for packets in sorted(self.bucket_counts):
+            seen += self.bucket_counts[packets]
+            if seen >= rank:
+                return packets / self.bucket_seconds
+        return max(self.bucket_counts) / self.bucket_seconds
@@ -0,0 +1,122 @@
+import bz2
+import glob
+import gzip
+import lzma
+import os
+import queue
+import re
+import shutil
+import threading
+
+import dpkt
+
+from buffered_pcap import RECORD_HEADER, BufferedPcapWriter
+
+# Stdlib codecs for closed segments, keyed by the --compress choice
+COMPRESSORS = {
+    'gzip': ('.gz', gzip.open),
+    'bz2': ('.bz2', bz2.open),
+    'xz': ('.xz', lzma.open),
+}
+OPENERS = {extension: opener for extension, opener in COMPRESSORS.values()}
+
+
+def segment_name(base_path, index):
+    # capture.pcap -> capture_00003.pcap
+    stem, extension = os.path.splitext(base_path)
+    return f"{stem}_{index:05d}{extension or '.pcap'}"
+
+
+def segment_paths(base_path):
+    """Returns the rotated segments of base_path in capture order, compressed or not."""
+    stem, extension = os.path.splitext(base_path)
+    extension = extension or '.pcap'
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r'_(\d+)' + re.escape(extension) + r'(\.gz|\.bz2|\.xz)?$')
+    segments = []
+    for path in glob.glob(glob.escape(stem) + '_*'):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            segments.append((int(match.group(1)), path))
+    return [path for _, path in sorted(segments)]
+
+
+def read_segments(paths):
+    """Streams (timestamp, frame) records from a list of pcap segments as one capture."""
+    for path in paths:
+        opener = OPENERS.get(os.path.splitext(path)[1], open)
+        with opener(path, 'rb') as f:
+            for timestamp, packet in dpkt.pcap.Reader(f):
+                yield timestamp, packet
+
+
+class RotatingPcapWriter:
+    """Ring-buffer pcap output split into numbered segments.
+
+    A new segment starts once the current one exceeds max_bytes or spans
+    max_seconds of capture time. Closed segments go to a background thread
+    that compresses them and deletes the oldest ones beyond `keep`, so the
+    writer itself only ever closes and opens a file.
+    """
+
+    def __init__(self, base_path, max_bytes=None, max_seconds=None, keep=None, compress=None):
+        self.base_path = base_path
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self.compress = compress
+        self.records = 0
+
+        self._index = 0
+        self._closed_segments = []
+        self._pending = queue.Queue()
+        self._worker = threading.Thread(target=self._finish_segments, name="pcap-rotation", daemon=True)
+        self._worker.start()
+        self._open_segment()
+
+    def _open_segment(self):
+        self.current_path = segment_name(self.base_path, self._index)
+        self._writer = BufferedPcapWriter(open(self.current_path, 'wb'))
+        self._segment_bytes = 0
+        self._segment_start = None
+        self._index += 1
+
+    def writepkt(self, pkt, ts=None):
+        if self._segment_start is None:
+            self._segment_start = ts
+        elif ((self.max_bytes and self._segment_bytes >= self.max_bytes)
+              or (self.max_seconds and ts is not None and ts - self._segment_start >= self.max_seconds)):
+            self.rotate()
+            self._segment_start = ts
+
+        self._writer.writepkt(pkt, ts)
+        self._segment_bytes += RECORD_HEADER.size + len(pkt)
+        self.records += 1
+
+    def rotate(self):
+        self._writer.close()
+        self._pending.put((self.current_path, False))
+        self._open_segment()
+
+    def close(self):
+        # Waits for the background thread to compress every closed segment
+        self._writer.close()
+        self._pending.put((self.current_path, True))
+        self._worker.join()
+
+    def _finish_segments(self):
+        while True:
+            path, last = self._pending.get()
+            if self.compress:
+                extension, opener = COMPRESSORS[self.compress]
+                with open(path, 'rb') as source, opener(path + extension, 'wb') as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+                os.remove(path)
+                path += extension
+            self._closed_segments.append(path)
+
+            # While capturing, the open segment counts towards `keep` as well
+            limit = self.keep if last else (self.keep or 0) - 1
+            while self.keep and len(self._closed_segments) > limit:
+                os.remove(self._closed_segments.pop(0))
+            if last:
+                return
@@ -0,0 +1,166 @@
+import heapq
+import math
+
+from flow_report import ENDPOINT_BITS, NO_PORT, PORT_BITS, SORT_FIELDS
+
+MASK64 = (1 << 64) - 1
+
+
+def mix64(key):
+    # splitmix64 finalizer, keys wider than 64 bits are folded in first
+    x = (key ^ (key >> 64) * 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class HyperLogLog:
+    """Distinct count estimator in 2**p one-byte registers.
+
+    p is the smallest precision whose standard error 1.04 / sqrt(2**p) is
+    within `error`, e.g. 16 KiB of registers for 1%. Sketches built with the
+    same error merge exactly by taking the register-wise maximum.
+    """
+
+    def __init__(self, error=0.01):
+        self.p = min(max(math.ceil(math.log2((1.04 / error) ** 2)), 4), 18)
+        self.m = 1 << self.p
+        self.error = 1.04 / math.sqrt(self.m)
+        self.registers = bytearray(self.m)
+        self._shift = 64 - self.p
+        self._rest = (1 << self._shift) - 1
+
+    def add(self, key):
+        x = mix64(key)
+        index = x >> self._shift
+        rank = self._shift - (x & self._rest).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / math.fsum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate while many registers are still empty
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    def merge(self, other):
+        if other.m != self.m:
+            raise ValueError("HyperLogLog sketches of different precision cannot be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class SpaceSaving:
+    """Heaviest keys of a weighted stream in bounded memory (Space-Saving with batched eviction).
+
+    Up to 2 * capacity keys are monitored as [count, error, other]. When the
+    table is full, only the `capacity` largest counts are kept and the largest
+    evicted count becomes the floor new keys start from. A count is never
+    below the key's true total and at most `error` above it. `other` is a
+    second weight counted only while the key is monitored, so it is a lower
+    bound.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self.floor = 0
+        self.total = 0
+
+    def add(self, key, count, other=0):
+        self.total += count
+        counters = self.counters.get(key)
+        if counters is None:
+            if len(self.counters) >= 2 * self.capacity:
+                self._trim()
+            self.counters[key] = [self.floor + count, self.floor, other]
+        else:
+            counters[0] += count
+            counters[2] += other
+
+    def _trim(self):
+        kept = heapq.nlargest(self.capacity, self.counters.items(), key=lambda item: item[1][0])
+        kept_keys = {key for key, _ in kept}
+        evicted = max(counters[0] for key, counters in self.counters.items() if key not in kept_keys)
+        self.floor = max(self.floor, evicted)
+        self.counters = dict(kept)
+
+    def merge(self, other):
+        # Keys missing from one side may have been counted there up to that side's floor
+        for key, counters in self.counters.items():
+            if key not in other.counters:
+                counters[0] += other.floor
+                counters[1] += other.floor
+        for key, (count, error, extra) in other.counters.items():
+            counters = self.counters.get(key)
+            if counters is None:
+                self.counters[key] = [count + self.floor, error + self.floor, extra]
+            else:
+                counters[0] += count
+                counters[1] += error
+                counters[2] += extra
+        self.floor += other.floor
+        self.total += other.total
+        if len(self.counters) > 2 * self.capacity:
+            self._trim()
+
+    def max_error(self):
+        return max((counters[1] for counters in self.counters.values()), default=0)
+
+
+class FlowSketch:
+    """Approximate stand-in for FlowTable when exact per-flow state is too large.
+
+    HyperLogLog estimates the number of distinct directional endpoint pairs
+    and IPv4 hosts. Space-Saving summaries keep the heaviest pairs, sources
+    and destinations by `sort` ('bytes' or 'packets'). Memory is fixed by the
+    error bounds, not by the number of flows, and the packed endpoint keys
+    are the ones the flow reports use.
+    """
+
+    def __init__(self, cardinality_error=0.01, heavy_hitter_error=0.001, sort='bytes'):
+        self.pairs = HyperLogLog(cardinality_error)
+        self.hosts = HyperLogLog(cardinality_error)
+        capacity = math.ceil(1 / heavy_hitter_error)
+        self.top_pairs = SpaceSaving(capacity)
+        self.top_sources = SpaceSaving(capacity)
+        self.top_destinations = SpaceSaving(capacity)
+        self.sort = sort
+
+    def __len__(self):
+        return round(self.pairs.estimate())
+
+    def update(self, proto, src, sport, dst, dport, length, packets=1):
+        src = int.from_bytes(src, 'big')
+        dst = int.from_bytes(dst, 'big')
+        a = src << PORT_BITS | (NO_PORT if sport is None else sport)
+        b = dst << PORT_BITS | (NO_PORT if dport is None else dport)
+        pair = a << ENDPOINT_BITS | b
+        # Keys a summary still monitors were added to the HyperLogLog before, adding them again changes nothing
+        if a not in self.top_sources.counters:
+            self.hosts.add(src)
+        if b not in self.top_destinations.counters:
+            self.hosts.add(dst)
+        if pair not in self.top_pairs.counters:
+            self.pairs.add(pair)
+
+        count, other = (length, packets) if self.sort == 'bytes' else (packets, length)
+        self.top_pairs.add(pair, count, other)
+        self.top_sources.add(a, count, other)
+        self.top_destinations.add(b, count, other)
+
+    def merge(self, other):
+        self.pairs.merge(other.pairs)
+        self.hosts.merge(other.hosts)
+        self.top_pairs.merge(other.top_pairs)
+        self.top_sources.merge(other.top_sources)
+        self.top_destinations.merge(other.top_destinations)
+
+    def totals(self, summary):
+        # key -> [packets, bytes] for the monitored keys of one summary, like the exact report totals
+        if SORT_FIELDS[self.sort] == 1:
+            return {key: [other, count] for key, (count, _, other) in summary.counters.items()}
+        return {key: [count, other] for key, (count, _, other) in summary.counters.items()}
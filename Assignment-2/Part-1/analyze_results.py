@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import json
+import struct
 import matplotlib.pyplot as plt
 import numpy as np
 import subprocess
 from scapy.all import rdpcap, TCP
 import argparse
 
+# Reuse the memory-mapped pcap reader from the Assignment-1 packet sniffer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Assignment-1', 'Packet-Sniffer'))
+from mmap_pcap import MmapPcapReader
+
+# Link-layer header length for the link types tcpdump writes in mininet (Ethernet, raw IP, Linux cooked)
+LINK_HEADER_LEN = {1: 14, 101: 0, 113: 16}
+
 def process_iperf_json(file_path):
     """Process iperf3 JSON output file to extract throughput data"""
     with open(file_path, 'r') as f:
@@ -68,9 +77,67 @@ def process_iperf_json(file_path):
             print(f"Error processing {file_path}: {e}")
             return None
 
+def tcp_windows_mmap(file_path):
+    """Extract (relative time, TCP window) from a classic pcap without building scapy packets.
+
+    Returns None when the file is pcapng or uses a link type this parser does not handle.
+    """
+    try:
+        reader = MmapPcapReader(file_path)
+    except ValueError:
+        return None
+
+    with reader:
+        link_len = LINK_HEADER_LEN.get(reader.linktype)
+        if link_len is None:
+            return None
+
+        times = []
+        window_sizes = []
+        first_time = None
+        for timestamp, frame in reader:
+            if first_time is None:
+                first_time = timestamp
+            if reader.linktype == 101:
+                ip_offset = 0
+            else:
+                # EtherType (or cooked-capture protocol) sits just before the IP header,
+                # Ethernet frames may carry 802.1Q tags in between
+                ip_offset = link_len
+                while reader.linktype == 1 and frame[ip_offset - 2:ip_offset] == b'\x81\x00':
+                    ip_offset += 4
+                if frame[ip_offset - 2:ip_offset] not in (b'\x08\x00', b'\x86\xdd'):
+                    continue
+            if len(frame) <= ip_offset:
+                continue
+
+            version = frame[ip_offset] >> 4
+            if version == 4 and len(frame) >= ip_offset + 20 and frame[ip_offset + 9] == 6:
+                tcp_offset = ip_offset + (frame[ip_offset] & 0x0F) * 4
+            elif version == 6 and len(frame) >= ip_offset + 40 and frame[ip_offset + 6] == 6:
+                tcp_offset = ip_offset + 40
+            else:
+                continue
+            if len(frame) < tcp_offset + 16:
+                continue
+
+            times.append(timestamp - first_time)  # Relative time
+            window_sizes.append(struct.unpack_from('!H', frame, tcp_offset + 14)[0])
+        return times, window_sizes
+
+
 def analyze_pcap(file_path):
     """Analyze pcap file to extract window size data"""
     try:
+        extracted = tcp_windows_mmap(file_path)
+        if extracted is not None:
+            times, window_sizes = extracted
+            return {
+                'times': times,
+                'window_sizes': window_sizes,
+                'max_window_size': max(window_sizes) if window_sizes else 0
+            }
+
         packets = rdpcap(file_path)
         times = []
         window_sizes = []
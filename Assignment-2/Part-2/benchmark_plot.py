@@ -0,0 +1,39 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from connection_tracker import INCOMPLETE_DURATION
+from plot_packets import MAX_SCATTER_POINTS, plot_connections
+
+
+def synthetic_connections(count, seconds=300.0, attack=(60.0, 240.0), seed=0):
+    """(start times, durations, completed) of a SYN flood: legitimate traffic throughout, spoofed SYNs during the attack."""
+    rng = np.random.default_rng(seed)
+    legitimate = max(count // 50, 1)
+    starts = np.concatenate([rng.uniform(0, seconds, legitimate), rng.uniform(*attack, count - legitimate)])
+    completed = np.zeros(count, dtype=bool)
+    completed[:legitimate] = True
+    durations = np.where(completed, rng.exponential(2.0, count), INCOMPLETE_DURATION)
+    order = np.argsort(starts, kind='stable')
+    origin = 1.7e9
+    return starts[order] + origin, durations[order], completed[order], [(origin + attack[0], origin + attack[1])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time plot_packets.py rendering on synthetic SYN flood connections')
+    parser.add_argument('--connections', type=int, default=5000000, help='Number of synthetic connections')
+    parser.add_argument('--budget', type=float, default=10.0, help='Seconds the render may take')
+    parser.add_argument('--output', default='benchmark_plot.png', help='PNG file to write')
+    parser.add_argument('--max-points', type=int, default=MAX_SCATTER_POINTS,
+                        help='Scatter plot threshold, set above --connections to time the per-point path')
+    args = parser.parse_args()
+
+    starts, durations, completed, attacks = synthetic_connections(args.connections)
+    start = time.perf_counter()
+    plot_connections(starts, durations, completed, attacks, args.output, args.max_points)
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {args.connections} connections to {args.output} in {elapsed:.2f} seconds (budget {args.budget:g})")
+    if elapsed > args.budget:
+        sys.exit(1)
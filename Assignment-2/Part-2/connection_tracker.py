@@ -0,0 +1,242 @@
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from flood_detector import ACK, BACKLOG_DELTA, RST, SYN, SYN_ACK, FloodTimeline
+
+# Reuse the memory-mapped pcap reader, header decoder and endpoint packing from the packet sniffer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Assignment-1', 'Packet-Sniffer'))
+from fast_decode import IP_PROTO_TCP, decode_frame
+from flow_report import ENDPOINT_BITS, ENDPOINT_MASK, PORT_BITS, format_endpoint
+from mmap_pcap import GLOBAL_HEADER_LEN, MmapPcapReader, read_pcap
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+MAX_PACKET_SIZE = 1500
+# Duration plotted for connections that never got past the SYN
+INCOMPLETE_DURATION = 100
+# 2**64 / golden ratio, spreads endpoint bits over the high bits of a 64-bit product
+FIBONACCI_HASH = 0x9E3779B97F4A7C15
+
+
+def shard_of(connection, shards):
+    # Both endpoints folded together, so a flood towards one server port still spreads over the shards
+    mixed = ((connection ^ connection >> ENDPOINT_BITS) & ENDPOINT_MASK) * FIBONACCI_HASH & 0xFFFFFFFFFFFFFFFF
+    return mixed * shards >> 64
+
+
+class ConnectionTracker:
+    """TCP connections of a capture, built in one pass without tshark.
+
+    Connections are keyed by their two endpoints whatever direction a
+    packet travels in, packed into one int as in the flow reports. A SYN
+    (re)starts a connection, the SYN-ACK answering it changes nothing, and
+    any later FIN, ACK or RST from either side completes it, the last such
+    packet setting its duration. Frames over `max_packet_size` and TCP that
+    is not over IPv4 are counted as ignored. Every packet updates the state
+    in capture order, so the counts are the same on every run.
+
+    Handshake packets are also counted into `timeline`, with +1 to the
+    half-open backlog when a SYN opens a connection and -1 when its first
+    FIN/ACK/RST arrives.
+
+    A tracker fed only part of a capture also keeps, with `keep_unmatched`,
+    the last FIN/ACK/RST of connections it saw no SYN for, which may
+    complete a connection opened in an earlier part, and the bucket of the
+    first SYN or FIN/ACK/RST of each connection. Taking every connection as
+    closed at the start of the part, the backlog is one too high from there
+    if it was in fact half-open (see merge_shard).
+    """
+
+    def __init__(self, max_packet_size=MAX_PACKET_SIZE, keep_unmatched=False, timeline=None):
+        self.max_packet_size = max_packet_size
+        # Connection -> time of its latest SYN
+        self.start = {}
+        # Connection -> time of its last FIN/ACK/RST after that SYN, absent until one arrives
+        self.end = {}
+        # Connection -> time of its last FIN/ACK/RST, for connections without a SYN so far
+        self.unmatched = {} if keep_unmatched else None
+        # Connection -> bucket of its first SYN or FIN/ACK/RST, for connections with their state unknown
+        self.first_event = {} if keep_unmatched else None
+        self.timeline = FloodTimeline() if timeline is None else timeline
+        self.packets = 0
+        self.ignored_packets = 0
+
+    def add(self, timestamp, frame):
+        decoded = decode_frame(frame)
+        if decoded is None or decoded[1] != IP_PROTO_TCP:
+            return
+        self.packets += 1
+        version, _, src, dst, sport, dport, flags, _ = decoded
+        if version != 4 or flags is None or len(frame) > self.max_packet_size:
+            self.ignored_packets += 1
+            return
+
+        a = int.from_bytes(src, 'big') << PORT_BITS | sport
+        b = int.from_bytes(dst, 'big') << PORT_BITS | dport
+        connection = a << ENDPOINT_BITS | b if a <= b else b << ENDPOINT_BITS | a
+        timeline = self.timeline
+        row = timeline.current if timeline.low <= timestamp < timeline.high else timeline.row(timestamp)
+        if flags & TCP_SYN:
+            if flags & TCP_ACK:
+                row[SYN_ACK] += 1
+                return
+            row[SYN] += 1
+            if self.first_event is not None:
+                self._first_event(connection, timestamp)
+            # A retransmitted SYN leaves a half-open connection half-open
+            if connection not in self.start or connection in self.end:
+                row[BACKLOG_DELTA] += 1
+            self.start[connection] = timestamp
+            self.end.pop(connection, None)
+            if self.unmatched is not None:
+                self.unmatched.pop(connection, None)
+            return
+        if flags & TCP_RST:
+            row[RST] += 1
+        elif flags & TCP_ACK:
+            row[ACK] += 1
+        if flags & (TCP_FIN | TCP_ACK | TCP_RST):
+            if self.first_event is not None:
+                self._first_event(connection, timestamp)
+            if connection in self.start:
+                if connection not in self.end:
+                    row[BACKLOG_DELTA] -= 1
+                self.end[connection] = timestamp
+            elif self.unmatched is not None:
+                self.unmatched[connection] = timestamp
+
+    def _first_event(self, connection, timestamp):
+        if connection not in self.start and connection not in self.unmatched:
+            self.first_event[connection] = self.timeline.index(timestamp)
+
+    @classmethod
+    def from_pcap(cls, path, **settings):
+        tracker = cls(**settings)
+        for timestamp, frame in read_pcap(path):
+            tracker.add(timestamp, frame)
+        return tracker
+
+    @property
+    def completed_connections(self):
+        return len(self.end)
+
+    @property
+    def incomplete_connections(self):
+        return len(self.start) - len(self.end)
+
+    def shard(self, shards):
+        """Splits the state into `shards` trackers, each connection going to shard_of(connection)."""
+        parts = [ConnectionTracker(self.max_packet_size, self.unmatched is not None) for _ in range(shards)]
+        for name in ('start', 'end', 'unmatched', 'first_event'):
+            table = getattr(self, name)
+            for connection, timestamp in (table or {}).items():
+                getattr(parts[shard_of(connection, shards)], name)[connection] = timestamp
+        return parts
+
+    def connections(self):
+        """Returns (start times, durations, completed) arrays ordered by start time.
+
+        Incomplete connections get INCOMPLETE_DURATION, as in the plots.
+        """
+        starts = np.fromiter(self.start.values(), dtype=np.float64, count=len(self.start))
+        completed = np.fromiter((connection in self.end for connection in self.start), dtype=bool,
+                                count=len(self.start))
+        ends = np.fromiter((self.end.get(connection, 0.0) for connection in self.start), dtype=np.float64,
+                           count=len(self.start))
+        durations = np.where(completed, ends - starts, INCOMPLETE_DURATION)
+        order = np.argsort(starts, kind='stable')
+        return starts[order], durations[order], completed[order]
+
+
+def track_chunk(path, start, end, chunk, shards, directory, max_packet_size, bucket, origin):
+    """Worker entry point: tracks the records of the byte range [start, end) and saves one file per shard."""
+    tracker = ConnectionTracker(max_packet_size, keep_unmatched=start > GLOBAL_HEADER_LEN,
+                                timeline=FloodTimeline(bucket, origin))
+    with MmapPcapReader(path) as reader:
+        for timestamp, frame in reader.records(start, end):
+            tracker.add(timestamp, frame)
+    for shard, part in enumerate(tracker.shard(shards)):
+        with open(os.path.join(directory, f"{chunk}-{shard}.pickle"), 'wb') as f:
+            pickle.dump((part.start, part.end, part.unmatched, part.first_event), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return tracker.packets, tracker.ignored_packets, tracker.timeline
+
+
+def merge_shard(directory, shard, chunks):
+    """Worker entry point: folds the chunk files of one shard, in file order, into the state a serial pass ends with.
+
+    A SYN in a later chunk restarts the connection, and the completions a
+    chunk saw before any SYN apply to connections opened in earlier chunks.
+    Returns the connection arrays and {bucket: backlog correction} for the
+    connections a chunk took as closed that were still half-open.
+    """
+    merged = ConnectionTracker()
+    corrections = {}
+    for chunk in range(chunks):
+        path = os.path.join(directory, f"{chunk}-{shard}.pickle")
+        with open(path, 'rb') as f:
+            start, end, unmatched, first_event = pickle.load(f)
+        os.remove(path)
+        for connection, index in (first_event or {}).items():
+            if connection in merged.start and connection not in merged.end:
+                corrections[index] = corrections.get(index, 0) - 1
+        for connection, timestamp in (unmatched or {}).items():
+            if connection in merged.start:
+                merged.end[connection] = timestamp
+        for connection in start:
+            merged.end.pop(connection, None)
+        merged.start.update(start)
+        merged.end.update(end)
+    return merged.connections() + (corrections,)
+
+
+def track_connections(path, workers=1, max_packet_size=MAX_PACKET_SIZE, bucket=1.0):
+    """Returns (packets, ignored packets, start times, durations, completed, timeline) for a capture.
+
+    With several workers the capture is split into one byte range per
+    worker, each tracked in its own process and its connections written out
+    in `workers` shards by hash. One process per shard then merges that
+    shard across the ranges, so every connection is merged by a single
+    worker and no process holds more than its share of the table.
+    """
+    if workers > 1:
+        try:
+            with MmapPcapReader(path) as reader:
+                ranges = reader.split(workers)
+                # Every worker buckets from the first packet, so their timelines line up
+                origin = next(reader.records(), (None,))[0]
+        except (ValueError, OSError) as e:
+            # pcapng, compressed or rotated captures cannot be memory-mapped and split, read_pcap streams
+            # them in one process like the sniffer's --read does
+            print(f"{e}, falling back to a single process")
+        else:
+            with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(workers) as pool:
+                counts = list(pool.map(track_chunk, repeat(path), *zip(*ranges), range(len(ranges)),
+                                       repeat(workers), repeat(directory), repeat(max_packet_size),
+                                       repeat(bucket), repeat(origin)))
+                shards = list(pool.map(merge_shard, repeat(directory), range(workers), repeat(len(ranges))))
+            timeline = FloodTimeline(bucket, origin)
+            for count in counts:
+                timeline.merge(count[2])
+            for *_, corrections in shards:
+                for index, delta in corrections.items():
+                    timeline.add_backlog(index, delta)
+            starts, durations, completed = (np.concatenate(arrays) for arrays in list(zip(*shards))[:3])
+            order = np.argsort(starts, kind='stable')
+            return (sum(count[0] for count in counts), sum(count[1] for count in counts),
+                    starts[order], durations[order], completed[order], timeline)
+
+    tracker = ConnectionTracker.from_pcap(path, max_packet_size=max_packet_size, timeline=FloodTimeline(bucket))
+    return (tracker.packets, tracker.ignored_packets) + tracker.connections() + (tracker.timeline,)
+
+
+def format_connection(connection):
+    return f"{format_endpoint(connection >> ENDPOINT_BITS)} <-> {format_endpoint(connection & ENDPOINT_MASK)}"
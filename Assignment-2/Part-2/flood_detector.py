@@ -0,0 +1,179 @@
+import argparse
+import math
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+# Per-bucket counters, in row order
+SYN, SYN_ACK, ACK, RST, BACKLOG_DELTA = range(5)
+COUNTERS = ('syn', 'syn_ack', 'ack', 'rst')
+
+
+class FloodTimeline:
+    """TCP handshake counters in fixed time buckets, grown as the capture goes on.
+
+    Each bucket counts SYNs, SYN-ACKs, other ACKs and RSTs, and the change
+    in half-open connections, which ConnectionTracker reports as it opens
+    and completes them. Bucket i covers [origin + i * bucket, origin +
+    (i + 1) * bucket), origin defaulting to the first packet. Timelines of
+    different parts of a capture with the same origin add up bucket by
+    bucket with merge().
+    """
+
+    def __init__(self, bucket=1.0, origin=None):
+        self.bucket = bucket
+        self.origin = origin
+        self.rows = []
+        # Row of the bucket [low, high) packets last fell in, most packets reuse it without any arithmetic
+        self.low = self.high = 0.0
+        self.current = None
+
+    def index(self, timestamp):
+        if self.origin is None:
+            self.origin = timestamp
+        # Slightly out-of-order timestamps before the origin land in the first bucket
+        return max(int((timestamp - self.origin) // self.bucket), 0)
+
+    def row(self, timestamp):
+        if self.low <= timestamp < self.high:
+            return self.current
+        index = self.index(timestamp)
+        rows = self.rows
+        while len(rows) <= index:
+            rows.append([0, 0, 0, 0, 0])
+        self.low = self.origin + index * self.bucket
+        self.high = self.low + self.bucket
+        self.current = rows[index]
+        return self.current
+
+    def add_backlog(self, index, delta):
+        while len(self.rows) <= index:
+            self.rows.append([0, 0, 0, 0, 0])
+        self.rows[index][BACKLOG_DELTA] += delta
+
+    def merge(self, other):
+        for index, row in enumerate(other.rows):
+            self.add_backlog(index, 0)
+            mine = self.rows[index]
+            for column, value in enumerate(row):
+                mine[column] += value
+
+    def arrays(self):
+        """Returns {'syn', 'syn_ack', 'ack', 'rst', 'backlog'} arrays, backlog as of the end of each bucket."""
+        table = np.array(self.rows, dtype=np.int64).reshape(-1, 5)
+        series = {name: table[:, column] for column, name in enumerate(COUNTERS)}
+        series['backlog'] = np.cumsum(table[:, BACKLOG_DELTA])
+        return series
+
+
+def detect_attacks(syn, alpha=0.1, threshold=4.0, min_rise=10, hold=3):
+    """Returns [(first bucket, last bucket)] of SYN floods in a series of per-bucket SYN counts.
+
+    An EWMA of the SYN count and of its variance learns the normal rate. A
+    bucket more than `threshold` standard deviations (and at least
+    `min_rise` SYNs) above it starts an attack, and the attack ends after
+    `hold` buckets back under that limit. The baseline is frozen during an
+    attack so the flood never becomes the new normal, and each bucket is
+    looked at once, so the detector can run as buckets complete.
+    """
+    windows = []
+    mean = variance = None
+    first = last = None
+    quiet = 0
+    for index, count in enumerate(syn):
+        if mean is None:
+            mean, variance = float(count), 0.0
+            continue
+        limit = mean + max(threshold * math.sqrt(variance), min_rise)
+        if count > limit:
+            if first is None:
+                first = index
+            last = index
+            quiet = 0
+            continue
+        if first is not None:
+            quiet += 1
+            if quiet < hold:
+                continue
+            windows.append((first, last))
+            first = None
+        deviation = count - mean
+        mean += alpha * deviation
+        variance = (1 - alpha) * (variance + alpha * deviation * deviation)
+    if first is not None:
+        windows.append((first, last))
+    return windows
+
+
+def attack_times(timeline, windows):
+    # Bucket windows -> (start, end) timestamps, the end being that of the last flooded bucket
+    return [(timeline.origin + first * timeline.bucket, timeline.origin + (last + 1) * timeline.bucket)
+            for first, last in windows]
+
+
+def save_timeline(path, timeline, **detector):
+    """Saves the timeline arrays and the detected attack windows to an .npz file."""
+    series = timeline.arrays()
+    attacks = attack_times(timeline, detect_attacks(series['syn'], **detector))
+    np.savez_compressed(path, origin=timeline.origin, bucket=timeline.bucket,
+                        attacks=np.array(attacks, dtype=np.float64).reshape(-1, 2), **series)
+    return attacks
+
+
+def plot_timeline(series, path=None):
+    """Plots saved timeline arrays (a dict or np.load result) against time."""
+    times = series['origin'] + np.arange(len(series['syn'])) * series['bucket']
+    figure, (rates, backlog) = plt.subplots(2, 1, sharex=True, figsize=(10, 6))
+    for name in COUNTERS:
+        rates.step(times, series[name], where='post', label=name.upper().replace('_', '-'))
+    backlog.step(times, series['backlog'], where='post', color='r')
+    for start, end in series['attacks']:
+        for axes in (rates, backlog):
+            axes.axvspan(start, end, color='orange', alpha=0.2)
+    rates.set_ylabel(f"Packets per {float(series['bucket']):g}s")
+    rates.legend()
+    rates.grid(True)
+    backlog.set_ylabel("Half-open connections")
+    backlog.set_xlabel("Capture time (epoch seconds)")
+    backlog.grid(True)
+    rates.set_title("SYN flood timeline")
+    if path:
+        figure.savefig(path)
+    else:
+        plt.show()
+
+
+if __name__ == "__main__":
+    from connection_tracker import track_connections
+
+    parser = argparse.ArgumentParser(description='Bucket a capture into a SYN flood timeline and detect attacks')
+    parser.add_argument('input', help='pcap/pcapng file (compressed or rotated included) to analyze, or a saved .npz timeline to plot')
+    parser.add_argument('-o', '--output', help='Save the timeline arrays to this .npz file')
+    parser.add_argument('-b', '--bucket', type=float, default=1.0, help='Bucket width in seconds')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Processes to track connections with')
+    parser.add_argument('--threshold', type=float, default=4.0, help='Standard deviations above the EWMA that start an attack')
+    parser.add_argument('--plot', nargs='?', const='', help='Plot the timeline, to a PNG file when one is given')
+    args = parser.parse_args()
+
+    if args.input.endswith('.npz'):
+        plot_timeline(np.load(args.input), args.plot)
+        raise SystemExit
+
+    start = time.perf_counter()
+    timeline = track_connections(args.input, args.workers, bucket=args.bucket)[5]
+    series = timeline.arrays()
+    attacks = attack_times(timeline, detect_attacks(series['syn'], threshold=args.threshold))
+    print(f"Bucketed {len(series['syn'])} x {args.bucket:g}s in {time.perf_counter() - start:.2f} seconds")
+    for first, last in attacks:
+        print(f"SYN flood from {time.strftime('%H:%M:%S', time.localtime(first))} "
+              f"to {time.strftime('%H:%M:%S', time.localtime(last))} ({last - first:.1f} s)")
+    if not attacks:
+        print("No SYN flood detected")
+    print(f"Peak half-open backlog: {series['backlog'].max(initial=0)}")
+
+    if args.output:
+        save_timeline(args.output, timeline, threshold=args.threshold)
+    if args.plot is not None:
+        series.update(origin=timeline.origin, bucket=timeline.bucket, attacks=attacks)
+        plot_timeline(series, args.plot)
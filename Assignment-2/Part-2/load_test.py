@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MESSAGE = b"This is a TCP packet"
+
+
+async def echo_once(host, port, timeout):
+    # Seconds for one connect, message and echo, as client_side.py does it
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(MESSAGE)
+        await asyncio.wait_for(reader.readexactly(len(MESSAGE)), timeout)
+    finally:
+        writer.close()
+    return time.perf_counter() - start
+
+
+async def client(host, port, deadline, timeout, latencies, failures):
+    while time.perf_counter() < deadline:
+        try:
+            latencies.append(await echo_once(host, port, timeout))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            failures.append(1)
+
+
+async def hold_idle(host, port, count):
+    # Connected clients that never send anything, like a stalled or malicious peer
+    connections = []
+    for _ in range(count):
+        try:
+            connections.append(await asyncio.wait_for(asyncio.open_connection(host, port), 2.0))
+        except (OSError, asyncio.TimeoutError):
+            break
+    return connections
+
+
+async def run_load(host, port, clients, idle, duration, timeout):
+    """Returns (echo latencies, failures, idle connections held, seconds) of one load run."""
+    held = await hold_idle(host, port, idle)
+    latencies, failures = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, start + duration, timeout, latencies, failures)
+                           for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    for _, writer in held:
+        writer.close()
+    return latencies, len(failures), len(held), elapsed
+
+
+def start_server(mode, port, timeout):
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server_side.py'),
+                               '--mode', mode, '--host', '127.0.0.1', '--port', str(port),
+                               '--timeout', str(timeout), '--skip-sysctl'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait until it listens
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare echo servers: connection rate and latency under concurrent load')
+    parser.add_argument('--modes', nargs='+', choices=('events', 'blocking'), default=['blocking', 'events'])
+    parser.add_argument('--port', type=int, default=9080, help='First port, each mode gets the next one')
+    parser.add_argument('--clients', type=int, default=100, help='Concurrent clients reconnecting in a loop')
+    parser.add_argument('--idle', type=int, default=1000, help='Idle connections held open during the run')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds of load per server')
+    parser.add_argument('--timeout', type=float, default=2.0, help='Seconds before a client gives up on an echo')
+    parser.add_argument('--server-timeout', type=float, default=30.0, help='Idle timeout of the event-driven server')
+    args = parser.parse_args()
+
+    # Every idle and active connection is a descriptor here and in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{args.clients} clients for {args.duration:g}s with {args.idle} idle connections held open")
+    for offset, mode in enumerate(args.modes):
+        server = start_server(mode, args.port + offset, args.server_timeout)
+        try:
+            latencies, failures, held, elapsed = asyncio.run(
+                run_load('127.0.0.1', args.port + offset, args.clients, args.idle, args.duration, args.timeout))
+        finally:
+            server.terminate()
+            server.wait()
+        line = f"{mode:>8}: {len(latencies) / elapsed:8.0f} connections/s, {failures} failed, {held} idle held"
+        if latencies:
+            p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+            line += f", latency p50 {p50:.2f} ms p90 {p90:.2f} ms p99 {p99:.2f} ms max {max(latencies) * 1000:.2f} ms"
+        print(line)
@@ -1,106 +1,107 @@
-import pyshark
-import matplotlib.pyplot as plt
+import argparse
 import datetime
+import os
+import time
+
+import matplotlib
+matplotlib.use('Agg')  # Plots are written to PNG, no display needed
+import matplotlib.pyplot as plt
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
-
-pcap_file = 'client_traffic.pcap'
-
-connection_start_times = {}
-connection_durations = {}
-packet_colors = {}
-
-syn_only_connections = 0
-completed_connections = 0
-ignored_packets = 0
-
-MAX_PACKET_SIZE = 1500  
-
-def process_packet(packet):
-    global ignored_packets, completed_connections
-
-    try:
-        if 'TCP' not in packet or not hasattr(packet, 'length') or int(packet.length) > MAX_PACKET_SIZE:
-            ignored_packets += 1
-            return
-
-        src_ip = packet.ip.src
-        dest_ip = packet.ip.dst
-        src_port = packet.tcp.srcport
-        dest_port = packet.tcp.dstport
-        tcp_flags = int(packet.tcp.flags, 16)
-        sniff_timestamp = float(packet.sniff_timestamp)
-
-        connection_id = (src_ip, src_port, dest_ip, dest_port)
-
-        if tcp_flags & 0x02:
-            connection_start_times[connection_id] = sniff_timestamp
-            connection_durations[connection_id] = 100  
-            packet_colors[connection_id] = 'red'  
-
-        elif (tcp_flags & 0x11) or (tcp_flags & 0x04):  
-            if connection_id in connection_start_times:
-                start_time = connection_start_times[connection_id]
-                connection_durations[connection_id] = sniff_timestamp - start_time
-                completed_connections += 1
-                packet_colors[connection_id] = 'blue'
-
-    except Exception:
-        ignored_packets += 1
-
-
-def process_pcap():
-    global packets
-    try:
-        packets = pyshark.FileCapture(pcap_file, display_filter="tcp")
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            executor.map(process_packet, packets)
-    except pyshark.capture.capture.TSharkCrashException as e:
-        print("[Warning] TShark crashed! Retrying with debug mode...")
-        packets.close()
-        packets = pyshark.FileCapture(pcap_file, display_filter="tcp")
-        packets.set_debug()  # Enable debug mode to see more details
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            executor.map(process_packet, packets)
-    finally:
-        packets.close()
-
-
-process_pcap()
-
-syn_only_connections = sum(1 for d in connection_durations.values() if d == 100)
-
-print(f"Total SYN packets: {len(connection_start_times)}")
-print(f"Completed Connections: {completed_connections}")
-print(f"Incomplete Connections: {syn_only_connections}")
-print(f"Ignored Packets: {ignored_packets}")
-
-start_times = np.array([datetime.datetime.fromtimestamp(t) for t in connection_start_times.values()])
-durations = np.array(list(connection_durations.values()))
-colors = np.array([packet_colors[conn_id] for conn_id in connection_start_times.keys()])
-
-sorted_indices = np.argsort(start_times)
-start_times, durations, colors = start_times[sorted_indices], durations[sorted_indices], colors[sorted_indices]
-
-# Identify attack start and end based on first and last red dot
-red_dot_indices = np.where(colors == 'red')[0]
-
-if len(red_dot_indices) > 0:
-    attack_start_time = start_times[red_dot_indices[0]]
-    attack_end_time = start_times[red_dot_indices[-1]]
-else:
-    attack_start_time = start_times[0] + datetime.timedelta(seconds=20)
-    attack_end_time = start_times[0] + datetime.timedelta(seconds=100)
-
-plt.figure(figsize=(10, 6))
-plt.scatter(start_times, durations, c=colors, alpha=0.7)
-
-plt.axvline(attack_start_time, color='r', linestyle='dashed', label="Attack Start")
-plt.axvline(attack_end_time, color='g', linestyle='dashed', label="Attack End")
-plt.xlabel("Start Time")
-plt.ylabel("Connection Duration (seconds)")
-plt.title("TCP Connection Duration vs. Start Time")
-plt.xticks(rotation=45)
-plt.legend(["TCP Connections", "Attack Start", "Attack End"])
-plt.grid(True)
-plt.show()
+from matplotlib.colors import ListedColormap, LogNorm
+
+from connection_tracker import track_connections
+from flood_detector import attack_times, detect_attacks, save_timeline
+
+# Above this many connections, points are binned into a density image instead of drawn one by one
+MAX_SCATTER_POINTS = 50000
+# Density image resolution, (time bins, duration bins), a few pixels per cell so single connections stay visible
+DENSITY_BINS = (400, 120)
+
+
+def bin_counts(x, y, extent, bins=DENSITY_BINS):
+    """Counts points per cell of a bins[0] x bins[1] grid over extent ((x0, x1), (y0, y1)).
+
+    Cell indices come from one multiply per point and np.bincount, far
+    cheaper than np.histogram2d's sorted bin search on millions of points.
+    """
+    (x0, x1), (y0, y1) = extent
+    columns, rows = bins
+    ix = np.clip(((x - x0) * (columns / (x1 - x0))).astype(np.intp), 0, columns - 1)
+    iy = np.clip(((y - y0) * (rows / (y1 - y0))).astype(np.intp), 0, rows - 1)
+    return np.bincount(iy * columns + ix, minlength=rows * columns).reshape(rows, columns)
+
+
+def plot_connections(starts, durations, completed, attacks, path, max_points=MAX_SCATTER_POINTS):
+    """Writes connection duration against start time to a PNG, with the detected attack windows.
+
+    Times are epoch seconds, plotted as seconds since the first connection.
+    Up to `max_points` connections are drawn as a scatter plot, more are
+    binned per pixel-sized cell and drawn as one log-scaled image per class,
+    so the cost of drawing does not grow with the number of connections.
+    """
+    origin = starts[0]
+    x = starts - origin
+    figure, axes = plt.subplots(figsize=(10, 6))
+
+    if len(starts) <= max_points:
+        axes.scatter(x, durations, c=np.where(completed, 'blue', 'red'), alpha=0.7, label="TCP Connections")
+    else:
+        extent = ((0.0, max(x[-1], 1e-9)), (0.0, max(durations.max(), 1.0) * 1.02))
+        for mask, cmap, label in ((~completed, 'Reds', "Incomplete connections"),
+                                  (completed, 'Blues', "Completed connections")):
+            counts = np.ma.masked_equal(bin_counts(x[mask], durations[mask], extent), 0)
+            if counts.count():
+                # The pale end of the map is dropped, so a lone connection does not vanish into the background
+                colors = ListedColormap(plt.get_cmap(cmap)(np.linspace(0.4, 1.0, 256)))
+                axes.imshow(counts, origin='lower', aspect='auto', extent=(*extent[0], *extent[1]),
+                            cmap=colors, norm=LogNorm(vmin=1, vmax=max(counts.max(), 2)), interpolation='nearest')
+                axes.plot([], [], 's', color=colors(0.7), label=f"{label} (log density)")
+
+    for index, (first, last) in enumerate(attacks):
+        axes.axvline(first - origin, color='r', linestyle='dashed', label="Attack Start" if index == 0 else None)
+        axes.axvline(last - origin, color='g', linestyle='dashed', label="Attack End" if index == 0 else None)
+
+    axes.set_xlabel(f"Start Time (seconds after {datetime.datetime.fromtimestamp(origin):%Y-%m-%d %H:%M:%S})")
+    axes.set_ylabel("Connection Duration (seconds)")
+    axes.set_title("TCP Connection Duration vs. Start Time")
+    axes.legend()
+    axes.grid(True)
+    figure.savefig(path)
+    plt.close(figure)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plot TCP connection durations against their start time')
+    parser.add_argument('pcap', nargs='?', default='client_traffic.pcap', help='pcap/pcapng file to analyze, compressed or rotated captures included')
+    parser.add_argument('-o', '--output', help='PNG file to write (default: the capture name with .png)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Processes to track connections with, sharded by connection hash (classic pcap only)')
+    parser.add_argument('--timeline', help='Also save the bucketed SYN flood timeline to this .npz file')
+    parser.add_argument('--max-points', type=int, default=MAX_SCATTER_POINTS,
+                        help='Largest number of connections drawn as a scatter plot before switching to density')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    packets, ignored_packets, timestamps, durations, completed, timeline = track_connections(args.pcap, args.workers)
+    print(f"Processed {packets} TCP packets in {time.perf_counter() - start:.2f} seconds")
+
+    print(f"Total SYN packets: {len(timestamps)}")
+    print(f"Completed Connections: {np.count_nonzero(completed)}")
+    print(f"Incomplete Connections: {len(completed) - np.count_nonzero(completed)}")
+    print(f"Ignored Packets: {ignored_packets}")
+
+    # Attack windows come from the SYN rate per second, not from where the red dots happen to fall
+    if args.timeline:
+        attacks = save_timeline(args.timeline, timeline)
+    else:
+        attacks = attack_times(timeline, detect_attacks(timeline.arrays()['syn']))
+    for first, last in attacks:
+        print(f"SYN flood detected: {datetime.datetime.fromtimestamp(first)} to {datetime.datetime.fromtimestamp(last)}")
+
+    if len(timestamps) == 0:
+        print("No connections to plot")
+    else:
+        output = args.output or os.path.splitext(os.path.basename(args.pcap))[0] + '.png'
+        start = time.perf_counter()
+        plot_connections(timestamps, durations, completed, attacks, output, args.max_points)
+        print(f"Plot saved to {output} in {time.perf_counter() - start:.2f} seconds")
@@ -1,5 +1,9 @@
+import argparse
+import selectors
 import socket
 import subprocess
+import time
+from collections import OrderedDict
 
 class Server:
     def __init__(self, host='0.0.0.0', port=8080):
@@ -35,12 +39,151 @@ class Server:
         except KeyboardInterrupt:
             print("Shutting down server...")
 
+class EventServer(Server):
+    """Echo server multiplexing every connection over one selector (epoll on Linux).
+
+    A slow or silent client costs an idle entry instead of holding up the
+    accept loop. Connections without traffic for `timeout` seconds are
+    closed; they are kept in an OrderedDict by last activity, so the sweep
+    only looks at the oldest. While a client does not read its echoes, its
+    connection stops being read too, so unsent data stays bounded.
+    """
+
+    def __init__(self, host='0.0.0.0', port=8080, timeout=10.0, backlog=4096):
+        super().__init__(host, port)
+        self.timeout = timeout
+        self.backlog = backlog
+        self.selector = selectors.DefaultSelector()
+        # Connection -> monotonic time of its last traffic, least recently active first
+        self.connections = OrderedDict()
+        # Connection -> echo bytes the socket buffer did not take yet
+        self.unsent = {}
+        self.accepted = 0
+        self.timed_out = 0
+
+    def start_server(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(self.backlog)
+        server.setblocking(False)
+        self.selector.register(server, selectors.EVENT_READ)
+        print(f"Server listening on {self.host}:{self.port} (event loop, {self.timeout:g}s idle timeout)")
+
+        try:
+            self.handle_events(server)
+        except KeyboardInterrupt:
+            print("Shutting down server...")
+        finally:
+            for conn in list(self.connections):
+                self.close(conn)
+            self.selector.close()
+            server.close()
+            print(f"Accepted {self.accepted} connections, closed {self.timed_out} idle ones")
+
+    def handle_events(self, server):
+        while True:
+            # Wake up at least once a second to close idle connections
+            for key, mask in self.selector.select(timeout=min(self.timeout, 1.0)):
+                if key.fileobj is server:
+                    self.accept(server)
+                elif mask & selectors.EVENT_WRITE:
+                    self.flush(key.fileobj)
+                else:
+                    self.echo(key.fileobj)
+            self.expire(time.monotonic() - self.timeout)
+
+    def accept(self, server):
+        # Take a batch per wakeup, a connection burst then needs far fewer select() calls
+        now = time.monotonic()
+        for _ in range(64):
+            try:
+                conn, _ = server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Out of descriptors or the client reset before accept, the listener itself is fine
+                return
+            conn.setblocking(False)
+            self.selector.register(conn, selectors.EVENT_READ)
+            self.connections[conn] = now
+            self.accepted += 1
+
+    def echo(self, conn):
+        try:
+            message = conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            message = b''
+        if not message:
+            self.close(conn)
+            return
+        self.touch(conn)
+        try:
+            sent = conn.send(message)  # Echo back the message
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self.close(conn)
+            return
+        if sent < len(message):
+            self.unsent[conn] = message[sent:]
+            self.selector.modify(conn, selectors.EVENT_WRITE)
+
+    def flush(self, conn):
+        try:
+            sent = conn.send(self.unsent[conn])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(conn)
+            return
+        self.touch(conn)
+        remaining = self.unsent[conn][sent:]
+        if remaining:
+            self.unsent[conn] = remaining
+        else:
+            del self.unsent[conn]
+            self.selector.modify(conn, selectors.EVENT_READ)
+
+    def touch(self, conn):
+        self.connections[conn] = time.monotonic()
+        self.connections.move_to_end(conn)
+
+    def expire(self, cutoff):
+        while self.connections:
+            conn, last = next(iter(self.connections.items()))
+            if last > cutoff:
+                return
+            self.close(conn)
+            self.timed_out += 1
+
+    def close(self, conn):
+        self.selector.unregister(conn)
+        del self.connections[conn]
+        self.unsent.pop(conn, None)
+        conn.close()
+
 def set_kernel_parameters():
     subprocess.run(['sudo', 'sysctl', '-w', 'net.ipv4.tcp_max_syn_backlog=2048'])
     subprocess.run(['sudo', 'sysctl', '-w', 'net.ipv4.tcp_syncookies=1'])
     subprocess.run(['sudo', 'sysctl', '-w', 'net.ipv4.tcp_synack_retries=2'])
 
 if __name__ == "__main__":
-    set_kernel_parameters()
-    server = Server()
+    parser = argparse.ArgumentParser(description='TCP echo server for the SYN flood experiments')
+    parser.add_argument('--mode', choices=('blocking', 'events'), default='blocking',
+                        help='Serve one connection at a time, or all of them from one event loop')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Seconds before an idle connection is closed (events mode)')
+    parser.add_argument('--skip-sysctl', action='store_true', help='Leave the SYN backlog/cookie kernel settings alone')
+    args = parser.parse_args()
+
+    if not args.skip_sysctl:
+        set_kernel_parameters()
+    if args.mode == 'events':
+        server = EventServer(args.host, args.port, args.timeout)
+    else:
+        server = Server(args.host, args.port)
     server.start_server()